@@ -0,0 +1,490 @@
+#!/usr/local/bin/python
+"""
+A local stand-in for the CRITs API that is used by the benchmarks.
+
+It implements the parts of the /ips/, /domains/ and /campaigns/ endpoints that
+libs2.crits.crits relies on:
+  GET    -- Lists objects with c-<field> filters (c-ip, c-domain, c-name, c-campaign.name,
+            c-source.name, c-modified__gte), limit and offset, and returns meta.total_count.
+            only=<field>,<field> returns just those fields of each object, as CRITs does.
+            GET <kind>/<id>/ returns a single object.
+  POST   -- Adds an object. Adding an IP or domain that exists merges the campaign and source
+            into it, as CRITs does. Adding a campaign that exists returns return_code 1.
+  PATCH  -- Removes a source from an IP or domain, or removes an IP or domain from a campaign.
+  DELETE -- Deletes an object.
+
+Every response can be delayed (--latency, --jitter), and a fraction of requests can fail
+with an HTTP error (--error_rate, --error_status) or have their connection dropped (--reset_rate).
+Injected errors can ask the client to wait before retrying (--retry_after).
+
+Example:
+  ./benchmarks/fake_crits.py --port 8080 --latency 0.02 --error_rate 0.01
+  ./os_list_update.py -a http://127.0.0.1:8080/api/v1/ -u user -k key --get_campaign_list
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import BaseHTTPServer
+import SocketServer
+import itertools
+import json
+import os.path
+import random
+import sys
+import threading
+import time
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import json_pages
+
+
+#The field that holds the value of each kind of object
+VALUE_FIELDS = {'ips' : 'ip', 'domains' : 'domain', 'campaigns' : 'name'}
+
+
+
+class FakeCritsStore:
+  """
+  The objects held by the fake server, indexed by value and by campaign.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.ids = itertools.count(1)
+    self.objects = dict((kind, {}) for kind in VALUE_FIELDS)
+    self.by_value = dict((kind, {}) for kind in VALUE_FIELDS)
+    self.members = {'ips' : {}, 'domains' : {}}
+    self.listings = {}
+
+
+
+  def _new_id(self):
+    return '%024x' % next(self.ids)
+
+
+
+  def _modified(self):
+    now = time.time()
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now)) + ('%.6f' % (now % 1))[1:]
+
+
+
+  def _changed(self,kind,campaign=None):
+    """
+    Forgets the cached listings that a change to kind (and campaign) makes stale.
+    """
+    for key in self.listings.keys():
+      if key[0] == kind and (campaign == None or key[1] == None or key[1] == campaign):
+        del self.listings[key]
+
+
+
+  def seed(self,kind,values,campaign,source,extra=None):
+    """
+    Adds values directly to the store without going through HTTP.
+
+    :param kind: 'ips' or 'domains'.
+    :type kind: str
+    :param values: The IPs or domains.
+    :type values: iterable of str
+    :param campaign: The campaign name. It is created if needed.
+    :type campaign: str
+    :param source: The source name.
+    :type source: str
+    :param extra: Fields added to every object (e.g. {'type' : 'Address - ipv4-addr'}).
+    :type extra: dict
+    :returns: int The number of values added.
+    """
+    with self.lock:
+      if campaign not in self.by_value['campaigns']:
+        self._add_locked('campaigns', {'name' : campaign, 'description' : 'seeded'})
+      count = 0
+      for value in values:
+        fields = dict(extra or {})
+        fields.update({VALUE_FIELDS[kind] : value, 'campaign' : campaign, 'source' : source})
+        obj = self.objects[kind][self._add_locked(kind, fields)['id']]
+        for field, field_value in (extra or {}).items():
+          obj.setdefault(field, field_value)
+        count += 1
+      return count
+
+
+
+  def add(self,kind,fields):
+    with self.lock:
+      return self._add_locked(kind, fields)
+
+
+
+  def _add_locked(self,kind,fields):
+    """
+    Adds or merges an object and returns the CRITs response.
+    """
+    key = VALUE_FIELDS[kind]
+    value = fields.get(key)
+    if not value:
+      return {'return_code' : 1, 'message' : 'A ' + key + ' is required'}
+
+    existing = self.by_value[kind].get(value)
+
+    if kind == 'campaigns':
+      if existing != None:
+        return {'return_code' : 1, 'message' : 'Campaign already exists', 'id' : existing}
+      c_id = self._new_id()
+      self.objects[kind][c_id] = {'_id' : c_id, 'name' : value, 'description' : fields.get('description',''),
+                                  'modified' : self._modified()}
+      self.by_value[kind][value] = c_id
+      self._changed(kind)
+      return {'return_code' : 0, 'id' : c_id, 'message' : 'Campaign added'}
+
+    campaign = fields.get('campaign')
+    source = fields.get('source')
+
+    if existing == None:
+      existing = self._new_id()
+      obj = {'_id' : existing, key : value, 'campaign' : [], 'source' : []}
+      if kind == 'ips':
+        obj['type'] = fields.get('ip_type') or fields.get('type') or 'Address - ipv4-addr'
+      self.objects[kind][existing] = obj
+      self.by_value[kind][value] = existing
+
+    obj = self.objects[kind][existing]
+    if campaign and not any(c['name'] == campaign for c in obj['campaign']):
+      obj['campaign'].append({'name' : campaign})
+      self.members[kind].setdefault(campaign, set()).add(existing)
+    if source and not any(s['name'] == source for s in obj['source']):
+      obj['source'].append({'name' : source})
+    obj['modified'] = self._modified()
+
+    self._changed(kind, campaign)
+    return {'return_code' : 0, 'id' : existing, 'message' : 'Added'}
+
+
+
+  def find(self,kind,query,obj_id=None):
+    """
+    Returns the response to a GET for one object or a page of objects.
+    """
+    with self.lock:
+      if obj_id != None:
+        return self.objects[kind].get(obj_id, {})
+
+      campaign = query.get('c-campaign.name')
+      value = query.get('c-' + VALUE_FIELDS[kind])
+
+      if value != None:
+        ids = [self.by_value[kind][value]] if value in self.by_value[kind] else []
+        objects = [self.objects[kind][i] for i in ids]
+        if campaign != None:
+          objects = [o for o in objects if any(c['name'] == campaign for c in o.get('campaign',[]))]
+      else:
+        listing_key = (kind, campaign)
+        objects = self.listings.get(listing_key)
+        if objects == None:
+          if campaign != None and kind in self.members:
+            ids = self.members[kind].get(campaign, set())
+          else:
+            ids = self.objects[kind].keys()
+          objects = [self.objects[kind][i] for i in sorted(ids)]
+          self.listings[listing_key] = objects
+
+      source = query.get('c-source.name')
+      if source != None:
+        objects = [o for o in objects if any(s['name'] == source for s in o.get('source',[]))]
+
+      modified = query.get('c-modified__gte')
+      if modified != None:
+        objects = [o for o in objects if o.get('modified','') >= modified]
+
+      limit = int(query.get('limit', 20))
+      offset = int(query.get('offset', 0))
+      page = [dict(o) for o in objects[offset:offset + limit]]
+
+      if query.get('only'):
+        page = [json_pages.project(o, query['only'].split(',')) for o in page]
+
+      return {'meta' : {'limit' : limit, 'offset' : offset, 'total_count' : len(objects)},
+              'objects' : page}
+
+
+
+  def patch(self,kind,obj_id,fields):
+    with self.lock:
+      if kind == 'campaigns':
+        campaign = self.objects['campaigns'].get(obj_id)
+        target_kind = {'IP' : 'ips', 'Domain' : 'domains'}.get(fields.get('crits_type'))
+        if campaign == None or target_kind == None:
+          return {'return_code' : 1, 'message' : 'Unknown campaign or type'}
+        obj = self.objects[target_kind].get(fields.get('crits_id'))
+        if obj == None:
+          return {'return_code' : 1, 'message' : 'Unknown object'}
+        obj['campaign'] = [c for c in obj['campaign'] if c['name'] != campaign['name']]
+        self.members[target_kind].get(campaign['name'], set()).discard(obj['_id'])
+        obj['modified'] = self._modified()
+        self._changed(target_kind, campaign['name'])
+        return {'return_code' : 0}
+
+      obj = self.objects[kind].get(obj_id)
+      if obj == None:
+        return {'return_code' : 1, 'message' : 'Unknown object'}
+      if len(obj['source']) < 2:
+        return {'return_code' : 1, 'message' : 'Can not remove the last source'}
+      obj['source'] = [s for s in obj['source'] if s['name'] != fields.get('source')]
+      obj['modified'] = self._modified()
+      self._changed(kind)
+      return {'return_code' : 0}
+
+
+
+  def delete(self,kind,obj_id):
+    with self.lock:
+      obj = self.objects[kind].pop(obj_id, None)
+      if obj == None:
+        return None
+
+      del self.by_value[kind][obj[VALUE_FIELDS[kind]]]
+      if kind in self.members:
+        for campaign in obj['campaign']:
+          self.members[kind].get(campaign['name'], set()).discard(obj_id)
+      self._changed(kind)
+      return {'return_code' : 0}
+
+
+
+class FakeCritsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves the CRITs API from the server's store.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+
+  def _parts(self):
+    """
+    Returns the kind, object ID and query of the request.
+    The path is /api/v1/<kind>/[<id>/].
+    """
+    url = urlparse.urlparse(self.path)
+    segments = [segment for segment in url.path.split('/') if segment]
+    kind = None
+    obj_id = None
+    for i, segment in enumerate(segments):
+      if segment in VALUE_FIELDS:
+        kind = segment
+        if i + 1 < len(segments):
+          obj_id = segments[i + 1]
+        break
+    return kind, obj_id, dict(urlparse.parse_qsl(url.query))
+
+
+  def _body(self):
+    length = int(self.headers.get('Content-Length') or 0)
+    return self.rfile.read(length)
+
+
+  def _send(self,status,obj,headers=None):
+    body = json.dumps(obj)
+    self.send_response(status)
+    self.send_header('Content-Type','application/json')
+    self.send_header('Content-Length',str(len(body)))
+    for name, value in (headers or {}).items():
+      self.send_header(name,value)
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def _handle(self,method):
+    server = self.server
+    kind, obj_id, query = self._parts()
+    body = self._body()
+
+    server.count(method, kind)
+    server.delay()
+
+    if server.should_reset():
+      self.close_connection = 1
+      self.request.shutdown(2)
+      return
+
+    if server.should_fail():
+      headers = None
+      if server.retry_after != None:
+        headers = {'Retry-After' : str(server.retry_after)}
+      self._send(server.error_status, {'return_code' : 1, 'message' : 'Injected error'}, headers)
+      return
+
+    if kind == None:
+      self._send(404, {'return_code' : 1, 'message' : 'Unknown endpoint'})
+      return
+
+    if method == 'POST':
+      fields = dict(urlparse.parse_qsl(body))
+    elif method == 'PATCH':
+      try:
+        fields = json.loads(body or '{}')
+      except ValueError:
+        self._send(400, {'return_code' : 1, 'message' : 'Invalid JSON'})
+        return
+    else:
+      fields = {}
+
+    if not (query.get('api_key') or fields.get('api_key')):
+      self._send(401, {'return_code' : 1, 'message' : 'Missing credentials'})
+      return
+
+    store = server.store
+    if method == 'GET':
+      self._send(200, store.find(kind, query, obj_id))
+    elif method == 'POST':
+      self._send(200, store.add(kind, fields))
+    elif method == 'PATCH':
+      self._send(200, store.patch(kind, obj_id, fields))
+    else:
+      result = store.delete(kind, obj_id)
+      if result == None:
+        self._send(404, {'return_code' : 1, 'message' : 'Unknown object'})
+      else:
+        self._send(200, result)
+
+
+  def do_GET(self):
+    self._handle('GET')
+
+  def do_POST(self):
+    self._handle('POST')
+
+  def do_PATCH(self):
+    self._handle('PATCH')
+
+  def do_DELETE(self):
+    self._handle('DELETE')
+
+
+
+class FakeCrits(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """
+  A threaded HTTP server for the fake CRITs API.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self,port=0,latency=0.0,jitter=0.0,error_rate=0.0,error_status=503,reset_rate=0.0,seed=None,
+               retry_after=None):
+    """
+    :param port: The port to listen on. 0 picks a free port (see url).
+    :type port: int
+    :param latency: Seconds added to every response.
+    :type latency: float
+    :param jitter: Up to this many seconds are added to the latency at random.
+    :type jitter: float
+    :param error_rate: The fraction of requests answered with error_status.
+    :type error_rate: float
+    :param error_status: The HTTP status of injected errors.
+    :type error_status: int
+    :param reset_rate: The fraction of requests whose connection is dropped without a response.
+    :type reset_rate: float
+    :param seed: The random seed for the jitter and injected failures.
+    :type seed: int
+    :param retry_after: The seconds sent in a Retry-After header with injected errors. None sends no header.
+    :type retry_after: int
+    """
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeCritsHandler)
+    self.store = FakeCritsStore()
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.error_status = error_status
+    self.reset_rate = reset_rate
+    self.retry_after = retry_after
+    self.random = random.Random(seed)
+    self.random_lock = threading.Lock()
+    self.stats_lock = threading.Lock()
+    self.requests = {}
+    self.thread = None
+
+
+  def url(self):
+    """
+    Returns the API URL to pass to the crits class.
+    """
+    return 'http://127.0.0.1:' + str(self.server_address[1]) + '/api/v1/'
+
+
+  def _chance(self,rate):
+    if rate <= 0:
+      return False
+    with self.random_lock:
+      return self.random.random() < rate
+
+
+  def delay(self):
+    seconds = self.latency
+    if self.jitter > 0:
+      with self.random_lock:
+        seconds += self.random.uniform(0, self.jitter)
+    if seconds > 0:
+      time.sleep(seconds)
+
+
+  def should_fail(self):
+    return self._chance(self.error_rate)
+
+
+  def should_reset(self):
+    return self._chance(self.reset_rate)
+
+
+  def count(self,method,kind):
+    with self.stats_lock:
+      key = method + ' ' + str(kind)
+      self.requests[key] = self.requests.get(key, 0) + 1
+
+
+  def start(self):
+    """
+    Serves requests on a background thread.
+    """
+    self.thread = threading.Thread(target=self.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    return self
+
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Run a local stand-in for the CRITs API')
+  parser.add_argument('--port', type=int, default=8080,
+                   help='The port to listen on')
+  parser.add_argument('--latency', type=float, default=0.0,
+                   help='Seconds added to every response')
+  parser.add_argument('--jitter', type=float, default=0.0,
+                   help='Up to this many random seconds added to every response')
+  parser.add_argument('--error_rate', type=float, default=0.0,
+                   help='The fraction of requests that fail with --error_status')
+  parser.add_argument('--error_status', type=int, default=503,
+                   help='The HTTP status of injected errors')
+  parser.add_argument('--reset_rate', type=float, default=0.0,
+                   help='The fraction of requests whose connection is dropped')
+  parser.add_argument('--retry_after', type=int,
+                   help='The seconds sent in a Retry-After header with injected errors')
+  args = parser.parse_args()
+
+  server = FakeCrits(args.port,args.latency,args.jitter,args.error_rate,args.error_status,args.reset_rate,
+                     retry_after=args.retry_after)
+  print "Serving a fake CRITs API at " + server.url()
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
@@ -0,0 +1,148 @@
+#!/usr/local/bin/python
+"""
+Compares the sets.Set of strings that process_file used to diff feeds against the
+diff that os_list_update.diff_file now runs with libs2.ipset.
+
+For each size, it builds a feed and an existing campaign that overlap by (1 - churn).
+The sets.Set diff builds both sets and takes the two differences (new additions and
+expired entries). The ipset diff builds an IPv4Set of the feed, splits the existing
+records into the ones it covers and the rest, and removes the entries that the kept
+records cover from the feed (the additions), as diff_file does. The expired entries are
+then found with a second coverage check, as plan_removals does. It also reports the approximate memory used.
+
+Example:
+  ./benchmarks/ipset_benchmark.py --sizes 10000,100000,1000000 --churn 0.05
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import os.path
+import random
+import sys
+import time
+from sets import Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import ipset
+
+
+
+def make_feeds(size,churn,seed):
+  """
+  Returns two lists of dotted-quad strings of the given size.
+  A churn fraction of the second list is replaced with new addresses.
+
+  :param size: The number of addresses in each list.
+  :type size: int
+  :param churn: The fraction of addresses that differ between the lists.
+  :type churn: float
+  :param seed: The random seed.
+  :type seed: int
+  :returns: list, list
+  """
+  rand = random.Random(seed)
+  numbers = rand.sample(xrange(2**32), size + int(size * churn))
+  existing = [ipset.int_to_ip(n) for n in numbers[:size]]
+  changed = int(size * churn)
+  feed = existing[changed:] + [ipset.int_to_ip(n) for n in numbers[size:]]
+  rand.shuffle(feed)
+  return feed, existing
+
+
+
+def set_size(s):
+  """
+  Approximates the bytes used by a sets.Set of strings.
+  """
+  return sys.getsizeof(s._data) + sum(sys.getsizeof(k) for k in s._data)
+
+
+
+def array_size(values):
+  """
+  Approximates the bytes used by an array or NumPy array.
+  """
+  if ipset.numpy != None and isinstance(values, ipset.numpy.ndarray):
+    return values.nbytes
+  return values.itemsize * len(values)
+
+
+
+def ipset_size(s):
+  """
+  Approximates the bytes used by an IPv4Set and the IPv4Ranges built for its coverage tests.
+  """
+  size = array_size(s.ints) + sys.getsizeof(s.others)
+  if s.ranges != None:
+    size += array_size(s.ranges.starts) + array_size(s.ranges.ends)
+  return size
+
+
+
+def timed(function):
+  start = time.time()
+  result = function()
+  return result, time.time() - start
+
+
+
+def run_sets(feed,existing):
+  """
+  Times the sets.Set diff and returns a row for the report.
+  """
+  (feed_set, existing_set), build = timed(lambda: (Set(feed), Set(existing)))
+  adds, add_time = timed(lambda: feed_set.difference(existing_set))
+  expired, expire_time = timed(lambda: existing_set.difference(feed_set))
+
+  return ("sets.Set", build, add_time + expire_time,
+          (set_size(feed_set) + set_size(existing_set)) / (1024.0 * 1024), len(adds), len(expired))
+
+
+
+def run_ipset(name,feed,existing):
+  """
+  Times the diff_file diff and returns a row for the report.
+  """
+  feed_set, build = timed(lambda: ipset.IPv4Set(feed))
+
+  def diff():
+    kept, uncovered, kept_ranges = feed_set.split(existing)
+    adds = feed_set.difference(kept_ranges)
+    #plan_removals checks the existing records again when the expired entries are removed
+    expired = [entry for entry, covered in zip(existing, feed_set.covers(existing)) if not covered]
+    return adds, expired, kept_ranges
+
+  (adds, expired, kept_ranges), diff_time = timed(diff)
+  size = ipset_size(feed_set) + array_size(kept_ranges.starts) + array_size(kept_ranges.ends)
+
+  return (name, build, diff_time, size / (1024.0 * 1024), len(adds), len(expired))
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark sets.Set against the ipset diff used by diff_file')
+  parser.add_argument('--sizes', default='10000,100000,1000000',
+                   help='A comma separated list of feed sizes')
+  parser.add_argument('--churn', type=float, default=0.05,
+                   help='The fraction of entries that change between runs')
+  parser.add_argument('--seed', type=int, default=1,
+                   help='The random seed for the synthetic feeds')
+  args = parser.parse_args()
+
+  if ipset.numpy != None:
+    engine = "IPv4Set (numpy)"
+  else:
+    engine = "IPv4Set (array)"
+
+  row = "%-10s %-16s %10s %10s %10s %10s %10s"
+  print row % ("Size","Engine","Build s","Diff s","MB","Adds","Expired")
+
+  for size in [int(x) for x in args.sizes.split(',')]:
+    feed, existing = make_feeds(size,args.churn,args.seed)
+    for result in [run_sets(feed,existing), run_ipset(engine,feed,existing)]:
+      print row % ((size,) + (result[0], "%.3f" % result[1], "%.3f" % result[2],
+                              "%.1f" % result[3], result[4], result[5]))
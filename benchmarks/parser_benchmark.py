@@ -0,0 +1,117 @@
+#!/usr/local/bin/python
+"""
+Measures the throughput of each feed parser in libs2.feed_parsers.
+
+For each format, it builds a synthetic feed in that format and times how long the
+parser takes to yield every (ip, type) tuple. The regex in get_ip_and_type, which
+every feed used to go through, is timed on the plain feed for comparison.
+
+Example:
+  ./benchmarks/parser_benchmark.py --lines 1000000
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import os.path
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import feed_parsers
+from libs2 import ipset
+
+
+
+def make_feed(format,count,seed):
+  """
+  Returns a list of lines for the format with count entries and a comment every 100 lines.
+
+  :param format: The format name.
+  :type format: str
+  :param count: The number of entries.
+  :type count: int
+  :param seed: The random seed.
+  :type seed: int
+  :returns: list of str
+  """
+  rand = random.Random(seed)
+  lines = []
+
+  for i in xrange(count):
+    ip = ipset.int_to_ip(rand.randrange(2**32))
+    if i % 10 == 0:
+      ip = ip.rsplit('.',1)[0] + '.0/24'
+
+    if i % 100 == 0:
+      lines.append("# comment line " + str(i) + "\n")
+
+    if format == 'csv':
+      lines.append("2015-06-01 12:00:00," + ip + ",443\n")
+    elif format == 'snort':
+      lines.append('alert ip [' + ip + '] any -> $HOME_NET any (msg:"Bad host"; sid:' + str(i) + ';)\n')
+    elif format == 'regex':
+      lines.append("host=" + ip + " score=5\n")
+    elif format == 'plain':
+      lines.append(ip + " # description\n")
+    else:
+      lines.append(ip + "\n")
+
+  return lines
+
+
+
+def old_parse(lines):
+  """
+  The per line regex that every feed used before the parser registry.
+  """
+  for line in lines:
+    ip_result = re.match("^[0-9.]+([/0-9]+)?",line.strip())
+    if ip_result != None:
+      ip = ip_result.group(0)
+      yield (ip, feed_parsers.ip_type(ip))
+
+
+
+def run(parse,lines):
+  """
+  Parses the lines and returns the number of entries, the seconds taken and the lines per second.
+  """
+  start = time.time()
+  count = 0
+  for entry in parse(lines):
+    count += 1
+  seconds = time.time() - start
+  return count, seconds, len(lines) / max(seconds, 1e-9)
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the feed parsers')
+  parser.add_argument('--lines', type=int, default=1000000,
+                   help='The number of entries in each synthetic feed')
+  parser.add_argument('--seed', type=int, default=1,
+                   help='The random seed for the synthetic feeds')
+  args = parser.parse_args()
+
+  options = {'csv' : {'column' : '1'}, 'regex' : {'pattern' : r'host=(\S+)'}}
+
+  row = "%-10s %10s %10s %10s %12s %10s"
+  print row % ("Format","Lines","Entries","Seconds","Lines/s","MB/s")
+
+  for format in ['plain', 'netset', 'csv', 'snort', 'regex']:
+    lines = make_feed(format,args.lines,args.seed)
+    size = sum(len(line) for line in lines) / (1024.0 * 1024)
+
+    runs = [(format, feed_parsers.get_parser(format,**options.get(format,{})))]
+    if format == 'plain':
+      runs.append(("old regex", old_parse))
+
+    for name, parse in runs:
+      count, seconds, rate = run(parse,lines)
+      print row % (name, len(lines), count, "%.3f" % seconds, "%.0f" % rate, "%.1f" % (size / max(seconds, 1e-9)))
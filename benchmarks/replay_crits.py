@@ -0,0 +1,215 @@
+#!/usr/local/bin/python
+"""
+Serves the responses in a cassette recorded with os_list_update.py --record_cassette.
+
+Each request is matched to a recorded one by its verb, its path and query (in any order)
+and its body, ignoring the credentials. Requests that were recorded several times (e.g. a
+retried request) get their recorded responses in the order they were recorded, and the last
+one is repeated once they run out. Every response is delayed by the time it took when it
+was recorded, multiplied by --scale, so 1 replays the original latencies, 0.5 replays them
+twice as fast and 0 replays without any delay. A recorded connection error drops the connection.
+Requests that were not recorded get a 404 and are counted as misses.
+
+This allows changes to libs2/crits.py and os_list_update.py to be compared against the response
+sizes and latencies of a real CRITs server without connecting to it.
+
+Example:
+  ./os_list_update.py --update_os_ip_list zeus --record_cassette zeus.cassette
+  ./benchmarks/replay_crits.py zeus.cassette --port 8080 --scale 1.0
+  ./os_list_update.py --update_os_ip_list zeus -a http://127.0.0.1:8080/api/v1/ -u user -k key
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import BaseHTTPServer
+import SocketServer
+import os.path
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import cassette
+
+
+
+class ReplayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Answers each request with the next matching response from the cassette.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+
+  def _send(self,status,content_type,body):
+    body = body or ""
+    if isinstance(body, unicode):
+      body = body.encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type',content_type or 'application/json')
+    self.send_header('Content-Length',str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def _handle(self,method):
+    server = self.server
+    length = int(self.headers.get('Content-Length') or 0)
+    body = self.rfile.read(length) if length > 0 else None
+
+    path = self.path
+    if path.startswith(server.prefix):
+      path = path[len(server.prefix):]
+
+    entry = server.next_response(cassette.request_key(method, path, body))
+    if entry == None:
+      self._send(404, 'application/json', '{"return_code": 1, "message": "No recorded response"}')
+      return
+
+    if server.scale > 0 and entry.get('seconds'):
+      time.sleep(entry['seconds'] * server.scale)
+
+    if entry.get('status') == None:
+      self.close_connection = 1
+      self.request.shutdown(2)
+      return
+
+    self._send(entry['status'], entry.get('content_type'), entry.get('response'))
+
+
+  def do_GET(self):
+    self._handle('GET')
+
+  def do_POST(self):
+    self._handle('POST')
+
+  def do_PATCH(self):
+    self._handle('PATCH')
+
+  def do_DELETE(self):
+    self._handle('DELETE')
+
+
+
+class ReplayCrits(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """
+  A threaded HTTP server that replays a cassette.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self,entries,port=0,scale=1.0,prefix='/api/v1/'):
+    """
+    :param entries: The request attempts from cassette.load.
+    :type entries: list of dict
+    :param port: The port to listen on. 0 picks a free port (see url).
+    :type port: int
+    :param scale: The factor applied to the recorded latencies. 0 replays without delay.
+    :type scale: float
+    :param prefix: The path of the API URL that the recorded paths are relative to.
+    :type prefix: str
+    """
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), ReplayHandler)
+    self.scale = scale
+    self.prefix = prefix
+    self.lock = threading.Lock()
+    self.responses = {}
+    self.last = {}
+    self.hits = 0
+    self.misses = 0
+    self.missed = []
+
+    for entry in entries:
+      key = cassette.request_key(entry['method'], entry['path'], entry.get('body'))
+      self.responses.setdefault(key, deque()).append(entry)
+
+
+  def url(self):
+    """
+    Returns the API URL to pass to the crits class.
+    """
+    return 'http://127.0.0.1:' + str(self.server_address[1]) + self.prefix
+
+
+  def next_response(self,key):
+    """
+    Returns the next recorded response for the request key, or None if it was not recorded.
+    """
+    with self.lock:
+      queue = self.responses.get(key)
+      if queue:
+        self.last[key] = queue.popleft()
+      entry = self.last.get(key)
+
+      if entry == None:
+        self.misses += 1
+        if len(self.missed) < 20:
+          self.missed.append(key)
+      else:
+        self.hits += 1
+      return entry
+
+
+  def stats(self):
+    """
+    Returns the number of matched and unmatched requests and the recorded requests never asked for.
+
+    :returns: dict
+    """
+    with self.lock:
+      unused = sum(len(queue) for queue in self.responses.values())
+      return {'hits' : self.hits, 'misses' : self.misses, 'unused' : unused, 'missed' : list(self.missed)}
+
+
+  def start(self):
+    """
+    Serves requests on a background thread.
+    """
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return self
+
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Replay a cassette recorded with os_list_update.py --record_cassette')
+  parser.add_argument('cassette',
+                   help='The cassette file')
+  parser.add_argument('--port', type=int, default=8080,
+                   help='The port to listen on')
+  parser.add_argument('--scale', type=float, default=1.0,
+                   help='The factor applied to the recorded latencies. 0 replays without delay')
+  parser.add_argument('--prefix', default='/api/v1/',
+                   help='The path of the CRITs API URL')
+  args = parser.parse_args()
+
+  try:
+    header, entries = cassette.load(args.cassette)
+  except (IOError, ValueError) as e:
+    print "Error: Could not read the cassette: " + str(e)
+    exit(1)
+
+  server = ReplayCrits(entries,args.port,args.scale,args.prefix)
+  print "Replaying " + str(len(entries)) + " requests at " + server.url()
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+  stats = server.stats()
+  print "Matched: " + str(stats['hits']) + " Missed: " + str(stats['misses']) + " Unused: " + str(stats['unused'])
+  for key in stats['missed']:
+    print "  Missed: " + key[0] + " " + key[1]
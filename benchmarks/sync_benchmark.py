@@ -0,0 +1,183 @@
+#!/usr/local/bin/python
+"""
+Times a full sync of an IP feed against a local fake CRITs server (benchmarks/fake_crits.py).
+
+For each feed size, the fake server is seeded with a campaign of that many IPs and a feed is
+generated in which the churn fraction of the IPs has been replaced with new ones. The benchmark
+then runs os_list_update.process_file and remove_expired_entries, which list the campaign, add
+the new IPs and remove the departed ones, and reports the wall time, the requests per second
+and the peak memory of the sync.
+
+The server and the sync each run in their own process, so the peak memory is that of the sync
+alone and the server does not compete with the sync for the interpreter lock.
+
+The seeded IPs carry the fields of a real CRITs IP object, so --no_field_projection shows
+what listing the campaign costs when every field of every IP is downloaded and decoded.
+
+Example:
+  ./benchmarks/sync_benchmark.py --sizes 10000,100000,1000000 --churn 0.05 --workers 8
+  ./benchmarks/sync_benchmark.py --sizes 10000 --latency 0.02 --jitter 0.01 --error_rate 0.01
+  ./benchmarks/sync_benchmark.py --sizes 100000 --no_field_projection
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import multiprocessing
+import os
+import os.path
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import crits
+from libs2 import ipset
+import os_list_update
+import fake_crits
+
+
+CAMPAIGN = 'OS-Benchmark'
+SOURCE = 'Benchmark'
+
+#The other fields of a CRITs IP object
+IP_FIELDS = {'type' : 'Address - ipv4-addr', 'status' : 'New', 'analyst' : 'benchmark',
+             'created' : '2015-01-01 00:00:00.000000', 'description' : '', 'schema_version' : 3,
+             'bucket_list' : [], 'sectors' : [], 'releasability' : [], 'relationships' : [],
+             'tickets' : [], 'objects' : [], 'screenshots' : [], 'locations' : [], 'actions' : []}
+
+
+
+def make_values(size,churn,seed):
+  """
+  Returns the IPs in the seeded campaign and the IPs in the feed.
+  The feed drops the first size * churn IPs of the campaign and adds as many new ones.
+
+  :param size: The number of IPs in the campaign and in the feed.
+  :type size: int
+  :param churn: The fraction of IPs that changed.
+  :type churn: float
+  :param seed: The random seed.
+  :type seed: int
+  :returns: list of str, list of str
+  """
+  rand = random.Random(seed)
+  changed = int(size * churn)
+
+  #Stay clear of 0.0.0.0/8 and the multicast and reserved ranges.
+  values = [ipset.int_to_ip(value) for value in rand.sample(xrange(1 << 24, 224 << 24), size + changed)]
+
+  return values[:size], values[changed:]
+
+
+
+def serve(queue,args,size):
+  """
+  Seeds a fake CRITs server with the campaign and serves it until terminated.
+  The server's URL is put on the queue once it is ready.
+  """
+  server = fake_crits.FakeCrits(0,args.latency,args.jitter,args.error_rate,seed=args.seed)
+  existing, feed = make_values(size,args.churn,args.seed)
+  server.store.seed('ips',existing,CAMPAIGN,SOURCE,IP_FIELDS)
+  del existing, feed
+
+  queue.put(server.url())
+  server.serve_forever()
+
+
+
+def sync(queue,args,url,size):
+  """
+  Runs process_file and remove_expired_entries against the server and puts the results on the queue.
+  """
+  existing, feed = make_values(size,args.churn,args.seed)
+  lines = [ip + "\n" for ip in feed]
+  del existing, feed
+
+  baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  client = crits.crits('benchmark','benchmark',url,False,False,
+                       pool_connections=args.workers,pool_maxsize=max(args.workers,10),
+                       field_projection=not args.no_field_projection)
+
+  #The sync prints a line per removed IP.
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull,'w')
+  start = time.time()
+  try:
+    in_set, existing_index, add_failures = os_list_update.process_file(client,lines,CAMPAIGN,SOURCE,False,'low',False,
+                                                                        args.workers,args.page_fanout)
+    delete_failures = os_list_update.remove_expired_entries(client,CAMPAIGN,SOURCE,in_set,existing_index,False,
+                                                            None,args.workers)
+  finally:
+    seconds = time.time() - start
+    sys.stdout.close()
+    sys.stdout = stdout
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  queue.put({'seconds' : seconds, 'stats' : client.connection_stats(), 'peak_kb' : peak,
+             'growth_kb' : peak - baseline, 'add_failures' : len(add_failures),
+             'delete_failures' : len(delete_failures)})
+
+
+
+def run(args,size):
+  """
+  Starts the server and the sync in their own processes and returns the sync's results.
+  """
+  queue = multiprocessing.Queue()
+  server = multiprocessing.Process(target=serve, args=(queue,args,size))
+  server.daemon = True
+  server.start()
+
+  try:
+    url = queue.get()
+    worker = multiprocessing.Process(target=sync, args=(queue,args,url,size))
+    worker.start()
+    result = queue.get()
+    worker.join()
+  finally:
+    server.terminate()
+    server.join()
+
+  return result
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark a full IP feed sync against a fake CRITs server')
+  parser.add_argument('--sizes', default='10000,100000,1000000',
+                   help='A comma separated list of feed sizes')
+  parser.add_argument('--churn', type=float, default=0.05,
+                   help='The fraction of the feed that changed since the last sync')
+  parser.add_argument('--workers', type=int, default=8,
+                   help='The number of concurrent adds and removals')
+  parser.add_argument('--page_fanout', type=int, default=4,
+                   help='The number of campaign pages fetched at once')
+  parser.add_argument('--latency', type=float, default=0.0,
+                   help='Seconds the fake server adds to every response')
+  parser.add_argument('--jitter', type=float, default=0.0,
+                   help='Up to this many random seconds the fake server adds to every response')
+  parser.add_argument('--error_rate', type=float, default=0.0,
+                   help='The fraction of requests the fake server fails with a 503')
+  parser.add_argument('--no_field_projection', action='store_true',
+                   help='Download every field of the listed IPs instead of only the ones the sync uses')
+  parser.add_argument('--seed', type=int, default=1,
+                   help='The random seed for the feeds and the injected latency and errors')
+  args = parser.parse_args()
+
+  row = "%-9s %8s %8s %10s %9s %9s %10s %10s %9s"
+  print row % ("Size","Changed","Requests","Retried","Seconds","Req/s","Peak MB","Growth MB","Failures")
+
+  for size in [int(value) for value in args.sizes.split(',')]:
+    result = run(args,size)
+    stats = result['stats']
+    print row % (size, int(size * args.churn), stats['requests'], stats['retried'], "%.2f" % result['seconds'],
+                 "%.0f" % (stats['requests'] / max(result['seconds'], 1e-9)),
+                 "%.1f" % (result['peak_kb'] / 1024.0), "%.1f" % (result['growth_kb'] / 1024.0),
+                 result['add_failures'] + result['delete_failures'])
@@ -0,0 +1,213 @@
+import threading
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+class AdaptiveController:
+  """
+  An AIMD (additive increase, multiplicative decrease) limit on the number of requests
+  that a crits object has in flight, and on the page size used to list campaigns.
+
+  Every request reports its latency, whether the server was overloaded (a connection
+  error, timeout, 429 or 5xx) and its request class (e.g. its verb and endpoint, or page
+  listings). Each class keeps its own window of requests and its own baseline latency,
+  so that slow page listings are not read as congestion by fast single-object requests.
+  After each window of a class, the controller looks at that class's 90th percentile
+  latency and error rate. If either is too high, the limit is cut by the backoff factor.
+  Otherwise, if requests were waiting for a slot, the limit grows by one.
+  Page requests get the same treatment for the page size, which grows by page_step.
+  """
+
+  def __init__(self,min_limit=1,max_limit=32,initial_limit=4,latency_target=None,
+               error_threshold=0.05,window=20,backoff=0.5,
+               min_page_size=100,max_page_size=1000,page_step=100,page_latency_target=5.0):
+    """
+    :param min_limit: The fewest requests allowed in flight.
+    :type min_limit: int
+    :param max_limit: The most requests allowed in flight.
+    :type max_limit: int
+    :param initial_limit: The number of requests allowed in flight at the start.
+    :type initial_limit: int
+    :param latency_target: The 90th percentile latency in seconds above which the limit is cut.
+                           None uses three times the lowest median latency seen so far
+                           for the same request class.
+    :type latency_target: float
+    :param error_threshold: The fraction of overloaded requests above which the limit is cut.
+    :type error_threshold: float
+    :param window: The number of requests of a class between adjustments.
+    :type window: int
+    :param backoff: The factor that the limit and page size are multiplied by when cut.
+    :type backoff: float
+    :param min_page_size: The smallest page size.
+    :type min_page_size: int
+    :param max_page_size: The largest page size. CRITs allows at most 1000.
+    :type max_page_size: int
+    :param page_step: The amount that the page size grows by.
+    :type page_step: int
+    :param page_latency_target: The 90th percentile page latency in seconds above which the page size is cut.
+    :type page_latency_target: float
+    """
+
+    self.min_limit = max(min_limit, 1)
+    self.max_limit = max(max_limit, self.min_limit)
+    self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+    self.latency_target = latency_target
+    self.error_threshold = error_threshold
+    self.window = window
+    self.backoff = backoff
+
+    self.min_page_size = min_page_size
+    self.max_page_size = max_page_size
+    self.page_step = page_step
+    self.page_latency_target = page_latency_target
+    self.current_page_size = max_page_size
+
+    self.in_flight = 0
+    self.waited = False
+    self.samples = {}
+    self.page_samples = []
+    self.baselines = {}
+    self.increases = 0
+    self.decreases = 0
+    self.last_p50 = None
+    self.last_p90 = None
+    self.condition = threading.Condition()
+
+
+
+  def acquire(self):
+    """
+    Waits until a request may be sent and takes a slot for it.
+    """
+
+    with self.condition:
+      while self.in_flight >= int(self.limit):
+        self.waited = True
+        self.condition.wait()
+      self.in_flight += 1
+
+
+
+  def release(self,latency,overloaded,page=False,request_class=None):
+    """
+    Frees the slot taken by acquire and records how the request went.
+
+    :param latency: The seconds the request took.
+    :type latency: float
+    :param overloaded: Whether the request failed in a way that suggests the server is overloaded.
+    :type overloaded: bool
+    :param page: Whether the request listed a page of a campaign.
+    :type page: bool
+    :param request_class: The class whose latencies the request is compared with.
+                          Page listings are always their own class. The default puts every
+                          other request in one class.
+    :type request_class: str
+    """
+
+    if page:
+      request_class = 'page'
+    elif request_class == None:
+      request_class = 'request'
+
+    with self.condition:
+      self.in_flight -= 1
+      samples = self.samples.setdefault(request_class, [])
+      samples.append((latency, overloaded))
+      if page:
+        self.page_samples.append((latency, overloaded))
+
+      if len(samples) >= self.window:
+        self._adjust_limit(request_class)
+      if len(self.page_samples) >= max(self.window / 4, 1):
+        self._adjust_page_size()
+
+      self.condition.notify_all()
+
+
+
+  def page_size(self,default=1000):
+    """
+    Returns the number of objects to request per page.
+
+    :param default: The largest page size the caller wants.
+    :type default: int
+    :returns: int
+    """
+
+    with self.condition:
+      return min(self.current_page_size, default)
+
+
+
+  def stats(self):
+    """
+    Returns the current limit and page size and how often they were changed.
+
+    :returns: dict
+    """
+
+    with self.condition:
+      return {'limit' : int(self.limit), 'page_size' : self.current_page_size,
+              'increases' : self.increases, 'decreases' : self.decreases,
+              'p50' : self.last_p50, 'p90' : self.last_p90}
+
+
+
+  def _adjust_limit(self,request_class):
+    """
+    Applies one AIMD step to the limit from the current window of a request class.
+    Called with the condition held.
+    """
+
+    samples = self.samples.pop(request_class)
+    latencies = sorted(latency for latency, overloaded in samples)
+    errors = sum(1 for latency, overloaded in samples if overloaded)
+
+    self.last_p50 = _percentile(latencies, 0.5)
+    self.last_p90 = _percentile(latencies, 0.9)
+    baseline = self.baselines.get(request_class)
+    if baseline == None or self.last_p50 < baseline:
+      baseline = self.last_p50
+      self.baselines[request_class] = baseline
+
+    target = self.latency_target
+    if target == None:
+      target = baseline * 3
+
+    if errors > self.error_threshold * len(samples) or self.last_p90 > target:
+      limit = max(self.min_limit, self.limit * self.backoff)
+      if int(limit) < int(self.limit):
+        self.decreases += 1
+      self.limit = limit
+    elif self.waited and self.limit < self.max_limit:
+      self.limit = min(self.max_limit, self.limit + 1)
+      self.increases += 1
+
+    self.waited = False
+
+
+
+  def _adjust_page_size(self):
+    """
+    Applies one AIMD step to the page size from the page requests. Called with the condition held.
+    """
+
+    latencies = sorted(latency for latency, overloaded in self.page_samples)
+    errors = sum(1 for latency, overloaded in self.page_samples if overloaded)
+
+    if errors > self.error_threshold * len(self.page_samples) or _percentile(latencies, 0.9) > self.page_latency_target:
+      self.current_page_size = max(self.min_page_size, int(self.current_page_size * self.backoff))
+    else:
+      self.current_page_size = min(self.max_page_size, self.current_page_size + self.page_step)
+
+    self.page_samples = []
+
+
+
+def _percentile(values,fraction):
+  """
+  Returns the value at fraction of the way through the sorted list values.
+  """
+  return values[min(int(len(values) * fraction), len(values) - 1)]
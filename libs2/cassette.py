@@ -0,0 +1,224 @@
+import json
+import re
+import threading
+import time
+import urllib
+import urlparse
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+#The request parameters that hold the CRITs credentials
+CREDENTIAL_FIELDS = ('username', 'api_key')
+
+#What a secret is replaced with in the cassette
+SCRUBBED = 'SCRUBBED'
+
+#A credential parameter in a query string or form body, e.g. in a URL that a response refers to
+CREDENTIAL_PARAMETER = re.compile(r"\b(" + "|".join(CREDENTIAL_FIELDS) + r")=[^&#\s\"'\\]*")
+
+#A credential field of a JSON object
+CREDENTIAL_JSON_FIELD = re.compile(r'"(' + "|".join(CREDENTIAL_FIELDS) + r')"(\s*:\s*)"(?:[^"\\]|\\.)*"')
+
+CASSETTE_VERSION = 1
+
+
+
+class CassetteRecorder:
+  """
+  This class records the requests that a crits object sends and the responses it gets
+  to a cassette file, so that a run can be replayed later by benchmarks/replay_crits.py.
+
+  The cassette is a JSON lines file. The first line describes the recording and each
+  following line is one request attempt with its path relative to the API URL, the
+  request body, the response status, content type and body, the seconds the response
+  took and the seconds since the recording started. An attempt that got no response
+  has a status of None and the error name.
+
+  The username and api_key parameters are removed from every path and form body. Any other
+  username or api_key parameter or JSON field in a request or response has its value replaced
+  with SCRUBBED. The credentials are not searched for anywhere else, so a short username that is
+  also part of an indicator or a campaign name is recorded as it is.
+  Each line is flushed as it is written, so a cassette is usable even if the run exits early.
+  """
+
+  def __init__(self,path):
+    """
+    Opens the cassette for writing and writes the header line.
+
+    :param path: The file name of the cassette.
+    :type path: str
+    """
+
+    self.path = path
+    self.lock = threading.Lock()
+    self.start = time.time()
+    self.count = 0
+    self.file = open(path,'w')
+    self._write({'version' : CASSETTE_VERSION, 'recorded' : self.start})
+
+
+
+  def _write(self,entry):
+    with self.lock:
+      if self.file == None:
+        return
+      self.file.write(json.dumps(entry, sort_keys=True) + "\n")
+      self.file.flush()
+
+
+
+  def scrub(self,text):
+    """
+    Replaces the value of every username and api_key parameter and JSON field in text with SCRUBBED.
+
+    :param text: The text to scrub.
+    :type text: str
+    :returns: str
+    """
+
+    if not text:
+      return text
+    text = CREDENTIAL_PARAMETER.sub(r"\1=" + SCRUBBED, text)
+    return CREDENTIAL_JSON_FIELD.sub(r'"\1"\2"' + SCRUBBED + '"', text)
+
+
+
+  def record(self,method,path,body,status,content_type,content,started,seconds,error=None):
+    """
+    Records one request attempt.
+
+    :param method: The HTTP verb.
+    :type method: str
+    :param path: The URL of the request relative to the API URL.
+    :type path: str
+    :param body: The request body, if any.
+    :type body: str
+    :param status: The HTTP status code, or None if there was no response.
+    :type status: int
+    :param content_type: The Content-Type of the response.
+    :type content_type: str
+    :param content: The response body.
+    :type content: str
+    :param started: The time.time() when the attempt was sent.
+    :type started: float
+    :param seconds: How long the attempt took.
+    :type seconds: float
+    :param error: The name of the exception if there was no response.
+    :type error: str
+    """
+
+    entry = {'method' : method.upper(),
+             'path' : self.scrub(strip_credentials(path)),
+             'body' : self.scrub(strip_form_credentials(body)),
+             'status' : status,
+             'content_type' : content_type,
+             'response' : self.scrub(content),
+             'offset' : round(started - self.start, 6),
+             'seconds' : round(seconds, 6)}
+    if error != None:
+      entry['error'] = error
+
+    self._write(entry)
+    with self.lock:
+      self.count += 1
+
+
+
+  def close(self):
+    with self.lock:
+      if self.file != None:
+        self.file.close()
+        self.file = None
+
+
+
+def strip_credentials(path):
+  """
+  Removes the credential parameters from the query string of a URL and sorts the rest.
+
+  :param path: The URL or path.
+  :type path: str
+  :returns: str
+  """
+
+  if '?' not in path:
+    return path
+  base, query = path.split('?', 1)
+  fields = sorted((key, value) for key, value in urlparse.parse_qsl(query, keep_blank_values=True)
+                  if key not in CREDENTIAL_FIELDS)
+  if len(fields) == 0:
+    return base
+  return base + '?' + urllib.urlencode(fields)
+
+
+
+def strip_form_credentials(body):
+  """
+  Removes the credential fields from a form encoded body and sorts the rest.
+  Other bodies (e.g. JSON) are returned unchanged.
+
+  :param body: The request body.
+  :type body: str
+  :returns: str
+  """
+
+  if not body or body.lstrip()[:1] in ('{', '['):
+    return body or None
+  fields = urlparse.parse_qsl(body, keep_blank_values=True)
+  if len(fields) == 0:
+    return body
+  return urllib.urlencode(sorted((key, value) for key, value in fields if key not in CREDENTIAL_FIELDS))
+
+
+
+def request_key(method,path,body):
+  """
+  Returns the key that a recorded request and a replayed request are matched on:
+  the verb, the path with its query sorted and the body without credentials.
+  JSON bodies are compared by value.
+
+  :param method: The HTTP verb.
+  :type method: str
+  :param path: The URL relative to the API URL.
+  :type path: str
+  :param body: The request body, if any.
+  :type body: str
+  :returns: tuple
+  """
+
+  body = strip_form_credentials(body)
+  if body and body.lstrip()[:1] in ('{', '['):
+    try:
+      body = json.dumps(json.loads(body), sort_keys=True)
+    except ValueError:
+      pass
+  return (method.upper(), strip_credentials(path), body or None)
+
+
+
+def load(path):
+  """
+  Reads a cassette written by CassetteRecorder.
+
+  :param path: The file name of the cassette.
+  :type path: str
+  :returns: dict (the header), list of dict (the request attempts in order)
+  """
+
+  header = None
+  entries = []
+  with open(path) as f:
+    for line in f:
+      if not line.strip():
+        continue
+      entry = json.loads(line)
+      if header == None:
+        header = entry
+        if entry.get('version') != CASSETTE_VERSION:
+          raise ValueError("Unsupported cassette version: " + str(entry.get('version')))
+      else:
+        entries.append(entry)
+  return header, entries
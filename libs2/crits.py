@@ -1,20 +1,47 @@
 import json
+import random
 import urllib
+import threading
+import time
 import requests
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.packages.urllib3.exceptions import NewConnectionError
+from libs2.metrics import RequestMetrics
+from libs2 import json_pages
 
 __author__ = 'Peleus Uhley'
 __copyright__   = "Copyright 2015, Adobe System Incorporated"
 __license__ = "MIT License"
 
 
+#HTTP methods that can be sent again without changing the result
+IDEMPOTENT_METHODS = ('get', 'head', 'options', 'put', 'delete', 'patch')
+
+#Responses that mean the server could not handle the request right now
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+#The bytes read from a streamed response at a time
+PAGE_CHUNK_SIZE = 64 * 1024
+
+#The campaign fields that get_campaign_id needs
+CAMPAIGN_ID_FIELDS = ('_id', 'name')
+
+
 class crits:
   """
   This class manages the interactions with the CRITs server via the API.
   """
 
-  def __init__(self,username,api_key,crits_url,verify=True,debug=False):
+  def __init__(self,username,api_key,crits_url,verify=True,debug=False,
+               pool_connections=10,pool_maxsize=10,pool_block=False,keep_alive=True,
+               connect_timeout=None,read_timeout=None,cache_ttl=300,
+               retries=3,retry_backoff=0.5,retry_max_backoff=30.0,request_deadline=None,
+               controller=None,recorder=None,field_projection=True):
     """
     The initialization class which stores the CRITs connection info.
+    All requests made by this object share a single pooled HTTP session.
 
     :param username: The user ID for the CRITs account.
     :type username: str
@@ -26,6 +53,37 @@ class crits:
     :type verify: bool
     :param debug: A boolean indicating whether to print debug statements.
     :type debug: bool
+    :param pool_connections: The number of per-host connection pools to cache.
+    :type pool_connections: int
+    :param pool_maxsize: The max number of connections kept open to a single host.
+    :type pool_maxsize: int
+    :param pool_block: Whether to wait for a free connection when a host's pool is full.
+    :type pool_block: bool
+    :param keep_alive: Whether connections should be kept open between requests.
+    :type keep_alive: bool
+    :param connect_timeout: Seconds to wait when connecting to CRITs. None waits forever.
+    :type connect_timeout: float
+    :param read_timeout: Seconds to wait for a response from CRITs. None waits forever.
+    :type read_timeout: float
+    :param cache_ttl: Seconds that a campaign name to ID lookup is remembered.
+    :type cache_ttl: float
+    :param retries: The number of times a request is sent again after a transient error.
+    :type retries: int
+    :param retry_backoff: Seconds of the first retry delay. The delay doubles with each retry.
+    :type retry_backoff: float
+    :param retry_max_backoff: The longest delay between retries in seconds.
+    :type retry_max_backoff: float
+    :param request_deadline: Seconds that a request may take in total, including retries. None has no limit.
+    :type request_deadline: float
+    :param controller: Adapts the number of requests in flight and the page size to the server's
+                       latency and errors. None sends requests as soon as they are made.
+    :type controller: :class:`libs2\adaptive.AdaptiveController`
+    :param recorder: Records every request and response to a cassette for later replay. None records nothing.
+                     Responses are read in full instead of streamed while recording.
+    :type recorder: :class:`libs2\cassette.CassetteRecorder`
+    :param field_projection: Whether to ask CRITs for only the fields a find needs (the only parameter).
+                             The objects are reduced to those fields either way.
+    :type field_projection: bool
     """
 
     self.username = username
@@ -33,10 +91,247 @@ class crits:
     self.CRITs_URL = crits_url
     self.verify = verify
     self.debug = debug
+    self.timeout = (connect_timeout, read_timeout)
+    self.pool_maxsize = pool_maxsize
+
+    self.retries = retries
+    self.retry_backoff = retry_backoff
+    self.retry_max_backoff = retry_max_backoff
+    self.request_deadline = request_deadline
+    self.controller = controller
+    self.recorder = recorder
+    self.field_projection = field_projection
+
+    self.connections_opened = 0
+    self.requests_sent = 0
+    self.requests_retried = 0
+    self.stats_lock = threading.Lock()
+    self.metrics = RequestMetrics()
+
+    self.session = requests.Session()
+    adapter = _CountingAdapter(self, pool_connections=pool_connections,
+                               pool_maxsize=pool_maxsize, pool_block=pool_block)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+    if not keep_alive:
+      self.session.headers['Connection'] = 'close'
+
+    self.cache_ttl = cache_ttl
+    self.cache_lock = threading.Lock()
+    self.campaign_ids = {}
+    self.campaign_lookups = {}
+    self.cache_generation = 0
+
+    self.batch_pool = None
+    self.batch_pool_size = 0
+    self.batch_pool_lock = threading.Lock()
+
+
+
+  def _request(self,method,url,timeout=None,deadline=None,idempotent=None,page=False,stream=False,**kwargs):
+    """
+    Sends a request through the pooled session and retries transient errors.
+    A request that never reached the server (it could not connect) is always retried.
+    Read timeouts, dropped connections and 429/5xx responses are only retried for
+    idempotent requests. Retries wait an exponential backoff with full jitter, and
+    stop once the deadline would be passed.
+    The connection error or timeout is raised to the caller when the retries run out.
+    A 429/5xx response is returned to the caller when the retries run out.
+    If the client has a controller, each attempt waits for a slot and reports its latency.
+    Every attempt is recorded in self.metrics under its endpoint and verb, and in the
+    recorder's cassette if the client has one. Recording reads each response body in full,
+    so stream is ignored while recording.
+
+    :param method: The HTTP verb to use ('get','post','patch','delete').
+    :type method: str
+    :param url: The full URL for the request.
+    :type url: str
+    :param timeout: The (connect, read) timeout for each attempt. The default is the client's.
+    :type timeout: tuple
+    :param deadline: Seconds the request may take including retries. The default is request_deadline.
+    :type deadline: float
+    :param idempotent: Whether sending the request twice is safe. The default depends on the method.
+    :type idempotent: bool
+    :param page: Whether the request lists a page of objects. Pages drive the controller's page size.
+    :type page: bool
+    :param stream: Whether to leave the response body unread so that it can be decoded as it arrives (see _decode).
+    :type stream: bool
+    :returns: :class:`requests.Response`
+    """
+
+    if timeout == None:
+      timeout = self.timeout
+    if deadline == None:
+      deadline = self.request_deadline
+    #The cassette stores each response body whole, so nothing is streamed while recording.
+    if self.recorder != None:
+      stream = False
+    if idempotent == None:
+      idempotent = method.lower() in IDEMPOTENT_METHODS
+
+    give_up = None
+    if deadline != None:
+      give_up = time.time() + deadline
+
+    #The first path segment under the API URL (ips, domains, campaigns)
+    endpoint = url[len(self.CRITs_URL):].split('?')[0].split('/')[0] or "other"
+
+    attempt = 0
+    while True:
+      attempt_timeout = timeout
+      if give_up != None:
+        attempt_timeout = _cap_timeout(timeout, give_up - time.time())
+
+      with self.stats_lock:
+        self.requests_sent += 1
+
+      if self.controller != None:
+        self.controller.acquire()
+      start = time.time()
+
+      try:
+        r = None
+        try:
+          r = self.session.request(method, url, verify=self.verify, timeout=attempt_timeout, stream=stream, **kwargs)
+        finally:
+          #The slot is given back however the attempt ends
+          elapsed = time.time() - start
+          if self.controller != None:
+            self.controller.release(elapsed, r == None or r.status_code in RETRY_STATUS_CODES, page,
+                                    method.upper() + " " + endpoint)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        self.metrics.record(endpoint, method, "error", elapsed, retry=attempt > 0)
+        if self.recorder != None:
+          self.recorder.record(method, url[len(self.CRITs_URL):], _request_body(kwargs.get('data')),
+                               None, None, None, start, elapsed, type(e).__name__)
+        if not (idempotent or _never_sent(e)) or not self._retry(method,url,attempt,give_up,e):
+          raise
+      else:
+        self.metrics.record(endpoint, method, r.status_code, elapsed, _body_size(r.request.body),
+                            _response_size(r, stream), attempt > 0)
+        if self.recorder != None:
+          self.recorder.record(method, url[len(self.CRITs_URL):], r.request.body, r.status_code,
+                               r.headers.get('Content-Type'), r.content, start, elapsed)
+        if not idempotent or r.status_code not in RETRY_STATUS_CODES:
+          return r
+        if not self._retry(method,url,attempt,give_up,"HTTP " + str(r.status_code),_retry_after(r)):
+          return r
+        #Hand the connection of a streamed response back to the pool before the next attempt.
+        r.close()
+
+      attempt += 1
+
+
+
+  def _retry(self,method,url,attempt,give_up,reason,delay=None):
+    """
+    Waits before the next attempt of a request.
+    Returns False instead if the retries are used up or the wait would pass the deadline.
+
+    :param method: The HTTP verb of the request.
+    :type method: str
+    :param url: The full URL of the request.
+    :type url: str
+    :param attempt: The number of retries already made.
+    :type attempt: int
+    :param give_up: The time when the request must be finished, or None.
+    :type give_up: float
+    :param reason: The error or a description of the response.
+    :type reason: object
+    :param delay: The wait requested by the server (Retry-After), if any.
+    :type delay: float
+    :returns: boolean
+    """
+
+    if attempt >= self.retries:
+      return False
+
+    if delay == None:
+      delay = random.uniform(0, min(self.retry_max_backoff, self.retry_backoff * (2 ** attempt)))
+
+    if give_up != None and time.time() + delay >= give_up:
+      return False
+
+    with self.stats_lock:
+      self.requests_retried += 1
+
+    if self.debug:
+      #The query string holds the API key
+      print "Retrying " + method.upper() + " " + url.split('?')[0] + " in %.2fs: " % delay + str(reason)
+
+    time.sleep(delay)
+    return True
 
 
 
-  def find_campaign(self,name="",id="",limit=20,offset=0):
+  def _decode(self,r,fields=None):
+    """
+    Decodes a JSON response from its bytes and reduces each object in its objects list to fields.
+    A streamed response is decoded as it is read when ijson is installed (see libs2/json_pages.py).
+    Without ijson the whole body is read before it is decoded.
+
+    :param r: The response.
+    :type r: :class:`requests.Response`
+    :param fields: The fields to keep in each object. None keeps every field.
+    :type fields: list of str
+    :returns: dict
+    """
+
+    try:
+      if json_pages.STREAMING:
+        return json_pages.decode(r.iter_content(PAGE_CHUNK_SIZE), fields)
+      return json_pages.decode(r.content, fields)
+    finally:
+      r.close()
+
+
+
+  def _only(self,fields):
+    """
+    Returns the query parameter that asks CRITs for only the given fields, or "".
+    """
+
+    if not fields or not self.field_projection:
+      return ""
+    return '&' + urllib.urlencode({'only': ','.join(fields)})
+
+
+
+  def page_size(self,default=1000):
+    """
+    Returns the number of objects to request per page when listing a campaign.
+    This is default unless the controller has lowered it.
+
+    :param default: The largest page size wanted. Must be <= 1000.
+    :type default: int
+    :returns: int
+    """
+
+    if self.controller == None:
+      return default
+
+    return self.controller.page_size(default)
+
+
+
+  def connection_stats(self):
+    """
+    Returns the number of connections opened and reused by the session.
+
+    :returns: dict
+    """
+
+    with self.stats_lock:
+      opened = self.connections_opened
+      sent = self.requests_sent
+      retried = self.requests_retried
+
+    return {'requests' : sent, 'opened' : opened, 'reused' : max(sent - opened, 0), 'retried' : retried}
+
+
+
+  def find_campaign(self,name="",id="",limit=20,offset=0,fields=None):
     """
     Finds the information associated with the given campaign.
     Depending on the type of error, this will either exit or return None.
@@ -50,6 +345,8 @@ class crits:
     :type limit: int
     :param offset: Which rows to return
     :type offset: int
+    :param fields: Only return these fields of each campaign (e.g. ['_id','name']). None returns every field.
+    :type fields: list of str
     :returns: dict
     """
 
@@ -69,8 +366,10 @@ class crits:
     if offset != None and offset != "":
       url = url + '&' + urllib.urlencode({'offset': str(offset)})
 
+    url = url + self._only(fields)
+
     try: 
-      r = requests.get(url,verify=self.verify)
+      r = self._request('get', url, stream=True)
     except requests.exceptions.ConnectionError as e:
       print "find_campaign error: Could not connect to " + url + "\n" + str(e.message)
       exit(1)
@@ -82,7 +381,7 @@ class crits:
       print "find_campagin error: Error code returned from the server: " + str(r.status_code)
       exit(1)
 
-    j = json.loads(r.text)
+    j = self._decode(r, fields)
 
     #if self.debug:
     #  print ">>>find_campaign response<<<"
@@ -98,6 +397,73 @@ class crits:
 
 
 
+  def get_campaign_id(self,name):
+    """
+    Returns the GUID of the named campaign, or None if it does not exist.
+    Results are cached for cache_ttl seconds. Concurrent lookups of the same
+    name share a single find_campaign request. If that request fails (or its result
+    is made stale by an add or delete), the callers that were waiting on it do not
+    read it as a missing campaign. One of them sends the request again and the rest wait on it.
+
+    :param name: The name of the campaign to resolve.
+    :type name: str
+    :returns: str
+    """
+
+    while True:
+      with self.cache_lock:
+        cached = self.campaign_ids.get(name)
+        if cached != None and cached[1] > time.time():
+          return cached[0]
+
+        waiter = self.campaign_lookups.get(name)
+        if waiter == None:
+          waiter = threading.Event()
+          self.campaign_lookups[name] = waiter
+          generation = self.cache_generation
+          break
+
+      #Another caller is looking the name up. Check the cache again once it is done.
+      waiter.wait()
+
+    try:
+      c_id = None
+      result = self.find_campaign(name, fields=CAMPAIGN_ID_FIELDS)
+      if result != None:
+        c_id = result[0]['_id']
+
+      with self.cache_lock:
+        #Do not store a result that an add or delete made stale while it was in flight.
+        if generation == self.cache_generation:
+          self.campaign_ids[name] = (c_id, time.time() + self.cache_ttl)
+      return c_id
+    finally:
+      with self.cache_lock:
+        del self.campaign_lookups[name]
+      waiter.set()
+
+
+
+  def invalidate_campaign(self,name=None,c_id=None):
+    """
+    Removes a campaign from the name to ID cache by name and/or by GUID.
+
+    :param name: The name of the campaign.
+    :type name: str
+    :param c_id: The GUID of the campaign.
+    :type c_id: str
+    """
+
+    with self.cache_lock:
+      self.cache_generation += 1
+      self.campaign_ids.pop(name, None)
+      if c_id != None:
+        for key, value in self.campaign_ids.items():
+          if value[0] == c_id:
+            del self.campaign_ids[key]
+
+
+
   def add_campaign(self, name, description):
     """
     Add a campaign to the CRITs database.
@@ -124,7 +490,7 @@ class crits:
     }
 
     try:
-      r = requests.post(url, data=data, verify=self.verify)
+      r = self._request('post', url, data=data)
     except requests.exceptions.ConnectionError as e:
       print "add_campaign error: Could not connect to " + url + "\n" + str(e.message)
       exit(1)
@@ -132,6 +498,8 @@ class crits:
       print "add_campaign error: Timeout connecting to " + url
       exit(1)
 
+    self.invalidate_campaign(name)
+
     #if self.debug:
     #  print ">>>add_campaign response<<<\n"
     #  print r.text
@@ -159,7 +527,7 @@ class crits:
 
 
 
-  def find_domain(self,domain, campaign="", source="", id="", limit=20,offset=0):
+  def find_domain(self,domain, campaign="", source="", id="", limit=20,offset=0,meta=False,modified_since="",fields=None):
     """
     Find a domain(s) within the CRITs database.
     If a domain value is not provided, then it will return all the domains in the campaign.
@@ -179,10 +547,16 @@ class crits:
     :type limit: int
     :param offset: For large responses, return rows starting after offset.
     :type offset: int
+    :param meta: Return the whole response, including meta.total_count, even when it is empty.
+    :type meta: bool
+    :param modified_since: Only return records modified at or after this CRITs timestamp.
+    :type modified_since: str
+    :param fields: Only return these fields of each domain (e.g. ['_id','domain','campaign.name']). None returns every field.
+    :type fields: list of str
     :returns: dict
     """
 
-    url = self.CRITs_URL + 'domains/' + '?username=' + self.username + '&api_key=' + self.api_key
+    url = self.CRITs_URL + 'domains/'
 
     if id != None and id != "":
       url = url + str(id) + '/'
@@ -198,14 +572,19 @@ class crits:
     if source != None and source != "":
       url = url + '&' + urllib.urlencode({'c-source.name': source})
 
+    if modified_since != None and modified_since != "":
+      url = url + '&' + urllib.urlencode({'c-modified__gte': modified_since})
+
     if limit != None and limit != "":
       url = url + '&' + urllib.urlencode({'limit': str(limit)})
 
     if offset != None and offset != "":
       url = url + '&' + urllib.urlencode({'offset': str(offset)})
 
+    url = url + self._only(fields)
+
     try:
-      r = requests.get(url, verify=self.verify)
+      r = self._request('get', url, page=(domain == None or domain == ""), stream=True)
     except requests.exceptions.ConnectionError as e:
       print "find_domain error: Could not connect to " + url + "\n" + str(e.message)
       exit(1)
@@ -221,9 +600,9 @@ class crits:
     #  print ">>>find_domain response<<<\n"
     #  print r.text
 
-    j = json.loads(r.text)
+    j = self._decode(r, fields)
 
-    if id != None and id != "":
+    if meta or (id != None and id != ""):
       return j
     else:
       if j['meta']['total_count'] >= 1:
@@ -270,8 +649,9 @@ class crits:
     if indicator:
       data['add_indicator'] = indicator
 
+    #CRITs merges an add of an existing value into the existing record, so a resend is safe.
     try:
-      r = requests.post(url, data=data, verify=self.verify)
+      r = self._request('post', url, data=data, idempotent=True)
     except requests.exceptions.ConnectionError as e:
       print "add_domain error: Could not connect to " + url + "\n" + str(e.message)
 
@@ -299,7 +679,7 @@ class crits:
 
 
 
-  def find_ip(self,ip,campaign="",source="",id="", limit=20, offset=0):
+  def find_ip(self,ip,campaign="",source="",id="", limit=20, offset=0, meta=False, modified_since="", fields=None):
     """
     Find an IP address within the CRITs database.
     If an IP value is not provided, then it will return all the IPs in the campaign.
@@ -319,6 +699,12 @@ class crits:
     :type limit: int
     :param offset: For large responses, return rows starting after offset.
     :type offset: int
+    :param meta: Return the whole response, including meta.total_count, even when it is empty.
+    :type meta: bool
+    :param modified_since: Only return records modified at or after this CRITs timestamp.
+    :type modified_since: str
+    :param fields: Only return these fields of each IP (e.g. ['_id','ip','campaign.name']). None returns every field.
+    :type fields: list of str
     :returns: dict
     """
 
@@ -338,14 +724,19 @@ class crits:
     if source != None and source != "":
       url = url + '&' + urllib.urlencode({'c-source.name': source})
 
+    if modified_since != None and modified_since != "":
+      url = url + '&' + urllib.urlencode({'c-modified__gte': modified_since})
+
     if limit != None and limit != "":
       url = url + '&' + urllib.urlencode({'limit': str(limit)})
 
     if offset != None and offset != "":
       url = url + '&' + urllib.urlencode({'offset': str(offset)})
 
+    url = url + self._only(fields)
+
     try: 
-      r = requests.get(url, verify=self.verify)
+      r = self._request('get', url, page=(ip == None or ip == ""), stream=True)
     except requests.exceptions.ConnectionError as e:
       print "find_ip error: Could not connect to " + url + "\n" + str(e.message)
       exit(1)
@@ -357,13 +748,13 @@ class crits:
       print "find_ip error: Error code returned from the server: " + str(r.status_code)
       exit(1)
 
-    j = json.loads(r.text)
+    j = self._decode(r, fields)
 
     #if self.debug:
     #  print ">>>find_ip response<<<"
     #  print r.text
 
-    if id != None and id != "":
+    if meta or (id != None and id != ""):
       return j
     else:
       if j['meta']['total_count'] >= 1:
@@ -414,8 +805,9 @@ class crits:
     if indicator:
       data['add_indicator'] = indicator
 
+    #CRITs merges an add of an existing value into the existing record, so a resend is safe.
     try:
-      r = requests.post(url, data=data, verify=self.verify)
+      r = self._request('post', url, data=data, idempotent=True)
     except requests.exceptions.ConnectionError as e:
       print "add_ip error: Could not connect to " + url + "\n" + str(e.message)
       exit(1)
@@ -465,7 +857,7 @@ class crits:
     data = {} 
 
     try:
-      r = requests.delete(url, data=data, verify=self.verify)
+      r = self._request('delete', url, data=data)
     except requests.exceptions.ConnectionError as e:
       print "delete_domain error: Could not connect to " + url
       exit(1)
@@ -526,7 +918,7 @@ class crits:
       'id':d_id}
 
     try:
-      r = requests.patch(url, data=json.dumps(data), verify=self.verify)
+      r = self._request('patch', url, data=json.dumps(data))
     except requests.exceptions.ConnectionError as e:
       print "delete_domain_reference error: Could not connect to " + url
       print e
@@ -583,7 +975,7 @@ class crits:
     data = {}
 
     try:
-      r = requests.delete(url, data=data, verify=self.verify)
+      r = self._request('delete', url, data=data)
     except requests.exceptions.ConnectionError as e:
       print "delete_ip error: Could not connect to " + url
       exit(1)
@@ -635,7 +1027,7 @@ class crits:
       'id':ip_id}
 
     try:
-      r = requests.patch(url, data=json.dumps(data), verify=self.verify)
+      r = self._request('patch', url, data=json.dumps(data))
     except requests.exceptions.ConnectionError as e:
       print "delete_ip_reference error: Could not connect to " + url
       exit(1)
@@ -691,7 +1083,7 @@ class crits:
     data = {}
 
     try:
-      r = requests.delete(url, data=data, verify=self.verify)
+      r = self._request('delete', url, data=data)
     except requests.exceptions.ConnectionError as e:
       print "delete_campaign error: Could not connect to " + url
       exit(1)
@@ -699,6 +1091,8 @@ class crits:
       print "delete_campaign error: Timeout connecting to " + url
       exit(1)
 
+    self.invalidate_campaign(c_id=c_id)
+
     #if self.debug:
     #  print ">>>delete_campaign response<<<\n"
     #  print r.text
@@ -748,11 +1142,11 @@ class crits:
       'crits_id':obj_id}
 
     try:
-      r = requests.patch(url, data=json.dumps(data), verify=self.verify)
+      r = self._request('patch', url, data=json.dumps(data))
     except requests.exceptions.ConnectionError as e:
       print "delete_campaign_reference error: Could not connect to " + url
       exit(1)
-    except request.exceptions.Timeout:
+    except requests.exceptions.Timeout:
       print "delete_campagin_reference error: Timeout connecting to " + url
       exit(1)
 
@@ -780,3 +1174,473 @@ class crits:
       print r.text
 
     return (False)
+
+
+
+  def add_ips(self,records,workers=None,rate=None,**defaults):
+    """
+    Adds many IP addresses to the CRITs database.
+    Each record is an IP string or a dict with the add_ip arguments (ip, campaign, source,
+    ip_type, indicator, confidence). Arguments missing from a record are taken from defaults.
+    The adds share the pooled session and run concurrently. A failed add never exits.
+    See _batch for the result of each record.
+
+    :param records: The IPs to add.
+    :type records: iterable of str or dict
+    :param workers: The max number of adds in flight. The default is pool_maxsize.
+    :type workers: int
+    :param rate: The max number of adds started per second. None does not limit the rate.
+    :type rate: float
+    :param defaults: The add_ip arguments to use when a record does not supply them.
+    :type defaults: dict
+    :returns: list of dict, in the order of records
+    """
+
+    url = self.CRITs_URL + 'ips/'
+
+    def send(record):
+      fields = {'ip_type' : "Address - ipv4-addr", 'indicator' : False, 'confidence' : "low"}
+      fields.update(defaults)
+      fields.update(_as_record(record,'ip'))
+
+      if not fields.get('ip'):
+        return _batch_result(record,"An IP address must be supplied to add_ips")
+
+      data = {
+        'username' : self.username,
+        'api_key' : self.api_key,
+        'source' : fields.get('source'),
+        'campaign' : fields.get('campaign'),
+        'ip' : fields['ip'],
+        'ip_type' : fields['ip_type'],
+        'confidence' : fields['confidence']
+      }
+
+      if fields['indicator']:
+        data['add_indicator'] = fields['indicator']
+
+      return self._write(record,'post',url,data=data,idempotent=True)
+
+    return self._batch(records,send,workers,rate)
+
+
+
+  def add_domains(self,records,workers=None,rate=None,**defaults):
+    """
+    Adds many domains to the CRITs database.
+    Each record is a domain string or a dict with the add_domain arguments (domain, campaign,
+    source, indicator, confidence). Arguments missing from a record are taken from defaults.
+    The adds share the pooled session and run concurrently. A failed add never exits.
+    See _batch for the result of each record.
+
+    :param records: The domains to add.
+    :type records: iterable of str or dict
+    :param workers: The max number of adds in flight. The default is pool_maxsize.
+    :type workers: int
+    :param rate: The max number of adds started per second. None does not limit the rate.
+    :type rate: float
+    :param defaults: The add_domain arguments to use when a record does not supply them.
+    :type defaults: dict
+    :returns: list of dict, in the order of records
+    """
+
+    url = self.CRITs_URL + 'domains/'
+
+    def send(record):
+      fields = {'indicator' : False, 'confidence' : "low"}
+      fields.update(defaults)
+      fields.update(_as_record(record,'domain'))
+
+      if not fields.get('domain'):
+        return _batch_result(record,"A domain must be supplied to add_domains")
+
+      data = {
+        'username' : self.username,
+        'api_key' : self.api_key,
+        'source' : fields.get('source'),
+        'campaign' : fields.get('campaign'),
+        'domain' : fields['domain'],
+        'confidence' : fields['confidence']
+      }
+
+      if fields['indicator']:
+        data['add_indicator'] = fields['indicator']
+
+      return self._write(record,'post',url,data=data,idempotent=True)
+
+    return self._batch(records,send,workers,rate)
+
+
+
+  def delete_ips(self,records,workers=None,rate=None):
+    """
+    Removes many IPs from the CRITs database, or removes them from a source or campaign.
+    Each record is an IP GUID or a dict with the keys:
+      id -- The CRITs GUID of the IP.
+      source -- Remove only this source from the IP (see delete_ip_reference).
+      campaign -- Remove only this campaign name from the IP (see delete_campaign_reference).
+    A record without source or campaign deletes the IP. If both are given, the source is
+    removed first and the campaign is removed only if that succeeds.
+    The deletes share the pooled session and run concurrently. A failed delete never exits.
+    See _batch for the result of each record.
+
+    :param records: The IPs to delete.
+    :type records: iterable of str or dict
+    :param workers: The max number of deletes in flight. The default is pool_maxsize.
+    :type workers: int
+    :param rate: The max number of deletes started per second. None does not limit the rate.
+    :type rate: float
+    :returns: list of dict, in the order of records
+    """
+
+    return self._delete_records(records,workers,rate,'ips/',"IP")
+
+
+
+  def delete_domains(self,records,workers=None,rate=None):
+    """
+    Removes many domains from the CRITs database, or removes them from a source or campaign.
+    The records are the same as for delete_ips, with id holding the domain's GUID.
+
+    :param records: The domains to delete.
+    :type records: iterable of str or dict
+    :param workers: The max number of deletes in flight. The default is pool_maxsize.
+    :type workers: int
+    :param rate: The max number of deletes started per second. None does not limit the rate.
+    :type rate: float
+    :returns: list of dict, in the order of records
+    """
+
+    return self._delete_records(records,workers,rate,'domains/',"Domain")
+
+
+
+  def _delete_records(self,records,workers,rate,path,crits_type):
+    """
+    Sends the deletes and reference removals of delete_ips and delete_domains.
+
+    :param records: The records to delete (see delete_ips).
+    :type records: iterable of str or dict
+    :param workers: The max number of deletes in flight.
+    :type workers: int
+    :param rate: The max number of deletes started per second.
+    :type rate: float
+    :param path: The API path of the records ('ips/' or 'domains/').
+    :type path: str
+    :param crits_type: The CRITs type of the records ("IP" or "Domain").
+    :type crits_type: str
+    :returns: list of dict, in the order of records
+    """
+
+    def send(record):
+      fields = _as_record(record,'id')
+      obj_id = fields.get('id')
+
+      if not obj_id:
+        return _batch_result(record,"An ID must be supplied to delete_" + path.rstrip('/'))
+
+      url = self.CRITs_URL + path + obj_id + '/' + '?username=' + self.username + '&api_key=' + self.api_key
+
+      if not fields.get('source') and not fields.get('campaign'):
+        return self._write(record,'delete',url,data={})
+
+      start = time.time()
+      if fields.get('source'):
+        result = self._write(record,'patch',url,data=json.dumps({'source' : fields['source'], 'id' : obj_id}))
+        if not result['ok'] or not fields.get('campaign'):
+          return result
+
+      campaign_id = self.get_campaign_id(fields['campaign'])
+      if campaign_id == None:
+        result = _batch_result(record,"Could not find the campaign: " + fields['campaign'])
+      else:
+        url = self.CRITs_URL + 'campaigns/' + str(campaign_id) + '/' + '?username=' + self.username + '&api_key=' + self.api_key
+        result = self._write(record,'patch',url,data=json.dumps({'crits_type' : crits_type, 'crits_id' : obj_id}))
+
+      result['seconds'] = time.time() - start
+      return result
+
+    return self._batch(records,send,workers,rate)
+
+
+
+  def _batch(self,records,send,workers,rate):
+    """
+    Runs send for every record on the client's worker threads (see _worker_pool) and collects the results.
+    At most workers records of the batch are in flight at once.
+    Each result is a dict with the keys:
+      item -- The record.
+      ok -- Whether CRITs accepted the write.
+      status_code -- The HTTP status, or None if no response was received.
+      return_code -- The CRITs return_code, or None if the response did not include one.
+      message -- The CRITs message, or a description of the error.
+      seconds -- How long the record took.
+
+    :param records: The records to send.
+    :type records: iterable
+    :param send: The function that sends one record and returns its result.
+    :type send: function
+    :param workers: The max number of records in flight. The default is pool_maxsize.
+    :type workers: int
+    :param rate: The max number of records started per second. None does not limit the rate.
+    :type rate: float
+    :returns: list of dict, in the order of records
+    """
+
+    if workers == None:
+      workers = self.pool_maxsize
+
+    limiter = None
+    if rate:
+      limiter = _RateLimiter(rate)
+
+    def run(record):
+      if limiter != None:
+        limiter.wait()
+      start = time.time()
+      try:
+        return send(record)
+      except SystemExit:
+        #Lookups such as get_campaign_id exit on connection errors. Record the failure instead.
+        result = _batch_result(record,"Could not connect to " + self.CRITs_URL)
+      except Exception as e:
+        message = str(e)
+        if self.api_key:
+          message = message.replace(self.api_key,"<api_key>")
+        result = _batch_result(record,message)
+      result['seconds'] = time.time() - start
+      return result
+
+    if workers <= 1:
+      return [run(record) for record in records]
+
+    #The caller waits for a free slot before it queues the next record, so other batches
+    #sharing the pool are not held up behind this one.
+    slots = threading.Semaphore(workers)
+
+    def run_in_slot(record):
+      try:
+        return run(record)
+      finally:
+        slots.release()
+
+    pool = self._worker_pool(workers)
+    pending = []
+    for record in records:
+      slots.acquire()
+      pending.append(pool.apply_async(run_in_slot, (record,)))
+
+    return [result.get() for result in pending]
+
+
+
+  def _worker_pool(self,workers):
+    """
+    Returns the thread pool that runs the batches of this client, starting it on first use.
+    The pool is shared by every batch and only grows. When a batch needs more threads
+    than the pool has, a larger pool replaces it and the old one stops once its queued records are sent.
+
+    :param workers: The number of threads the batch needs.
+    :type workers: int
+    :returns: :class:`multiprocessing.pool.ThreadPool`
+    """
+
+    with self.batch_pool_lock:
+      if self.batch_pool == None or self.batch_pool_size < workers:
+        if self.batch_pool != None:
+          self.batch_pool.close()
+        self.batch_pool = ThreadPool(workers)
+        self.batch_pool_size = workers
+      return self.batch_pool
+
+
+
+  def _write(self,record,method,url,**kwargs):
+    """
+    Sends one write for a batch method. Errors are described in the result instead of exiting.
+
+    :param record: The record being written.
+    :type record: str or dict
+    :param method: The HTTP verb to use ('post','patch','delete').
+    :type method: str
+    :param url: The full URL for the request.
+    :type url: str
+    :returns: dict (see _batch)
+    """
+
+    result = _batch_result(record)
+    start = time.time()
+
+    try:
+      r = self._request(method, url, **kwargs)
+    except requests.exceptions.ConnectionError as e:
+      result['message'] = "Could not connect to " + self.CRITs_URL
+      result['seconds'] = time.time() - start
+      return result
+    except requests.exceptions.Timeout:
+      result['message'] = "Timeout connecting to " + self.CRITs_URL
+      result['seconds'] = time.time() - start
+      return result
+
+    result['seconds'] = time.time() - start
+    result['status_code'] = r.status_code
+
+    try:
+      j = json.loads(r.text)
+    except ValueError:
+      j = {}
+
+    if isinstance(j, dict):
+      if j.get('return_code') != None:
+        result['return_code'] = int(j['return_code'])
+      result['message'] = j.get('message') or ""
+
+    result['ok'] = r.status_code == 200 and result['return_code'] in (None, 0)
+    if not result['ok'] and result['message'] == "":
+      result['message'] = "HTTP " + str(r.status_code)
+
+    return result
+
+
+
+def _never_sent(error):
+  """
+  Returns whether a requests exception happened before the request reached the server.
+  """
+  if isinstance(error, requests.exceptions.ConnectTimeout):
+    return True
+
+  reason = None
+  if error.args:
+    reason = getattr(error.args[0], 'reason', None)
+  return isinstance(reason, NewConnectionError)
+
+
+
+def _body_size(body):
+  """
+  Returns the size in bytes of a prepared request body.
+  """
+  if body == None:
+    return 0
+  if isinstance(body, unicode):
+    return len(body.encode('utf-8'))
+  return len(body)
+
+
+
+def _response_size(response,stream):
+  """
+  Returns the size in bytes of a response body. A streamed body has not been read yet,
+  so its Content-Length is used (0 for a chunked response).
+  """
+  if not stream:
+    return len(response.content or "")
+  length = response.headers.get('Content-Length')
+  if length == None or not length.isdigit():
+    return 0
+  return int(length)
+
+
+
+def _request_body(data):
+  """
+  Returns the body that requests sends for the data argument.
+  """
+  if isinstance(data, dict):
+    return urllib.urlencode(data, True)
+  return data
+
+
+
+def _retry_after(response):
+  """
+  Returns the seconds in a numeric Retry-After header, or None.
+  """
+  value = response.headers.get('Retry-After')
+  if value == None or not value.strip().isdigit():
+    return None
+  return float(value)
+
+
+
+def _cap_timeout(timeout,remaining):
+  """
+  Shortens a (connect, read) timeout so an attempt can not run past the remaining seconds.
+  """
+  remaining = max(remaining, 0.001)
+  return tuple(remaining if t == None else min(t, remaining) for t in timeout)
+
+
+
+def _as_record(record,key):
+  """
+  Returns a batch record as a dict. A string record becomes {key: record}.
+  """
+  if isinstance(record, dict):
+    return record
+  return {key : record}
+
+
+
+def _batch_result(record,message=""):
+  """
+  Returns a failed batch result for the record (see crits._batch).
+  """
+  return {'item' : record, 'ok' : False, 'status_code' : None, 'return_code' : None,
+          'message' : message, 'seconds' : 0.0}
+
+
+
+class _RateLimiter:
+  """
+  Spaces out calls to wait() so that at most rate of them return per second.
+  """
+
+  def __init__(self, rate):
+    self.interval = 1.0 / rate
+    self.next_start = time.time()
+    self.lock = threading.Lock()
+
+
+  def wait(self):
+    with self.lock:
+      now = time.time()
+      start = max(now, self.next_start)
+      self.next_start = start + self.interval
+    if start > now:
+      time.sleep(start - now)
+
+
+
+class _CountingAdapter(HTTPAdapter):
+  """
+  An HTTPAdapter that reports every new connection back to the owning crits object.
+  """
+
+  def __init__(self, owner, **kwargs):
+    self.owner = owner
+    HTTPAdapter.__init__(self, **kwargs)
+
+
+  def init_poolmanager(self, *args, **kwargs):
+    HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+    self.poolmanager.pool_classes_by_scheme = {
+      'http' : _counting_pool(HTTPConnectionPool, self.owner),
+      'https' : _counting_pool(HTTPSConnectionPool, self.owner)
+    }
+
+
+
+def _counting_pool(base, owner):
+  """
+  Builds a urllib3 connection pool class that counts the connections it opens.
+  """
+
+  class CountingPool(base):
+    def _new_conn(self):
+      with owner.stats_lock:
+        owner.connections_opened += 1
+      return base._new_conn(self)
+
+  return CountingPool
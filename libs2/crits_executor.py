@@ -0,0 +1,145 @@
+import threading
+from multiprocessing.pool import ThreadPool
+from libs2.crits import crits
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+#The crits methods that a CritsExecutor schedules on its worker threads
+SUBMITTED_METHODS = ('find_campaign', 'get_campaign_id', 'add_campaign', 'delete_campaign', 'delete_campaign_reference',
+                     'find_domain', 'add_domain', 'delete_domain', 'delete_domain_reference',
+                     'find_ip', 'add_ip', 'delete_ip', 'delete_ip_reference',
+                     'add_ips', 'add_domains', 'delete_ips', 'delete_domains')
+
+
+
+class CritsExecutorError(Exception):
+  """
+  Raised by AsyncResult.get() when the underlying crits call gave up on the request.
+  """
+  pass
+
+
+
+class CritsExecutor:
+  """
+  A bounded thread executor for crits calls.
+  Each method named in SUBMITTED_METHODS takes the same arguments as its crits equivalent,
+  schedules the call on one of max_in_flight worker threads and returns an AsyncResult. Call get() on the result
+  to wait for the value, or pass callback= to be notified when it completes.
+  Each call holds a worker thread (and its blocking HTTP request) until it completes,
+  so max_in_flight is both the number of threads and the number of requests in flight.
+  Scheduling blocks once max_in_flight calls are outstanding.
+  All calls share one pooled HTTP session. The batch methods (add_ips, delete_ips, ...)
+  hold one worker thread while the batch itself runs on the crits worker threads.
+  """
+
+  def __init__(self,username,api_key,crits_url,verify=True,debug=False,max_in_flight=32,**pool_settings):
+    """
+    The initialization class which stores the CRITs connection info.
+
+    :param username: The user ID for the CRITs account.
+    :type username: str
+    :param api_key: The API key associated with the CRITs ID.
+    :type api_key: str
+    :param crits_url: The URL for the CRITs API.
+    :type crits_url: str
+    :param verify: Whether or not to verify the SSL certificate in an HTTPS connection.
+    :type verify: bool
+    :param debug: A boolean indicating whether to print debug statements.
+    :type debug: bool
+    :param max_in_flight: The number of worker threads, and so the max number of calls outstanding at once.
+    :type max_in_flight: int
+    :param pool_settings: The connection pool keyword arguments accepted by crits.
+    :type pool_settings: dict
+    """
+
+    if pool_settings.get('pool_maxsize',10) < max_in_flight:
+      pool_settings['pool_maxsize'] = max_in_flight
+
+    self.client = crits(username,api_key,crits_url,verify,debug,**pool_settings)
+    self.debug = debug
+    self.max_in_flight = max_in_flight
+    self.slots = threading.BoundedSemaphore(max_in_flight)
+    self.pool = ThreadPool(max_in_flight)
+
+
+
+  def _submit(self,name,args,kwargs):
+    """
+    Schedules the named crits method on a worker thread.
+    This blocks until a thread is free when max_in_flight calls are already outstanding.
+
+    :param name: The name of the crits method to call.
+    :type name: str
+    :param args: The positional arguments for the method.
+    :type args: tuple
+    :param kwargs: The keyword arguments for the method. 'callback' is removed and
+                   called with the result when the method completes successfully.
+    :type kwargs: dict
+    :returns: :class:`multiprocessing.pool.AsyncResult`
+    """
+
+    callback = kwargs.pop('callback', None)
+    method = getattr(self.client, name)
+
+    def run():
+      try:
+        return method(*args, **kwargs)
+      except SystemExit:
+        #The crits methods exit on connection errors. Surface it through get() instead.
+        raise CritsExecutorError(name + " failed")
+      finally:
+        self.slots.release()
+
+    self.slots.acquire()
+    try:
+      return self.pool.apply_async(run, callback=callback)
+    except:
+      self.slots.release()
+      raise
+
+
+
+  def connection_stats(self):
+    """
+    Returns the number of connections opened and reused by the shared session.
+
+    :returns: dict
+    """
+
+    return self.client.connection_stats()
+
+
+
+  def close(self):
+    """
+    Waits for every outstanding call to finish and stops the worker threads.
+    """
+
+    self.pool.close()
+    self.pool.join()
+
+
+
+  def __getattr__(self,name):
+    """
+    Returns the function that schedules the named crits method on a worker thread.
+    Only the methods in SUBMITTED_METHODS can be scheduled.
+
+    :param name: The name of the crits method.
+    :type name: str
+    :returns: function that returns a :class:`multiprocessing.pool.AsyncResult`
+    """
+
+    if name not in SUBMITTED_METHODS:
+      raise AttributeError(name)
+
+    def submit(*args,**kwargs):
+      return self._submit(name,args,kwargs)
+
+    submit.__name__ = name
+    submit.__doc__ = "Schedules crits." + name + " on a worker thread."
+    return submit
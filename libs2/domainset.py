@@ -0,0 +1,243 @@
+import bisect
+import heapq
+import re
+from array import array
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+#An unsigned 32-bit array typecode
+if array('I').itemsize == 4:
+  TYPECODE = 'I'
+else:
+  TYPECODE = 'L'
+
+#The number of names that are sorted (or joined) at a time while a set is built
+SORT_CHUNK_SIZE = 65536
+
+#A normalized domain: dot separated labels of at most 63 characters, 253 in total,
+#and a top level label that is not all digits (so IPv4 addresses are not domains).
+VALID_DOMAIN = re.compile(r"^(?=.{1,253}$)(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?\.)+"
+                          r"(?=[a-z0-9-]*[a-z])[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$")
+
+
+
+def normalize_domain(value):
+  """
+  Returns the canonical form of a domain name, or None if it is not a valid domain.
+  The name is stripped of whitespace, a trailing dot and a leading "*." wildcard,
+  lower cased, and internationalized names are converted to their IDNA (xn--) form.
+
+  :param value: The domain name. A str is assumed to be UTF-8.
+  :type value: str or unicode
+  :returns: str
+  """
+  if value == None:
+    return None
+
+  value = value.strip().rstrip('.')
+  if value.startswith('*.'):
+    value = value[2:]
+
+  try:
+    if isinstance(value, unicode):
+      value = value.lower().encode('idna')
+    else:
+      value = value.lower()
+      if not _is_ascii(value):
+        value = value.decode('utf-8').lower().encode('idna')
+  except UnicodeError:
+    return None
+
+  if VALID_DOMAIN.match(value) == None:
+    return None
+
+  return value
+
+
+
+def _is_ascii(value):
+  try:
+    value.decode('ascii')
+  except UnicodeDecodeError:
+    return False
+  return True
+
+
+
+class DomainSet:
+  """
+  A compact, immutable set of normalized domain names.
+  The names are sorted and stored back to back in one string with an array of their
+  offsets, which takes a few bytes per name on top of the names themselves instead of
+  the ~60 bytes of a Python string object and set slot. Lookups are binary searches.
+  Values that are not valid domains are dropped.
+  While a set is built, the names are sorted SORT_CHUNK_SIZE at a time, each chunk is packed
+  and the packed chunks are merged, so the names are never all held as Python strings at once.
+  """
+
+  def __init__(self,values=()):
+    """
+    :param values: The domain names. They are normalized with normalize_domain.
+    :type values: iterable of str
+    """
+    chunks = []
+    names = []
+    for value in values:
+      name = normalize_domain(value)
+      if name != None:
+        names.append(name)
+        if len(names) >= SORT_CHUNK_SIZE:
+          names.sort()
+          chunks.append(DomainSet._from_sorted(names, True))
+          names = []
+
+    names.sort()
+    if not chunks:
+      self._pack(names)
+      return
+
+    chunks.append(DomainSet._from_sorted(names, True))
+    names = None
+    self._pack(heapq.merge(*chunks))
+
+
+
+  @classmethod
+  def _from_sorted(cls,names,dedup=False):
+    """
+    Builds a set from names that are already normalized and sorted, and unique unless dedup is set.
+    """
+    result = cls()
+    result._pack(names, dedup)
+    return result
+
+
+
+  def _pack(self,names,dedup=True):
+    """
+    Stores the sorted names, skipping duplicates if dedup is set.
+    The names are joined SORT_CHUNK_SIZE at a time so that they are not all held in one list.
+    """
+    offsets = array(TYPECODE)
+    blocks = []
+    parts = []
+    position = 0
+    previous = None
+
+    for name in names:
+      if dedup and name == previous:
+        continue
+      previous = name
+      offsets.append(position)
+      parts.append(name)
+      position += len(name)
+      if len(parts) >= SORT_CHUNK_SIZE:
+        blocks.append("".join(parts))
+        parts = []
+
+    offsets.append(position)
+    blocks.append("".join(parts))
+    self.data = "".join(blocks)
+    self.offsets = offsets
+
+
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+
+
+  def __getitem__(self,index):
+    """
+    Returns the index-th name in sorted order.
+    """
+    if index < 0:
+      index += len(self)
+    if index < 0 or index >= len(self):
+      raise IndexError("DomainSet index out of range")
+    return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+
+
+  def __iter__(self):
+    data = self.data
+    offsets = self.offsets
+    for i in xrange(len(offsets) - 1):
+      yield data[offsets[i]:offsets[i + 1]]
+
+
+
+  def _contains_normalized(self,name):
+    i = bisect.bisect_left(self, name)
+    return i < len(self) and self[i] == name
+
+
+
+  def __contains__(self,value):
+    name = normalize_domain(value)
+    if name == None:
+      return False
+    return self._contains_normalized(name)
+
+
+
+  def covers(self,values):
+    """
+    Returns whether each value is in the set, after normalizing it.
+    A few values are looked up with binary searches. Many values are sorted
+    and merged with the set in a single pass.
+
+    :param values: The domain names to look up.
+    :type values: list of str
+    :returns: list of bool
+    """
+    names = [normalize_domain(value) for value in values]
+
+    if len(names) * 20 < len(self):
+      return [name != None and self._contains_normalized(name) for name in names]
+
+    result = [False] * len(names)
+    sentinel = object()
+    mine = iter(self)
+    current = next(mine, sentinel)
+
+    for i in sorted((i for i in xrange(len(names)) if names[i] != None), key=names.__getitem__):
+      while current is not sentinel and current < names[i]:
+        current = next(mine, sentinel)
+      result[i] = current is not sentinel and current == names[i]
+
+    return result
+
+
+
+  def difference(self,other):
+    """
+    Returns the names that are in this set and not in other.
+    The two sorted sets are merged in a single pass.
+
+    :param other: The names to remove.
+    :type other: DomainSet or iterable of str
+    :returns: DomainSet
+    """
+    if not isinstance(other, DomainSet):
+      other = DomainSet(other)
+
+    return DomainSet._from_sorted(_merge_difference(iter(self), iter(other)))
+
+
+
+def _merge_difference(a,b):
+  """
+  Yields the items of the sorted iterator a that are not in the sorted iterator b.
+  """
+  sentinel = object()
+  current = next(b, sentinel)
+
+  for item in a:
+    while current is not sentinel and current < item:
+      current = next(b, sentinel)
+    if current is sentinel or current != item:
+      yield item
@@ -0,0 +1,222 @@
+import os
+import json
+import hashlib
+import tempfile
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+class FeedCache:
+  """
+  This class keeps a local copy of open source feed downloads.
+  Feed bodies are stored once per content hash (<sha256>.feed). For each list name,
+  a <name>.json file records the URL, ETag, Last-Modified and content hash of the
+  version that was last synced successfully into CRITs. A body that no list refers to,
+  such as the download of a sync that failed, is removed by prune.
+  """
+
+  def __init__(self,directory,chunk_size=64*1024):
+    """
+    Opens (and creates if needed) the cache directory.
+
+    :param directory: The directory that holds the cache.
+    :type directory: str
+    :param chunk_size: The number of bytes read from a cached feed at a time.
+    :type chunk_size: int
+    """
+
+    self.directory = directory
+    self.chunk_size = chunk_size
+
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+
+
+  def _meta_path(self,name):
+    return os.path.join(self.directory, name + '.json')
+
+
+
+  def _content_path(self,digest):
+    return os.path.join(self.directory, digest + '.feed')
+
+
+
+  def synced(self,name):
+    """
+    Returns the version of the list that was last synced, or None.
+
+    :param name: The list name from os_indicators.config.
+    :type name: str
+    :returns: dict with the keys url, etag, last_modified and sha256
+    """
+
+    try:
+      with open(self._meta_path(name),'r') as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return None
+
+
+
+  def conditional_headers(self,name,url):
+    """
+    Returns the If-None-Match/If-Modified-Since headers for the last synced version of the list.
+    No headers are returned if the URL changed or the cached body is missing.
+
+    :param name: The list name from os_indicators.config.
+    :type name: str
+    :param url: The URL that will be requested.
+    :type url: str
+    :returns: dict
+    """
+
+    version = self.synced(name)
+    headers = {}
+
+    if version == None or version.get('url') != url:
+      return headers
+
+    if not os.path.isfile(self._content_path(version['sha256'])):
+      return headers
+
+    if version.get('etag'):
+      headers['If-None-Match'] = version['etag']
+    if version.get('last_modified'):
+      headers['If-Modified-Since'] = version['last_modified']
+
+    return headers
+
+
+
+  def store(self,url,chunks,etag=None,last_modified=None):
+    """
+    Writes a downloaded body into the cache while hashing it.
+
+    :param url: The URL the body was downloaded from.
+    :type url: str
+    :param chunks: The body of the response.
+    :type chunks: iterable of str
+    :param etag: The ETag header of the response.
+    :type etag: str
+    :param last_modified: The Last-Modified header of the response.
+    :type last_modified: str
+    :returns: dict describing the version (url, etag, last_modified, sha256)
+    """
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+    try:
+      with os.fdopen(fd,'wb') as f:
+        for chunk in chunks:
+          digest.update(chunk)
+          f.write(chunk)
+      os.rename(tmp_path, self._content_path(digest.hexdigest()))
+    except:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+    return {'url' : url, 'etag' : etag, 'last_modified' : last_modified, 'sha256' : digest.hexdigest()}
+
+
+
+  def is_synced(self,name,version):
+    """
+    Returns whether version has the same content as the last synced version of the list.
+
+    :param name: The list name from os_indicators.config.
+    :type name: str
+    :param version: A version returned by store.
+    :type version: dict
+    :returns: boolean
+    """
+
+    synced = self.synced(name)
+    return synced != None and synced.get('sha256') == version['sha256']
+
+
+
+  def read(self,version):
+    """
+    Yields the cached body of version in chunks.
+
+    :param version: A version returned by store.
+    :type version: dict
+    :returns: generator of str
+    """
+
+    with open(self._content_path(version['sha256']),'rb') as f:
+      chunk = f.read(self.chunk_size)
+      while chunk:
+        yield chunk
+        chunk = f.read(self.chunk_size)
+
+
+
+  def mark_synced(self,name,version):
+    """
+    Records version as the last successful sync of the list.
+    The body of the version it replaces is removed unless another list still refers to it.
+
+    :param name: The list name from os_indicators.config.
+    :type name: str
+    :param version: A version returned by store.
+    :type version: dict
+    """
+
+    previous = self.synced(name)
+
+    fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    with os.fdopen(fd,'w') as f:
+      json.dump(version, f)
+    os.rename(tmp_path, self._meta_path(name))
+
+    if previous == None or previous.get('sha256') == version['sha256']:
+      return
+
+    for entry in os.listdir(self.directory):
+      if entry.endswith('.json'):
+        other = self.synced(entry[:-len('.json')])
+        if other != None and other.get('sha256') == previous.get('sha256'):
+          return
+
+    old_path = self._content_path(previous['sha256'])
+    if os.path.isfile(old_path):
+      os.remove(old_path)
+
+
+
+  def prune(self):
+    """
+    Removes every body that no list's last synced version refers to, and any temporary
+    files left by an interrupted store or mark_synced.
+    A body that was just stored is not referred to until its sync succeeds, so only call
+    this while no sync is using the cache (e.g. before the feeds are downloaded).
+
+    :returns: int The number of files removed.
+    """
+
+    entries = os.listdir(self.directory)
+
+    referenced = set()
+    for entry in entries:
+      if entry.endswith('.json'):
+        version = self.synced(entry[:-len('.json')])
+        if version != None and version.get('sha256'):
+          referenced.add(version['sha256'])
+
+    removed = 0
+    for entry in entries:
+      if (entry.endswith('.feed') and entry[:-len('.feed')] not in referenced) or entry.endswith('.tmp'):
+        try:
+          os.remove(os.path.join(self.directory, entry))
+          removed += 1
+        except OSError:
+          pass
+
+    return removed
@@ -0,0 +1,367 @@
+import csv
+import re
+from libs2.domainset import normalize_domain
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+#An IPv4 address or CIDR that is not part of a longer dotted value
+IP_PATTERN = r"[0-9]{1,3}(?:\.[0-9]{1,3}){3}(?:/[0-9]{1,2})?(?![0-9./])"
+
+LEADING_IP = re.compile(r"\s*(" + IP_PATTERN + ")")
+WHOLE_IP = re.compile(r"\s*(" + IP_PATTERN + r")\s*$")
+ANY_IP = re.compile(r"(!?)(" + IP_PATTERN + ")")
+
+SNORT_ACTIONS = ('alert', 'log', 'pass', 'drop', 'reject', 'sdrop', 'activate', 'dynamic')
+
+CIDR_TYPE = "Address - cidr"
+IP_TYPE = "Address - ipv4-addr"
+DOMAIN_TYPE = "Domain"
+
+#The names that hosts files map to loopback addresses for the local machine
+HOSTS_LOCAL_NAMES = ('localhost', 'localhost.localdomain', 'local', 'broadcasthost', 'ip6-localhost', 'ip6-loopback')
+
+#The parser factories keyed by format name (see register and register_domain)
+PARSERS = {}
+DOMAIN_PARSERS = {}
+
+
+
+def register(name,options=()):
+  """
+  Registers a parser factory for the <list>_format setting in os_indicators.config.
+  The factory is called once per feed with the list's settings for each name in options
+  (only the ones that are set) and returns a function. That function takes the lines of
+  the feed and returns a generator of (ip, type) tuples.
+
+  :param name: The format name.
+  :type name: str
+  :param options: The setting suffixes the factory accepts (e.g. 'column' for <list>_column).
+  :type options: tuple of str
+  """
+  def decorator(factory):
+    PARSERS[name] = (factory, options)
+    return factory
+  return decorator
+
+
+
+def get_parser(name,**options):
+  """
+  Returns the parser for the named format.
+  Raises ValueError for an unknown format or an invalid option.
+
+  :param name: The format name. None or "" selects plain.
+  :type name: str
+  :param options: The settings for the format's options.
+  :type options: dict
+  :returns: function
+  """
+  return _make_parser(PARSERS,name,options)
+
+
+
+def register_domain(name,options=()):
+  """
+  Registers a domain parser factory for lists with _type set to domain.
+  It works like register, except that the parser yields (domain, 'Domain') tuples
+  with each domain normalized by libs2.domainset.normalize_domain.
+
+  :param name: The format name.
+  :type name: str
+  :param options: The setting suffixes the factory accepts.
+  :type options: tuple of str
+  """
+  def decorator(factory):
+    DOMAIN_PARSERS[name] = (factory, options)
+    return factory
+  return decorator
+
+
+
+def get_domain_parser(name,**options):
+  """
+  Returns the domain parser for the named format.
+  Raises ValueError for an unknown format or an invalid option.
+
+  :param name: The format name. None or "" selects plain.
+  :type name: str
+  :param options: The settings for the format's options.
+  :type options: dict
+  :returns: function
+  """
+  return _make_parser(DOMAIN_PARSERS,name,options)
+
+
+
+def _make_parser(registry,name,options):
+  if not name:
+    name = 'plain'
+
+  if name not in registry:
+    raise ValueError("Unknown feed format '" + name + "'. Supported formats: " + ", ".join(sorted(registry)))
+
+  factory, accepted = registry[name]
+  for option in options:
+    if option not in accepted:
+      raise ValueError("The " + name + " format does not accept the option '" + option + "'")
+
+  return factory(**options)
+
+
+
+def format_options(name,kind='ip'):
+  """
+  Returns the setting suffixes that the named format accepts.
+
+  :param name: The format name.
+  :type name: str
+  :param kind: 'ip' or 'domain'.
+  :type kind: str
+  :returns: tuple of str
+  """
+  registry = DOMAIN_PARSERS if kind == 'domain' else PARSERS
+  if name in registry:
+    return registry[name][1]
+  return ()
+
+
+
+def ip_type(ip):
+  """
+  Returns the CRITs type of an IP value ('Address - cidr' or 'Address - ipv4-addr').
+
+  :param ip: An IP address or CIDR.
+  :type ip: str
+  :returns: str
+  """
+  if ip.find("/") != -1:
+    return CIDR_TYPE
+  return IP_TYPE
+
+
+
+@register('plain')
+def plain():
+  """
+  One entry per line. The IP or CIDR at the start of the line is used and anything
+  after it (ports, comments, descriptions) is ignored.
+  """
+  match = LEADING_IP.match
+
+  def parse(lines):
+    for line in lines:
+      m = match(line)
+      if m != None:
+        ip = m.group(1)
+        yield (ip, CIDR_TYPE if '/' in ip else IP_TYPE)
+
+  return parse
+
+
+
+@register('netset')
+def netset():
+  """
+  FireHOL style netsets. Each line is exactly one IP or CIDR. Comments and any
+  other lines are skipped.
+  """
+  match = WHOLE_IP.match
+
+  def parse(lines):
+    for line in lines:
+      m = match(line)
+      if m != None:
+        ip = m.group(1)
+        yield (ip, CIDR_TYPE if '/' in ip else IP_TYPE)
+
+  return parse
+
+
+
+@register('csv', ('column', 'delimiter'))
+def csv_column(column='0',delimiter=','):
+  """
+  Delimited files such as the SSLBL blacklist (timestamp,ip,port).
+  column is the zero based index of the IP column. Lines starting with # are skipped.
+  """
+  if not column.isdigit():
+    raise ValueError("The csv column must be a zero based column number")
+  if len(delimiter) != 1:
+    raise ValueError("The csv delimiter must be a single character")
+
+  column = int(column)
+  match = WHOLE_IP.match
+
+  def parse(lines):
+    for row in csv.reader((line for line in lines if not line.startswith('#')), delimiter=delimiter):
+      if len(row) > column:
+        m = match(row[column])
+        if m != None:
+          ip = m.group(1)
+          yield (ip, CIDR_TYPE if '/' in ip else IP_TYPE)
+
+  return parse
+
+
+
+@register('snort')
+def snort():
+  """
+  Snort rules and Snort reputation lists. For a rule, every address in the
+  rule header is used except negated ones. Any other line is read like plain.
+  """
+  match = LEADING_IP.match
+  findall = ANY_IP.findall
+
+  def parse(lines):
+    for line in lines:
+      stripped = line.lstrip()
+      if stripped.startswith(SNORT_ACTIONS):
+        for negated, ip in findall(stripped.split('(',1)[0]):
+          if not negated:
+            yield (ip, CIDR_TYPE if '/' in ip else IP_TYPE)
+        continue
+
+      m = match(line)
+      if m != None:
+        ip = m.group(1)
+        yield (ip, CIDR_TYPE if '/' in ip else IP_TYPE)
+
+  return parse
+
+
+
+@register('regex', ('pattern',))
+def regex(pattern=None):
+  """
+  Feeds that need a custom pattern. The first group of pattern (or the whole match
+  if it has no groups) is searched for in each line and used when it is an IP or CIDR.
+  """
+  if not pattern:
+    raise ValueError("The regex format requires a pattern")
+
+  search = re.compile(pattern).search
+  match = WHOLE_IP.match
+
+  def parse(lines):
+    for line in lines:
+      m = search(line)
+      if m != None:
+        value = m.group(1) if m.re.groups else m.group(0)
+        found = match(value) if value != None else None
+        if found != None:
+          ip = found.group(1)
+          yield (ip, CIDR_TYPE if '/' in ip else IP_TYPE)
+
+  return parse
+
+
+
+@register_domain('plain')
+def plain_domains():
+  """
+  One domain per line. The first word of the line is used and anything after it is
+  ignored. Lines starting with # or ; are comments.
+  """
+  def parse(lines):
+    for line in lines:
+      words = line.split(None, 1)
+      if len(words) == 0 or words[0][0] in '#;':
+        continue
+      domain = normalize_domain(words[0])
+      if domain != None:
+        yield (domain, DOMAIN_TYPE)
+
+  return parse
+
+
+
+@register_domain('hosts')
+def hosts_domains():
+  """
+  Hosts files that map blocked names to an address (e.g. "0.0.0.0 example.com").
+  Every name after the address is used, except the names of the local machine.
+  """
+  def parse(lines):
+    for line in lines:
+      words = line.split('#', 1)[0].split()
+      for word in words[1:]:
+        if word.lower() in HOSTS_LOCAL_NAMES:
+          continue
+        domain = normalize_domain(word)
+        if domain != None:
+          yield (domain, DOMAIN_TYPE)
+
+  return parse
+
+
+
+@register_domain('adblock')
+def adblock_domains():
+  """
+  Adblock style domain rules ("||example.com^"). Rules with a path, a wildcard or
+  an exception (@@) are skipped, as are comments starting with !.
+  """
+  def parse(lines):
+    for line in lines:
+      line = line.strip()
+      if not line.startswith('||'):
+        continue
+      rule = line[2:].split('$', 1)[0].rstrip('^|')
+      if '/' in rule or '*' in rule or '^' in rule:
+        continue
+      domain = normalize_domain(rule)
+      if domain != None:
+        yield (domain, DOMAIN_TYPE)
+
+  return parse
+
+
+
+@register_domain('csv', ('column', 'delimiter'))
+def csv_domains(column='0',delimiter=','):
+  """
+  Delimited files with the domain in column (zero based). Lines starting with # are skipped.
+  """
+  if not column.isdigit():
+    raise ValueError("The csv column must be a zero based column number")
+  if len(delimiter) != 1:
+    raise ValueError("The csv delimiter must be a single character")
+
+  column = int(column)
+
+  def parse(lines):
+    for row in csv.reader((line for line in lines if not line.startswith('#')), delimiter=delimiter):
+      if len(row) > column:
+        domain = normalize_domain(row[column])
+        if domain != None:
+          yield (domain, DOMAIN_TYPE)
+
+  return parse
+
+
+
+@register_domain('regex', ('pattern',))
+def regex_domains(pattern=None):
+  """
+  Feeds that need a custom pattern. The first group of pattern (or the whole match
+  if it has no groups) is searched for in each line and used when it is a valid domain.
+  """
+  if not pattern:
+    raise ValueError("The regex format requires a pattern")
+
+  search = re.compile(pattern).search
+
+  def parse(lines):
+    for line in lines:
+      m = search(line)
+      if m != None:
+        value = m.group(1) if m.re.groups else m.group(0)
+        domain = normalize_domain(value)
+        if domain != None:
+          yield (domain, DOMAIN_TYPE)
+
+  return parse
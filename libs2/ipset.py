@@ -0,0 +1,685 @@
+import bisect
+import socket
+import sys
+import struct
+from array import array
+from itertools import compress
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+UINT32 = struct.Struct('!I')
+
+#An unsigned 32-bit array typecode
+if array('I').itemsize == 4:
+  TYPECODE = 'I'
+else:
+  TYPECODE = 'L'
+
+#The kinds of value found by _scan
+ADDRESS = 0
+BLOCK = 1
+OTHER = 2
+
+#The longest IPv4 address or CIDR ("255.255.255.255/32")
+MAX_BLOCK_LENGTH = 18
+
+#The number of strings parsed at a time with NumPy, which bounds the size of its byte matrices
+SCAN_CHUNK_SIZE = 65536
+
+
+
+def ip_to_int(ip):
+  """
+  Converts a canonical dotted-quad IPv4 address to an integer.
+  Anything else (CIDRs, leading zeros, short forms) returns None
+  so that it is never rewritten into a different string.
+
+  :param ip: The IP address.
+  :type ip: str
+  :returns: int
+  """
+  try:
+    packed = socket.inet_aton(ip)
+  except (socket.error, UnicodeError, TypeError):
+    return None
+
+  #inet_aton also accepts forms like "10.1" and "010.0.0.1". Only keep exact round trips.
+  if socket.inet_ntoa(packed) != ip:
+    return None
+
+  return UINT32.unpack(packed)[0]
+
+
+
+def int_to_ip(value):
+  """
+  Converts an integer back to a dotted-quad IPv4 address.
+
+  :param value: The address as an integer.
+  :type value: int
+  :returns: str
+  """
+  return "%d.%d.%d.%d" % ((value >> 24) & 255, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+
+
+class IPv4Set:
+  """
+  A set of IP strings that stores IPv4 addresses as sorted 32-bit integers.
+  Addresses take 4 bytes each in a packed array (or a NumPy array when NumPy is installed)
+  and set differences are computed with a sorted merge instead of hashing strings.
+  Values that are not plain IPv4 addresses, such as CIDRs, are kept as strings alongside.
+  The values are never rewritten, so iterating the set yields the entries it was built from.
+  """
+
+  def __init__(self,values=()):
+    """
+    Builds the set from an iterable of IP strings or another IPv4Set.
+
+    :param values: The values to store.
+    :type values: iterable of str
+    """
+
+    self.ranges = None
+
+    if isinstance(values, IPv4Set):
+      self.ints = values.ints
+      self.others = set(values.others)
+      return
+
+    ints, others = _parse(values)
+    self.ints = _sorted_unique(ints)
+    self.others = others
+
+
+
+  @classmethod
+  def _from_parts(cls,ints,others):
+    result = cls()
+    result.ints = ints
+    result.others = others
+    result.ranges = None
+    return result
+
+
+
+  def __len__(self):
+    return len(self.ints) + len(self.others)
+
+
+
+  def __iter__(self):
+    for number in self.ints:
+      yield int_to_ip(int(number))
+    for value in self.others:
+      yield value
+
+
+
+  def __contains__(self,value):
+    number = ip_to_int(value)
+    if number == None:
+      return value in self.others
+
+    if numpy != None:
+      i = numpy.searchsorted(self.ints, number)
+      return i < len(self.ints) and self.ints[i] == number
+
+    i = bisect.bisect_left(self.ints, number)
+    return i < len(self.ints) and self.ints[i] == number
+
+
+
+  def covers(self,values):
+    """
+    Returns, for each value, whether every address in it is in the set.
+    CIDRs, in the set and in values, are compared by the addresses they cover
+    (see IPv4Ranges.covers), so a CIDR is covered by the addresses that fill it.
+
+    :param values: The IP and CIDR strings to check.
+    :type values: iterable of str
+    :returns: list of bool
+    """
+
+    return self._ranges().covers(values)
+
+
+
+  def split(self,values):
+    """
+    Splits values into the ones the set covers and the ones it does not (see covers).
+    The covered values are also returned as an IPv4Ranges built from the same parse,
+    so that they can be taken out of another set without being parsed again.
+
+    :param values: The IP and CIDR strings to check.
+    :type values: iterable of str
+    :returns: list (covered), list (not covered), IPv4Ranges (covered)
+    """
+
+    if not isinstance(values, list):
+      values = [value for value in values]
+
+    ranges = self._ranges()
+    starts, ends, others = _parse_blocks(values)
+    covered = ranges._covers_blocks(starts, ends, others)
+
+    kept_others = [value for position, value in others if covered[position]]
+    if numpy != None:
+      kept = IPv4Ranges._from_blocks(starts[covered], ends[covered], kept_others)
+      uncovered = (~covered).tolist()
+      covered = covered.tolist()
+    else:
+      kept = IPv4Ranges._from_blocks(list(compress(starts, covered)), list(compress(ends, covered)), kept_others)
+      uncovered = [not is_covered for is_covered in covered]
+
+    return list(compress(values, covered)), list(compress(values, uncovered)), kept
+
+
+
+  def _ranges(self):
+    """
+    Returns the IPv4Ranges that covers the same addresses. It is built on first use.
+    """
+
+    if self.ranges == None:
+      starts, ends, others = _parse_blocks(self.others)
+      self.ranges = IPv4Ranges._from_blocks(_concat(self.ints, starts), _concat(self.ints, ends),
+                                            [value for position, value in others])
+    return self.ranges
+
+
+
+  def difference(self,other):
+    """
+    Returns the values in this set that are not in other.
+    If other is an IPv4Ranges, every value that it covers is removed, so an address
+    inside one of its CIDRs is removed too.
+
+    :param other: The values to remove.
+    :type other: IPv4Set, IPv4Ranges or iterable of str
+    :returns: IPv4Set
+    """
+
+    if isinstance(other, IPv4Ranges):
+      others = list(self.others)
+      remaining = set(value for value, covered in zip(others, other.covers(others)) if not covered)
+      return IPv4Set._from_parts(other._uncovered(self.ints), remaining)
+
+    if not isinstance(other, IPv4Set):
+      other = IPv4Set(other)
+
+    if numpy != None:
+      ints = numpy.setdiff1d(self.ints, other.ints, assume_unique=True)
+    else:
+      ints = _merge_difference(self.ints, other.ints)
+
+    return IPv4Set._from_parts(ints, self.others.difference(other.others))
+
+
+
+class IPv4Ranges:
+  """
+  A CIDR-aware set of IP strings stored as sorted, disjoint address intervals.
+  Addresses and CIDR blocks are merged when they overlap or are adjacent, so the set
+  can answer whether an address or block is covered by any of its entries.
+  It is only used for coverage tests. The entries written to CRITs are always the
+  feed's own (see IPv4Set.covers and IPv4Set.difference).
+  Values that are neither IPv4 addresses nor valid CIDRs are kept as strings alongside.
+  """
+
+  def __init__(self,values=()):
+    """
+    Builds the set from an iterable of IP and CIDR strings.
+
+    :param values: The values to store.
+    :type values: iterable of str
+    """
+
+    starts, ends, others = _parse_blocks(values)
+    self.starts, self.ends = _merge_intervals(starts, ends)
+    self.others = set(value for position, value in others)
+
+
+
+  @classmethod
+  def _from_blocks(cls,starts,ends,others):
+    result = cls()
+    result.starts, result.ends = _merge_intervals(starts, ends)
+    result.others = set(others)
+    return result
+
+
+
+  def __len__(self):
+    """
+    Returns the number of disjoint intervals plus the number of values kept as strings.
+    """
+
+    return len(self.starts) + len(self.others)
+
+
+
+  def covers(self,values):
+    """
+    Returns, for each value, whether it is entirely covered by the set.
+    An address or CIDR is covered when every address in it is in the set.
+    Other strings are covered only by the identical string.
+
+    :param values: The IP and CIDR strings to check.
+    :type values: iterable of str
+    :returns: list of bool
+    """
+
+    starts, ends, others = _parse_blocks(values)
+    result = self._covers_blocks(starts, ends, others)
+    if numpy != None:
+      result = result.tolist()
+    return result
+
+
+
+  def __contains__(self,value):
+    return self.covers([value])[0]
+
+
+
+  def _covers_blocks(self,starts,ends,others):
+    """
+    Returns covers for values already converted by _parse_blocks,
+    as a NumPy bool array when NumPy is installed and a list otherwise.
+    """
+
+    result = self._covered(starts, ends)
+    for position, value in others:
+      result[position] = value in self.others
+    return result
+
+
+
+  def _covered(self,starts,ends):
+    """
+    Returns whether each interval lies inside one of the set's intervals,
+    as a NumPy bool array when NumPy is installed and a list otherwise.
+    """
+
+    if numpy != None:
+      if len(self.starts) == 0:
+        return numpy.zeros(len(starts), dtype=bool)
+      #Searching for the intervals in order is about twice as fast as in the order given
+      order = numpy.argsort(starts)
+      i = numpy.searchsorted(self.starts, starts[order], side='right') - 1
+      result = numpy.empty(len(starts), dtype=bool)
+      result[order] = (i >= 0) & (ends[order] <= self.ends[numpy.maximum(i, 0)])
+      return result
+
+    result = []
+    for start, end in zip(starts, ends):
+      i = bisect.bisect_right(self.starts, start) - 1
+      result.append(i >= 0 and end <= self.ends[i])
+    return result
+
+
+
+  def _uncovered(self,ints):
+    """
+    Returns the addresses of the sorted integer array ints that the set does not cover.
+    """
+
+    if numpy != None:
+      return ints[~self._covered(ints, ints)]
+
+    result = array(TYPECODE)
+    j = 0
+    count = len(self.starts)
+    for number in ints:
+      while j < count and self.ends[j] < number:
+        j += 1
+      if j == count or self.starts[j] > number:
+        result.append(number)
+    return result
+
+
+
+def parse_block(value):
+  """
+  Converts an IPv4 address or CIDR to its first and last address as integers.
+  Host bits set in a CIDR are ignored. Anything else returns None.
+
+  :param value: The address or CIDR.
+  :type value: str
+  :returns: (int, int)
+  """
+  address, slash, prefix = value.partition('/')
+
+  start = ip_to_int(address)
+  if start == None:
+    return None
+
+  if not slash:
+    return (start, start)
+
+  if not prefix.isdigit() or int(prefix) > 32 or (len(prefix) > 1 and prefix[0] == '0'):
+    return None
+
+  size = 1 << (32 - int(prefix))
+  start = start & ~(size - 1) & 0xFFFFFFFF
+  return (start, start + size - 1)
+
+
+
+def _parse(values):
+  """
+  Splits IP strings into an integer array of the addresses and a set of the other strings (including CIDRs).
+  """
+  values, starts, ends, kinds = _scan(values)
+
+  if numpy != None:
+    others = numpy.flatnonzero(kinds != ADDRESS)
+    return starts[kinds == ADDRESS], set(values[i] for i in others)
+
+  ints = array(TYPECODE)
+  others = set()
+  for value, start, kind in zip(values, starts, kinds):
+    if kind == ADDRESS:
+      ints.append(start)
+    else:
+      others.add(value)
+  return ints, others
+
+
+
+def _parse_blocks(values):
+  """
+  Converts IP and CIDR strings to the first and last address of each, as integer arrays
+  in the same order as the values. Other values are returned with their position and
+  get an empty interval (start > end), so the arrays stay aligned with the values.
+  """
+  values, starts, ends, kinds = _scan(values)
+
+  if numpy != None:
+    others = numpy.flatnonzero(kinds == OTHER).tolist()
+  else:
+    others = [i for i, kind in enumerate(kinds) if kind == OTHER]
+
+  return starts, ends, [(i, values[i]) for i in others]
+
+
+
+def _scan(values):
+  """
+  Classifies each value as an ADDRESS, a BLOCK (a CIDR) or OTHER and finds the first and last
+  address of each. Returns the values as a list with the aligned start, end and kind arrays.
+  Other values get an empty interval (start > end).
+  With NumPy, the strings are parsed a chunk at a time as byte matrices, and only the
+  strings that the scan rejects are checked again one at a time.
+  """
+  if not isinstance(values, list):
+    values = [value for value in values]
+
+  if numpy != None and len(values) > 0:
+    try:
+      chunks = [_scan_numpy(values[i:i + SCAN_CHUNK_SIZE]) for i in xrange(0, len(values), SCAN_CHUNK_SIZE)]
+    except (TypeError, ValueError, UnicodeError):
+      pass
+    else:
+      starts, ends, kinds = [numpy.concatenate(parts) for parts in zip(*chunks)]
+      for i in numpy.flatnonzero(kinds == OTHER).tolist():
+        kinds[i], starts[i], ends[i] = _classify(values[i])
+      return values, starts, ends, kinds
+
+  starts = bytearray()
+  ends = bytearray()
+  kinds = array('b')
+  pack = UINT32.pack
+
+  for value in values:
+    kind, start, end = _classify(value)
+    starts.extend(pack(start))
+    ends.extend(pack(end))
+    kinds.append(kind)
+
+  if numpy != None:
+    kinds = numpy.frombuffer(kinds.tostring(), dtype=numpy.int8)
+  return values, _unpack(starts), _unpack(ends), kinds
+
+
+
+def _classify(value):
+  """
+  Returns the kind, first address and last address of one value.
+  """
+  try:
+    address = socket.inet_aton(value)
+  except (socket.error, UnicodeError, TypeError):
+    address = None
+
+  #inet_aton also accepts forms like "10.1" and "010.0.0.1". Only keep exact round trips.
+  if address != None and socket.inet_ntoa(address) == value:
+    number = UINT32.unpack(address)[0]
+    return ADDRESS, number, number
+
+  block = None
+  if isinstance(value, basestring) and '/' in value:
+    block = parse_block(value)
+  if block != None:
+    return BLOCK, block[0], block[1]
+
+  return OTHER, 0xFFFFFFFF, 0
+
+
+
+def _scan_numpy(values):
+  """
+  Parses canonical dotted-quad addresses and CIDRs with NumPy. The strings are stored as the
+  columns of a byte matrix and every string advances through one row of it at a time.
+  Strings that are not exactly an address or a CIDR (including anything longer than
+  MAX_BLOCK_LENGTH or containing NUL bytes) are returned as OTHER.
+  Raises TypeError, ValueError or UnicodeError when the values cannot be made into byte strings.
+  """
+  count = len(values)
+  text = "\n".join(values)
+  if isinstance(text, unicode):
+    text = text.encode('utf-8')
+  text = numpy.frombuffer(text, dtype=numpy.uint8)
+
+  #The newlines mark where each string ends. A string containing one would shift the rest.
+  ends = numpy.flatnonzero(text == 10)
+  if len(ends) != count - 1:
+    raise ValueError("a value contains a newline")
+  ends = numpy.append(ends, len(text))
+  offsets = numpy.concatenate(([0], ends[:-1] + 1))
+  lengths = ends - offsets
+
+  #Row i holds the i-th character of every string, padded with NUL bytes
+  chars = numpy.zeros((MAX_BLOCK_LENGTH, count), dtype=numpy.uint8)
+  text = numpy.append(text, numpy.uint8(0))
+  for row in xrange(MAX_BLOCK_LENGTH):
+    chars[row] = numpy.where(row < lengths, text[numpy.minimum(offsets + row, len(text) - 1)], 0)
+
+  digit = (chars >= 48) & (chars <= 57)
+  dot = chars == 46
+  slash = chars == 47
+  separator = dot | slash
+
+  #Every character is a digit, a dot or a slash, with exactly three dots and at most one slash
+  bad = lengths > MAX_BLOCK_LENGTH
+  bad |= lengths != numpy.count_nonzero(chars, axis=0)
+  bad |= (digit | separator).sum(axis=0) != lengths
+  bad |= dot.sum(axis=0) != 3
+  slashes = slash.sum(axis=0)
+  bad |= slashes > 1
+
+  #A digit shifts the field's value up, a separator starts a new field and padding leaves it alone
+  keep = (~separator).view(numpy.int8)
+  shift = digit.view(numpy.int8) * numpy.int8(9) + keep
+  numbers = ((chars - numpy.uint8(48)) * digit.view(numpy.uint8)).view(numpy.int8)
+  del chars
+
+  value = numpy.zeros(count, dtype=numpy.int32)
+  digits = numpy.zeros(count, dtype=numpy.int8)
+  fields = numpy.zeros(count, dtype=numpy.int8)
+  address = numpy.zeros(count, dtype=numpy.int64)
+
+  for row in xrange(MAX_BLOCK_LENGTH):
+    ended = numpy.flatnonzero(separator[row])
+    if len(ended):
+      octet = value[ended]
+      bad[ended] |= (octet > 255) | (digits[ended] != _decimal_digits(octet))
+      #The slash may only follow the fourth octet
+      bad[ended] |= slash[row][ended] & (fields[ended] != 3)
+      address[ended] = address[ended] * 256 + octet
+      fields[ended] += 1
+
+    value = value * shift[row] + numbers[row]
+    digits = digits * keep[row] + digit[row]
+
+  #The last field is the fourth octet of an address or the prefix length of a CIDR
+  bad |= digits != _decimal_digits(value)
+
+  is_address = ~bad & (slashes == 0) & (value <= 255)
+  is_block = ~bad & (slashes == 1) & (value <= 32)
+
+  starts = numpy.full(count, 0xFFFFFFFF, dtype=numpy.uint32)
+  ends = numpy.zeros(count, dtype=numpy.uint32)
+  kinds = numpy.full(count, OTHER, dtype=numpy.int8)
+
+  host = address[is_address] * 256 + value[is_address]
+  starts[is_address] = host
+  ends[is_address] = host
+  kinds[is_address] = ADDRESS
+
+  size = numpy.left_shift(1, 32 - value[is_block].astype(numpy.int64))
+  first = address[is_block] & ~(size - 1)
+  starts[is_block] = first
+  ends[is_block] = first + size - 1
+  kinds[is_block] = BLOCK
+
+  return starts, ends, kinds
+
+
+
+def _decimal_digits(values):
+  """
+  Returns the number of digits each value is written with, so that fields with
+  leading zeros (or too many digits) can be found by comparing the two.
+  """
+  return 1 + (values >= 10).astype(numpy.int8) + (values >= 100) + (values >= 1000)
+
+
+
+def _unpack(packed):
+  """
+  Converts packed network order addresses to an integer array in the same order
+  (a uint32 NumPy array when NumPy is installed).
+  """
+  if numpy != None:
+    return numpy.frombuffer(bytes(packed), dtype='>u4').astype(numpy.uint32)
+
+  ints = array('I')
+  if ints.itemsize == 4:
+    ints.fromstring(bytes(packed))
+    if sys.byteorder == 'little':
+      ints.byteswap()
+    return ints
+
+  return array(TYPECODE, (UINT32.unpack_from(packed, i)[0] for i in xrange(0, len(packed), 4)))
+
+
+
+def _concat(a,b):
+  """
+  Joins two integer arrays.
+  """
+  if numpy != None:
+    return numpy.concatenate((numpy.asarray(a, dtype=numpy.uint32), numpy.asarray(b, dtype=numpy.uint32)))
+  return array(TYPECODE, a) + array(TYPECODE, b)
+
+
+
+def _merge_intervals(starts,ends):
+  """
+  Sorts inclusive intervals and merges the ones that overlap or touch.
+  Empty intervals (start > end) are dropped.
+  Returns the start and end arrays of the merged intervals.
+  """
+  if numpy != None:
+    starts = numpy.asarray(starts, dtype=numpy.uint32)
+    ends = numpy.asarray(ends, dtype=numpy.uint32)
+    keep = starts <= ends
+    starts = starts[keep]
+    ends = ends[keep]
+    if len(starts) == 0:
+      return starts, ends
+
+    #The addresses of an IPv4Set are already sorted
+    if (starts[1:] < starts[:-1]).any():
+      order = numpy.argsort(starts, kind='mergesort')
+      starts = starts[order]
+      ends = ends[order]
+    ends = numpy.maximum.accumulate(ends)
+
+    #An interval starts a new group when it begins after everything before it has ended.
+    begins = numpy.ones(len(starts), dtype=bool)
+    begins[1:] = starts[1:] > ends[:-1].astype(numpy.int64) + 1
+    first = numpy.flatnonzero(begins)
+    last = numpy.append(first[1:] - 1, len(starts) - 1)
+    return starts[first], ends[last]
+
+  merged_starts = array(TYPECODE)
+  merged_ends = array(TYPECODE)
+
+  for start, end in sorted(zip(starts, ends)):
+    if start > end:
+      continue
+    if len(merged_starts) and start <= merged_ends[-1] + 1:
+      if end > merged_ends[-1]:
+        merged_ends[-1] = end
+    else:
+      merged_starts.append(start)
+      merged_ends.append(end)
+
+  return merged_starts, merged_ends
+
+
+
+def _sorted_unique(ints):
+  """
+  Converts an integer array of addresses to a sorted array without duplicates.
+  """
+  if numpy != None:
+    return numpy.unique(ints).astype(numpy.uint32)
+
+  result = array(TYPECODE)
+  last = None
+  for number in sorted(ints):
+    if number != last:
+      result.append(number)
+      last = number
+
+  return result
+
+
+
+def _merge_difference(a,b):
+  """
+  Returns the integers of sorted array a that are not in sorted array b.
+  """
+  result = array(TYPECODE)
+  j = 0
+  len_b = len(b)
+
+  for number in a:
+    while j < len_b and b[j] < number:
+      j += 1
+    if j == len_b or b[j] != number:
+      result.append(number)
+
+  return result
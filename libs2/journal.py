@@ -0,0 +1,193 @@
+import json
+import sqlite3
+import time
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+class WriteJournal:
+  """
+  This class keeps an on-disk SQLite outbox of the writes that a sync will send to CRITs.
+  Before a sync sends anything, every add and removal it decided on is stored under the
+  sync's key (e.g. 'ip:OS-Palevo'). Each write is marked done as soon as CRITs accepts it,
+  and the sync is forgotten once nothing is outstanding. If a run is interrupted, the next
+  run finds the outstanding writes and only has to send those.
+  A write that keeps failing is given up after max_attempts tries so that it can not block
+  the campaign's syncs forever.
+  """
+
+  def __init__(self,path,max_attempts=3):
+    """
+    Opens (and creates if needed) the journal database.
+
+    :param path: The file name of the SQLite database.
+    :type path: str
+    :param max_attempts: The number of times a write is tried before it is given up.
+    :type max_attempts: int
+    """
+
+    self.path = path
+    self.max_attempts = max_attempts
+    #Lists synced at the same time share the file, so wait for each other's commits.
+    self.db = sqlite3.connect(path, timeout=60)
+    self.db.execute("""CREATE TABLE IF NOT EXISTS syncs (
+                         key TEXT PRIMARY KEY, name TEXT, campaign TEXT, source TEXT,
+                         indicator TEXT, confidence TEXT, feed_version TEXT, created REAL)""")
+    self.db.execute("""CREATE TABLE IF NOT EXISTS writes (
+                         key TEXT, seq INTEGER, op TEXT, value TEXT, record TEXT,
+                         attempts INTEGER, error TEXT,
+                         PRIMARY KEY (key, seq))""")
+    self.db.commit()
+
+
+
+  def begin(self,key,name,campaign,source,indicator,confidence,adds,removals,feed_version=None):
+    """
+    Stores the writes of a sync, replacing any earlier sync with the same key.
+    The adds are stored before the removals, which is the order they are sent in.
+
+    :param key: The key of the sync.
+    :type key: str
+    :param name: The name of the list being synced.
+    :type name: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    :param source: The source name.
+    :type source: str
+    :param indicator: Whether the adds are indicators.
+    :type indicator: boolean
+    :param confidence: The confidence of the adds.
+    :type confidence: str
+    :param adds: The IPs and CIDRs to add.
+    :type adds: iterable of str
+    :param removals: The removal records (see plan_removals).
+    :type removals: iterable of dict
+    :param feed_version: The version of the feed being synced (see feed_cache).
+    :type feed_version: dict
+    :returns: int The number of writes stored.
+    """
+
+    self.db.execute("DELETE FROM writes WHERE key=?", (key,))
+    self.db.execute("INSERT OR REPLACE INTO syncs VALUES (?,?,?,?,?,?,?,?)",
+                    (key, name, campaign, source, json.dumps(indicator), confidence,
+                     json.dumps(feed_version), time.time()))
+
+    writes = [('add', value, None) for value in adds]
+    writes.extend(('remove', record['value'], json.dumps(record)) for record in removals)
+
+    self.db.executemany("INSERT INTO writes VALUES (?,?,?,?,?,0,NULL)",
+                        ((key, seq, op, value, record) for seq, (op, value, record) in enumerate(writes)))
+    self.db.commit()
+
+    return len(writes)
+
+
+
+  def pending(self,key):
+    """
+    Returns the sync stored under key and its outstanding writes, or None if there is no such sync.
+    The sync is a dict with the keys name, campaign, source, indicator, confidence,
+    feed_version and created. Each write is a dict with the keys seq, op ('add' or 'remove'),
+    value, record (the removal record, for removals) and attempts.
+
+    :param key: The key of the sync.
+    :type key: str
+    :returns: dict, list of dict
+    """
+
+    row = self.db.execute("SELECT name, campaign, source, indicator, confidence, feed_version, created "
+                          "FROM syncs WHERE key=?", (key,)).fetchone()
+    if row == None:
+      return None
+
+    sync = {'name' : row[0], 'campaign' : row[1], 'source' : row[2], 'indicator' : json.loads(row[3]),
+            'confidence' : row[4], 'feed_version' : json.loads(row[5]), 'created' : row[6]}
+
+    writes = []
+    for seq, op, value, record, attempts in self.db.execute(
+          "SELECT seq, op, value, record, attempts FROM writes WHERE key=? ORDER BY seq", (key,)):
+      if record != None:
+        record = dict((str(k), str(v)) for k, v in json.loads(record).items())
+      writes.append({'seq' : seq, 'op' : str(op), 'value' : str(value), 'record' : record, 'attempts' : attempts})
+
+    return sync, writes
+
+
+
+  def complete(self,key,seqs):
+    """
+    Marks writes as done, which removes them from the outbox.
+
+    :param key: The key of the sync.
+    :type key: str
+    :param seqs: The seq of each write that CRITs accepted.
+    :type seqs: iterable of int
+    """
+
+    self.db.executemany("DELETE FROM writes WHERE key=? AND seq=?", ((key, seq) for seq in seqs))
+    self.db.commit()
+
+
+
+  def failed(self,key,failures):
+    """
+    Counts a failed attempt for writes. Writes that have used up their attempts are given up.
+
+    :param key: The key of the sync.
+    :type key: str
+    :param failures: The seq of each failed write mapped to the error message.
+    :type failures: dict
+    :returns: list of int The seq of each write that was given up.
+    """
+
+    self.db.executemany("UPDATE writes SET attempts=attempts+1, error=? WHERE key=? AND seq=?",
+                        ((message, key, seq) for seq, message in failures.items()))
+    abandoned = [row[0] for row in self.db.execute(
+                   "SELECT seq FROM writes WHERE key=? AND attempts>=?", (key, self.max_attempts))]
+    self.db.executemany("DELETE FROM writes WHERE key=? AND seq=?", ((key, seq) for seq in abandoned))
+    self.db.commit()
+
+    return abandoned
+
+
+
+  def finish(self,key):
+    """
+    Forgets the sync if it has no outstanding writes.
+
+    :param key: The key of the sync.
+    :type key: str
+    :returns: boolean Whether the sync was forgotten.
+    """
+
+    if self.db.execute("SELECT COUNT(*) FROM writes WHERE key=?", (key,)).fetchone()[0] > 0:
+      return False
+
+    self.db.execute("DELETE FROM syncs WHERE key=?", (key,))
+    self.db.commit()
+    return True
+
+
+
+  def discard(self,key):
+    """
+    Forgets the sync and its outstanding writes.
+
+    :param key: The key of the sync.
+    :type key: str
+    """
+
+    self.db.execute("DELETE FROM writes WHERE key=?", (key,))
+    self.db.execute("DELETE FROM syncs WHERE key=?", (key,))
+    self.db.commit()
+
+
+
+  def close(self):
+    """
+    Closes the database.
+    """
+
+    self.db.close()
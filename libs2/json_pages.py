@@ -0,0 +1,157 @@
+import json
+
+#ijson decodes a page as it is read, so only the projected objects are ever held.
+try:
+  import ijson
+except ImportError:
+  ijson = None
+
+#Without ijson, each page is read whole and the fastest installed JSON module decodes it in one call.
+#That is not incremental: the page's bytes and all of its decoded objects are held at once.
+try:
+  import ujson as fast_json
+except ImportError:
+  try:
+    import simplejson as fast_json
+  except ImportError:
+    fast_json = json
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+#Whether pages are decoded incrementally
+STREAMING = ijson != None
+
+#The name of the module that decodes the pages, and how it reads them
+if STREAMING:
+  BACKEND = 'ijson (incremental)'
+else:
+  BACKEND = fast_json.__name__ + ' (whole page)'
+
+
+
+def project(obj,fields):
+  """
+  Returns a copy of a CRITs object with only the named fields.
+  A dotted name selects a field of a nested object, or of each object in a nested list
+  (e.g. campaign.name keeps the name of every campaign). Missing fields are left out.
+
+  :param obj: The decoded object.
+  :type obj: dict
+  :param fields: The names of the fields to keep. None keeps every field.
+  :type fields: list of str
+  :returns: dict
+  """
+  if not fields or not isinstance(obj, dict):
+    return obj
+
+  nested = {}
+  for field in fields:
+    head, dot, rest = field.partition('.')
+    nested.setdefault(head, []).append(rest)
+
+  result = {}
+  for head, rests in nested.items():
+    if head not in obj:
+      continue
+    value = obj[head]
+    if "" in rests:
+      result[head] = value
+    elif isinstance(value, list):
+      result[head] = [project(item, rests) for item in value]
+    else:
+      result[head] = project(value, rests)
+
+  return result
+
+
+
+def decode(data,fields=None):
+  """
+  Decodes a CRITs response and projects each object in its objects list to fields.
+  With ijson, the objects are decoded and projected one at a time as the chunks are read.
+  Otherwise the chunks are joined and the whole body is decoded in one call by the fastest
+  JSON module installed, so the memory used grows with the size of the page. Install ijson
+  to decode large pages incrementally.
+  Both read the raw bytes, so the body is never decoded to text first.
+
+  :param data: The response body, or an iterable of its chunks (e.g. Response.iter_content()).
+  :type data: str or iterable of str
+  :param fields: The fields to keep in each object (see project). None keeps every field.
+  :type fields: list of str
+  :returns: dict
+  """
+  if STREAMING:
+    if isinstance(data, basestring):
+      data = [data]
+    return _decode_stream(data, fields)
+
+  if not isinstance(data, basestring):
+    data = "".join(data)
+
+  page = fast_json.loads(data)
+  if fields and isinstance(page, dict) and isinstance(page.get('objects'), list):
+    page['objects'] = [project(obj, fields) for obj in page['objects']]
+  return page
+
+
+
+def _decode_stream(chunks,fields):
+  """
+  Builds the response from ijson events. Each object in the objects list is built on its own,
+  projected and then added to the list, so a whole page of objects is never held.
+  """
+  page = ijson.common.ObjectBuilder()
+  objects = None
+  item = None
+
+  for prefix, event, value in ijson.parse(_ChunkReader(chunks)):
+    if item != None:
+      item.event(event, value)
+      if prefix == 'objects.item' and event in ('end_map', 'end_array'):
+        objects.append(project(item.value, fields))
+        item = None
+    elif prefix == 'objects.item' and event in ('start_map', 'start_array'):
+      item = ijson.common.ObjectBuilder()
+      item.event(event, value)
+    elif prefix == 'objects.item':
+      objects.append(value)
+    elif prefix == '' and event == 'map_key' and value == 'objects':
+      objects = []
+    elif prefix == 'objects':
+      continue
+    else:
+      page.event(event, value)
+
+  result = page.value
+  if objects != None:
+    result['objects'] = objects
+  return result
+
+
+
+class _ChunkReader:
+  """
+  A file-like wrapper that ijson reads the chunks of a response through.
+  """
+
+  def __init__(self,chunks):
+    self.chunks = iter(chunks)
+    self.buffer = ""
+
+
+
+  def read(self,size=-1):
+    while size < 0 or len(self.buffer) < size:
+      chunk = next(self.chunks, None)
+      if chunk == None:
+        break
+      self.buffer += chunk
+
+    if size < 0:
+      size = len(self.buffer)
+    data = self.buffer[:size]
+    self.buffer = self.buffer[size:]
+    return data
@@ -0,0 +1,202 @@
+import json
+import threading
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+#The upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+
+class RequestMetrics:
+  """
+  This class counts and times the requests sent to CRITs per endpoint (ips, domains,
+  campaigns) and HTTP verb. For each pair it keeps a latency histogram, the bytes sent
+  and received, the number of responses per status code and the number of retries.
+  Requests that got no response are counted under the status "error".
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.endpoints = {}
+
+
+
+  def record(self,endpoint,method,status,seconds,bytes_sent=0,bytes_received=0,retry=False):
+    """
+    Records one request attempt.
+
+    :param endpoint: The API endpoint (e.g. 'ips').
+    :type endpoint: str
+    :param method: The HTTP verb.
+    :type method: str
+    :param status: The HTTP status code, or "error" if there was no response.
+    :type status: int or str
+    :param seconds: How long the attempt took.
+    :type seconds: float
+    :param bytes_sent: The size of the request body.
+    :type bytes_sent: int
+    :param bytes_received: The size of the response body.
+    :type bytes_received: int
+    :param retry: Whether the attempt was a retry of an earlier one.
+    :type retry: bool
+    """
+
+    key = (endpoint, method.upper())
+
+    with self.lock:
+      entry = self.endpoints.get(key)
+      if entry == None:
+        entry = {'count' : 0, 'seconds' : 0.0, 'buckets' : [0] * (len(BUCKETS) + 1),
+                 'statuses' : {}, 'bytes_sent' : 0, 'bytes_received' : 0, 'retries' : 0}
+        self.endpoints[key] = entry
+
+      entry['count'] += 1
+      entry['seconds'] += seconds
+      entry['buckets'][_bucket(seconds)] += 1
+      entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+      entry['bytes_sent'] += bytes_sent
+      entry['bytes_received'] += bytes_received
+      if retry:
+        entry['retries'] += 1
+
+
+
+  def snapshot(self,connections=None):
+    """
+    Returns the metrics as a dict that can be written as JSON.
+    The histogram buckets are cumulative and keyed by their upper bound, as in Prometheus.
+
+    :param connections: The crits connection_stats to include.
+    :type connections: dict
+    :returns: dict
+    """
+
+    result = []
+
+    with self.lock:
+      for (endpoint, method), entry in sorted(self.endpoints.items()):
+        buckets = {}
+        total = 0
+        for bound, count in zip(_bucket_labels(), entry['buckets']):
+          total += count
+          buckets[bound] = total
+
+        result.append({'endpoint' : endpoint, 'method' : method, 'count' : entry['count'],
+                       'seconds' : entry['seconds'], 'buckets' : buckets,
+                       'statuses' : dict(entry['statuses']), 'bytes_sent' : entry['bytes_sent'],
+                       'bytes_received' : entry['bytes_received'], 'retries' : entry['retries']})
+
+    return {'requests' : result, 'connections' : connections or {}}
+
+
+
+  def to_json(self,connections=None):
+    """
+    Returns the metrics as JSON (see snapshot).
+
+    :param connections: The crits connection_stats to include.
+    :type connections: dict
+    :returns: str
+    """
+
+    return json.dumps(self.snapshot(connections), indent=2, sort_keys=True)
+
+
+
+  def to_prometheus(self,connections=None):
+    """
+    Returns the metrics in the Prometheus text exposition format.
+
+    :param connections: The crits connection_stats to include.
+    :type connections: dict
+    :returns: str
+    """
+
+    snapshot = self.snapshot(connections)
+    lines = []
+
+    lines.append("# HELP crits_request_duration_seconds Latency of requests to the CRITs API.")
+    lines.append("# TYPE crits_request_duration_seconds histogram")
+    for entry in snapshot['requests']:
+      labels = _labels(endpoint=entry['endpoint'], method=entry['method'])
+      for bound in _bucket_labels():
+        lines.append("crits_request_duration_seconds_bucket" + _labels(endpoint=entry['endpoint'], method=entry['method'], le=bound) +
+                     " " + str(entry['buckets'][bound]))
+      lines.append("crits_request_duration_seconds_sum" + labels + " " + repr(entry['seconds']))
+      lines.append("crits_request_duration_seconds_count" + labels + " " + str(entry['count']))
+
+    lines.append("# HELP crits_requests_total Requests to the CRITs API by response status.")
+    lines.append("# TYPE crits_requests_total counter")
+    for entry in snapshot['requests']:
+      for status, count in sorted(entry['statuses'].items()):
+        lines.append("crits_requests_total" + _labels(endpoint=entry['endpoint'], method=entry['method'], status=status) +
+                     " " + str(count))
+
+    for name, key, help in [('crits_request_bytes_total', 'bytes_sent', "Bytes sent in request bodies."),
+                            ('crits_response_bytes_total', 'bytes_received', "Bytes received in response bodies."),
+                            ('crits_request_retries_total', 'retries', "Requests that were retries of an earlier attempt.")]:
+      lines.append("# HELP " + name + " " + help)
+      lines.append("# TYPE " + name + " counter")
+      for entry in snapshot['requests']:
+        lines.append(name + _labels(endpoint=entry['endpoint'], method=entry['method']) + " " + str(entry[key]))
+
+    for key, help in [('opened', "HTTP connections opened to CRITs."),
+                      ('reused', "Requests sent on an already open connection.")]:
+      if key in snapshot['connections']:
+        name = "crits_connections_" + key + "_total"
+        lines.append("# HELP " + name + " " + help)
+        lines.append("# TYPE " + name + " counter")
+        lines.append(name + " " + str(snapshot['connections'][key]))
+
+    return "\n".join(lines) + "\n"
+
+
+
+  def write(self,path,format='json',connections=None):
+    """
+    Writes the metrics to a file.
+
+    :param path: The file name.
+    :type path: str
+    :param format: 'json' or 'prometheus'.
+    :type format: str
+    :param connections: The crits connection_stats to include.
+    :type connections: dict
+    """
+
+    if format == 'prometheus':
+      text = self.to_prometheus(connections)
+    else:
+      text = self.to_json(connections)
+
+    with open(path,'w') as f:
+      f.write(text)
+
+
+
+def _bucket(seconds):
+  """
+  Returns the index of the histogram bucket for a latency.
+  """
+  for i, bound in enumerate(BUCKETS):
+    if seconds <= bound:
+      return i
+  return len(BUCKETS)
+
+
+
+def _bucket_labels():
+  return [repr(bound) for bound in BUCKETS] + ['+Inf']
+
+
+
+def _labels(**labels):
+  """
+  Formats Prometheus labels, escaping the values.
+  """
+  return "{" + ",".join(key + '="' + str(value).replace('\\','\\\\').replace('"','\\"') + '"'
+                        for key, value in sorted(labels.items())) + "}"
@@ -0,0 +1,191 @@
+import json
+import sqlite3
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+class CampaignMirror:
+  """
+  This class keeps an on-disk SQLite copy of the IPs and domains in CRITs campaigns.
+  Each record stores the value, its CRITs _id, its campaign and source names and its
+  modified timestamp. The newest modified timestamp seen for a campaign is kept as a
+  watermark so the next refresh only has to request records changed since then.
+  Lists synced at the same time share the file, so writes are committed in small batches
+  and each connection waits for the others' commits instead of failing.
+  """
+
+  def __init__(self,path,timeout=60):
+    """
+    Opens (and creates if needed) the mirror database.
+
+    :param path: The file name of the SQLite database.
+    :type path: str
+    :param timeout: Seconds to wait for another connection's write to be committed.
+    :type timeout: float
+    """
+
+    self.path = path
+    self.db = sqlite3.connect(path, timeout=timeout)
+    self.db.execute("""CREATE TABLE IF NOT EXISTS records (
+                         kind TEXT, campaign TEXT, value TEXT, id TEXT,
+                         campaigns TEXT, sources TEXT, modified TEXT,
+                         PRIMARY KEY (kind, campaign, value))""")
+    self.db.execute("""CREATE TABLE IF NOT EXISTS watermarks (
+                         kind TEXT, campaign TEXT, modified TEXT,
+                         PRIMARY KEY (kind, campaign))""")
+    self.db.commit()
+
+
+
+  def watermark(self,kind,campaign):
+    """
+    Returns the newest modified timestamp mirrored for the campaign.
+    None means the campaign has never been fully loaded.
+
+    :param kind: The type of record ('ip' or 'domain').
+    :type kind: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    :returns: str
+    """
+
+    row = self.db.execute("SELECT modified FROM watermarks WHERE kind=? AND campaign=?",
+                          (kind,campaign)).fetchone()
+    if row == None:
+      return None
+
+    return row[0]
+
+
+
+  def count(self,kind,campaign):
+    """
+    Returns the number of records mirrored for the campaign.
+
+    :param kind: The type of record ('ip' or 'domain').
+    :type kind: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    :returns: int
+    """
+
+    return self.db.execute("SELECT COUNT(*) FROM records WHERE kind=? AND campaign=?",
+                           (kind,campaign)).fetchone()[0]
+
+
+
+  def upsert(self,kind,campaign,objects):
+    """
+    Stores CRITs objects for the campaign, replacing any earlier copy of the same value,
+    and advances the campaign's watermark. Each batch of 1000 objects is committed as it is
+    written, so the database is not locked while the rest of the objects are listed.
+    The watermark is only advanced once every object is stored.
+
+    :param kind: The type of record ('ip' or 'domain'). This is also the value's field name.
+    :type kind: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    :param objects: The objects returned by a CRITs find query.
+    :type objects: iterable of dict
+    :returns: int The number of objects stored.
+    """
+
+    newest = self.watermark(kind,campaign) or ""
+    stored = 0
+    batch = []
+
+    for obj in objects:
+      modified = obj.get('modified') or ""
+      if modified > newest:
+        newest = modified
+      batch.append((kind, campaign, obj[kind], obj['_id'],
+                    json.dumps([c['name'] for c in obj.get('campaign',[])]),
+                    json.dumps([s['name'] for s in obj.get('source',[])]),
+                    modified))
+      if len(batch) >= 1000:
+        stored += self._write(batch)
+        batch = []
+
+    stored += self._write(batch)
+    self.db.execute("INSERT OR REPLACE INTO watermarks VALUES (?,?,?)", (kind,campaign,newest))
+    self.db.commit()
+
+    return stored
+
+
+
+  def _write(self,batch):
+    self.db.executemany("INSERT OR REPLACE INTO records VALUES (?,?,?,?,?,?,?)", batch)
+    self.db.commit()
+    return len(batch)
+
+
+
+  def remove(self,kind,campaign,values):
+    """
+    Removes values that are no longer part of the campaign.
+
+    :param kind: The type of record ('ip' or 'domain').
+    :type kind: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    :param values: The IPs or domains to remove.
+    :type values: iterable of str
+    """
+
+    self.db.executemany("DELETE FROM records WHERE kind=? AND campaign=? AND value=?",
+                        ((kind,campaign,value) for value in values))
+    self.db.commit()
+
+
+
+  def clear(self,kind,campaign):
+    """
+    Forgets everything mirrored for the campaign so the next refresh is a full scan.
+
+    :param kind: The type of record ('ip' or 'domain').
+    :type kind: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    """
+
+    self.db.execute("DELETE FROM records WHERE kind=? AND campaign=?", (kind,campaign))
+    self.db.execute("DELETE FROM watermarks WHERE kind=? AND campaign=?", (kind,campaign))
+    self.db.commit()
+
+
+
+  def index(self,kind,campaign):
+    """
+    Returns the campaign's records as a dict of value -> (_id, campaign names, source names).
+    Identical name tuples are shared between records.
+
+    :param kind: The type of record ('ip' or 'domain').
+    :type kind: str
+    :param campaign: The campaign name.
+    :type campaign: str
+    :returns: dict
+    """
+
+    result = {}
+    shared = {}
+
+    for value, id, campaigns, sources in self.db.execute(
+          "SELECT value, id, campaigns, sources FROM records WHERE kind=? AND campaign=?",
+          (kind,campaign)):
+      campaigns = tuple(json.loads(campaigns))
+      sources = tuple(json.loads(sources))
+      result[str(value)] = (str(id), shared.setdefault(campaigns,campaigns), shared.setdefault(sources,sources))
+
+    return result
+
+
+
+  def close(self):
+    """
+    Closes the database.
+    """
+
+    self.db.close()
@@ -0,0 +1,150 @@
+import os
+import time
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+class PhaseProfiler:
+  """
+  This class profiles the named phases of a run with cProfile.
+  Each time a phase runs, the thread that runs it is profiled and the wall clock time is
+  recorded. Runs of the same phase, including runs on other threads, are merged so that
+  write() produces one <phase>.pstats file per phase plus a summary.txt table.
+  Only the thread that enters a phase is profiled. Time spent by worker threads started
+  within a phase shows up in the phase's wall clock time but not in its pstats file.
+  """
+
+  def __init__(self,directory):
+    """
+    Creates the output directory if needed.
+
+    :param directory: The directory for the pstats files and the summary.
+    :type directory: str
+    """
+
+    self.directory = directory
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.order = []
+    self.stats = {}
+    self.calls = {}
+    self.seconds = {}
+
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+
+
+  @contextmanager
+  def phase(self,name):
+    """
+    Profiles the code run within the with block as the named phase.
+    A phase entered inside another phase on the same thread is timed but
+    its function calls stay in the outer phase's profile.
+
+    :param name: The name of the phase.
+    :type name: str
+    """
+
+    profile = None
+    if not getattr(self.local, 'active', False):
+      profile = cProfile.Profile()
+      self.local.active = True
+
+    start = time.time()
+    if profile != None:
+      profile.enable()
+
+    try:
+      yield
+    finally:
+      if profile != None:
+        profile.disable()
+        self.local.active = False
+      self._record(name, profile, time.time() - start)
+
+
+
+  def _record(self,name,profile,seconds):
+    with self.lock:
+      if name not in self.seconds:
+        self.order.append(name)
+        self.seconds[name] = 0.0
+        self.calls[name] = 0
+
+      self.seconds[name] += seconds
+      self.calls[name] += 1
+
+      if profile != None:
+        if name in self.stats:
+          self.stats[name].add(profile)
+        else:
+          self.stats[name] = pstats.Stats(profile)
+
+
+
+  def summary(self):
+    """
+    Returns a table with the runs, wall clock seconds and share of the total for each phase,
+    and the function with the most cumulative time in the phase.
+
+    :returns: str
+    """
+
+    with self.lock:
+      total = sum(self.seconds.values()) or 1.0
+      row = "%-12s %6s %10s %7s  %s"
+      lines = [row % ("Phase", "Runs", "Seconds", "Share", "Top function (cumulative)")]
+
+      for name in self.order:
+        lines.append(row % (name, self.calls[name], "%.3f" % self.seconds[name],
+                            "%.1f%%" % (100 * self.seconds[name] / total), _top_function(self.stats.get(name))))
+
+    return "\n".join(lines) + "\n"
+
+
+
+  def write(self):
+    """
+    Writes <phase>.pstats for every phase and summary.txt to the output directory.
+    The pstats files can be read with python -m pstats or snakeviz.
+
+    :returns: str The summary table.
+    """
+
+    with self.lock:
+      for name, stats in self.stats.items():
+        stats.dump_stats(os.path.join(self.directory, name + '.pstats'))
+
+    summary = self.summary()
+    with open(os.path.join(self.directory, 'summary.txt'),'w') as f:
+      f.write(summary)
+
+    return summary
+
+
+
+def _top_function(stats):
+  """
+  Returns file:line(function) for the entry with the most cumulative time,
+  skipping the profiler's own frames.
+  """
+  if stats == None:
+    return ""
+
+  best = None
+  for (filename, line, function), (cc, nc, tt, ct, callers) in stats.stats.items():
+    if filename == '~' or filename.endswith(('profiler.py', 'contextlib.py')):
+      continue
+    if best == None or ct > best[0]:
+      best = (ct, "%s:%d(%s)" % (os.path.basename(filename), line, function))
+
+  if best == None:
+    return ""
+  return best[1] + " %.3fs" % best[0]
@@ -0,0 +1,293 @@
+import json
+import threading
+import time
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+PLAN_VERSION = 1
+
+#The endpoint and verb of the request that each kind of write sends for an IP list
+WRITE_REQUESTS = {'add' : ('ips', 'POST'),
+                  'delete' : ('ips', 'DELETE'),
+                  'source_removal' : ('ips', 'PATCH'),
+                  'campaign_removal' : ('campaigns', 'PATCH'),
+                  'add_campaign' : ('campaigns', 'POST')}
+
+#The endpoint that each kind of list sends its record writes to instead of ips
+ENDPOINTS = {'ip' : 'ips', 'domain' : 'domains'}
+
+
+
+class SyncPlan:
+  """
+  This class collects the writes that syncing one or more lists would send to CRITs,
+  so that they can be reviewed and sent later with os_list_update.py --execute_plan.
+
+  For each list the plan holds its kind ('ip' or 'domain'), the entries to add and the removals
+  decided by remove_expired_entries, split into full deletes, source removals and campaign removals.
+  A removal record has the keys value, id, campaign and source, as taken by crits.delete_ips.
+  A record with both a campaign and a source is a campaign removal that also removes the source.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.lists = []
+
+
+
+  def add_list(self,name,campaign,source,indicator,confidence,adds,removals,
+               create_campaign=False,file_count=0,existing_count=0,kind='ip'):
+    """
+    Adds the writes for one list to the plan.
+
+    :param name: The name of the list.
+    :type name: str
+    :param campaign: The campaign of the list.
+    :type campaign: str
+    :param source: The source of the list.
+    :type source: str
+    :param indicator: Whether the adds are indicators.
+    :type indicator: boolean
+    :param confidence: The confidence of the adds.
+    :type confidence: str
+    :param adds: The IPs and CIDRs (or domains) to add.
+    :type adds: list of str
+    :param removals: The removal records (see remove_expired_entries).
+    :type removals: list of dict
+    :param create_campaign: Whether the campaign must be added before the entries.
+    :type create_campaign: boolean
+    :param file_count: The number of ranges in the list.
+    :type file_count: int
+    :param existing_count: The number of records in the campaign.
+    :type existing_count: int
+    :param kind: The kind of the list ('ip' or 'domain').
+    :type kind: str
+    """
+
+    entry = {'name' : name, 'kind' : kind, 'campaign' : campaign, 'source' : source, 'indicator' : indicator,
+             'confidence' : confidence, 'create_campaign' : create_campaign, 'file' : file_count,
+             'existing' : existing_count, 'adds' : list(adds), 'deletes' : [],
+             'source_removals' : [], 'campaign_removals' : []}
+
+    for record in removals:
+      entry[removal_kind(record) + 's'].append(record)
+
+    with self.lock:
+      self.lists.append(entry)
+
+
+
+  def to_dict(self,estimate=None):
+    """
+    Returns the plan as a dict that can be written as JSON.
+
+    :param estimate: The cost estimate to include (see estimate_cost).
+    :type estimate: dict
+    :returns: dict
+    """
+
+    with self.lock:
+      lists = sorted(self.lists, key=lambda entry: entry['name'])
+    return {'version' : PLAN_VERSION, 'created' : time.time(), 'lists' : lists, 'estimate' : estimate}
+
+
+
+  def write(self,path,estimate=None):
+    """
+    Writes the plan to a JSON file.
+
+    :param path: The file name.
+    :type path: str
+    :param estimate: The cost estimate to include (see estimate_cost).
+    :type estimate: dict
+    """
+
+    with open(path,'w') as f:
+      json.dump(self.to_dict(estimate), f, indent=1, sort_keys=True)
+
+
+
+def removal_kind(record):
+  """
+  Returns 'delete', 'source_removal' or 'campaign_removal' for a removal record.
+
+  :param record: A dict with the keys campaign and source.
+  :type record: dict
+  :returns: str
+  """
+  if record.get('campaign'):
+    return 'campaign_removal'
+  if record.get('source'):
+    return 'source_removal'
+  return 'delete'
+
+
+
+def count_calls(lists):
+  """
+  Returns the number of API calls of each kind that the lists of a plan will send.
+  A campaign removal that also removes a source sends a source removal first.
+
+  :param lists: The lists of a plan.
+  :type lists: list of dict
+  :returns: dict
+  """
+  calls = dict((kind, 0) for kind in WRITE_REQUESTS)
+
+  for entry in lists:
+    calls['add'] += len(entry['adds'])
+    calls['delete'] += len(entry['deletes'])
+    calls['source_removal'] += len(entry['source_removals'])
+    calls['campaign_removal'] += len(entry['campaign_removals'])
+    calls['source_removal'] += sum(1 for record in entry['campaign_removals'] if record.get('source'))
+    if entry['create_campaign']:
+      calls['add_campaign'] += 1
+
+  return calls
+
+
+
+def write_request(write,kind='ip'):
+  """
+  Returns the endpoint and verb of the request that a kind of write sends for a kind of list.
+
+  :param write: The kind of write (a key of WRITE_REQUESTS).
+  :type write: str
+  :param kind: The kind of the list ('ip' or 'domain').
+  :type kind: str
+  :returns: tuple
+  """
+  endpoint, method = WRITE_REQUESTS[write]
+  if endpoint == 'ips':
+    endpoint = ENDPOINTS[kind]
+  return (endpoint, method)
+
+
+
+def estimate_cost(lists,snapshot,workers):
+  """
+  Estimates the API calls and the time needed to execute a plan.
+  The time of each kind of call is the mean latency measured for its endpoint and verb
+  in snapshot (see write_request), weighted by its calls to each endpoint. Kinds that were
+  not measured use the mean latency of every request measured. A plan is made with GETs
+  only, so the writes of a plan's own run are never measured (see summary).
+
+  :param lists: The lists of a plan.
+  :type lists: list of dict
+  :param snapshot: The request metrics of the run (see RequestMetrics.snapshot).
+  :type snapshot: dict
+  :param workers: The number of writes that will be in flight at once. Pass the number
+                  that execute_plan will use (see plan_workers in os_list_update.py).
+  :type workers: int
+  :returns: dict with the keys calls, total_calls, latency, measured, workers and seconds.
+            seconds is None if no latency was measured.
+  """
+
+  calls = count_calls(lists)
+  workers = max(workers, 1)
+
+  #Domain lists write to a different endpoint, so each write is counted per endpoint and verb.
+  requests = dict((write, {write_request(write) : 0}) for write in calls)
+  for entry in lists:
+    for write, count in count_calls([entry]).items():
+      if count > 0:
+        request = write_request(write, entry.get('kind', 'ip'))
+        requests[write].setdefault(request, 0)
+        requests[write][request] += count
+
+  measured = {}
+  total_seconds = 0.0
+  total_count = 0
+  for entry in snapshot.get('requests', []):
+    if entry['count'] > 0:
+      measured[(entry['endpoint'], entry['method'])] = entry['seconds'] / entry['count']
+      total_seconds += entry['seconds']
+      total_count += entry['count']
+
+  fallback = None
+  if total_count > 0:
+    fallback = total_seconds / total_count
+
+  latency = {}
+  was_measured = {}
+  seconds = 0.0
+  for write, by_request in requests.items():
+    write_seconds = 0.0
+    write_count = 0
+    all_measured = True
+    for request, count in by_request.items():
+      if count > 0:
+        all_measured = all_measured and request in measured
+        if measured.get(request, fallback) != None:
+          write_seconds += count * measured.get(request, fallback)
+          write_count += count
+
+    if write_count > 0:
+      latency[write] = write_seconds / write_count
+      was_measured[write] = all_measured
+    else:
+      latency[write] = measured.get(write_request(write), fallback)
+      was_measured[write] = write_request(write) in measured
+    seconds += write_seconds
+
+  if fallback == None:
+    seconds = None
+  else:
+    seconds = seconds / workers
+
+  return {'calls' : calls, 'total_calls' : sum(calls.values()), 'latency' : latency,
+          'measured' : was_measured, 'workers' : workers, 'seconds' : seconds}
+
+
+
+def summary(plan):
+  """
+  Returns a table with the writes of each list in a plan and the cost estimate.
+  The kinds of write whose latency was not measured are named, since their time is
+  estimated from the latency of other requests.
+
+  :param plan: The plan (see SyncPlan.to_dict and load).
+  :type plan: dict
+  :returns: str
+  """
+
+  row = "%-20s %10s %10s %15s %17s"
+  lines = [row % ("List", "Adds", "Deletes", "Source removals", "Campaign removals")]
+  for entry in plan['lists']:
+    lines.append(row % (entry['name'], len(entry['adds']), len(entry['deletes']),
+                        len(entry['source_removals']), len(entry['campaign_removals'])))
+
+  estimate = plan.get('estimate')
+  if estimate != None:
+    line = "Estimated API calls: " + str(estimate['total_calls'])
+    if estimate['seconds'] != None:
+      line += ", about %.0f seconds with %d workers" % (estimate['seconds'], estimate['workers'])
+    lines.append(line)
+
+    unmeasured = sorted(write for write, count in estimate['calls'].items()
+                        if count > 0 and not estimate['measured'].get(write))
+    if unmeasured and estimate['seconds'] != None:
+      lines.append("Not measured (estimated from the mean latency of the reads): " + ", ".join(unmeasured))
+
+  return "\n".join(lines) + "\n"
+
+
+
+def load(path):
+  """
+  Reads a plan written by SyncPlan.write.
+
+  :param path: The file name.
+  :type path: str
+  :returns: dict
+  """
+
+  with open(path) as f:
+    plan = json.load(f)
+
+  if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+    raise ValueError("Unsupported plan version")
+  return plan
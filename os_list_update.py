@@ -20,11 +20,29 @@ import sys
 import re
 import requests
 import os.path
-import gzip
+import time
+import threading
+import urlparse
+import tempfile
+import zlib
+import atexit
 from pprint import pprint
 from libs2 import crits
+from libs2 import crits_executor
+from libs2 import mirror
+from libs2 import feed_cache
+from libs2 import ipset
+from libs2 import domainset
+from libs2 import feed_parsers
+from libs2 import adaptive
+from libs2 import profiler
+from libs2 import cassette
+from libs2 import sync_plan
+from libs2 import journal
+from libs2 import json_pages
 from sets import Set
-from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from collections import deque
 
 
 #The config file for the CRITs server
@@ -33,6 +51,62 @@ CRITS_CONFIG_FILE = 'crits.config'
 #The config file containing the supported open source lists
 OS_CONFIG_FILE = 'os_indicators.config'
 
+#The number of bytes read from a feed download at a time
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+#The (connect, read) timeout in seconds for feed downloads. The read timeout applies to each read of the body.
+DOWNLOAD_TIMEOUT = (10, 60)
+
+#The first two bytes of a gzip file
+GZIP_MAGIC = '\x1f\x8b'
+
+#The size at which a section of a shared feed is moved from memory to a temporary file
+SECTION_SPOOL_SIZE = 8 * 1024 * 1024
+
+#The number of journaled writes sent before their progress is saved
+JOURNAL_CHUNK_SIZE = 500
+
+#How each kind of record is named in messages
+KIND_NAMES = {'ip' : 'IP', 'domain' : 'domain'}
+
+#The fields of a CRITs IP or domain that index_record and the mirror use, besides the value itself
+INDEX_FIELDS = ('_id', 'campaign.name', 'source.name', 'modified')
+KIND_LABELS = {'ip' : 'IP address', 'domain' : 'domain'}
+
+#The sync statuses that leave writes unsent. The update and plan commands exit with 1 when a list ends in one of them,
+#so a 'partial' sync, where some adds or removals failed, is reported as a failure.
+INCOMPLETE_STATUSES = ('partial', 'resumed', 'failed')
+
+#The PhaseProfiler set by --profile. None when profiling is off.
+PROFILER = None
+
+
+
+class _NoProfile:
+  """
+  The with block used for a phase when profiling is off. It does nothing.
+  """
+  def __enter__(self):
+    return self
+  def __exit__(self, *args):
+    return False
+
+NO_PROFILE = _NoProfile()
+
+
+
+def profile_phase(name):
+  """
+  Returns a with block that profiles the named phase when --profile is set.
+  The phases are download, enumerate, diff, add and remove.
+
+  :param name: The name of the phase.
+  :type name: str
+  """
+  if PROFILER == None:
+    return NO_PROFILE
+  return PROFILER.phase(name)
+
 
 
 def get_config_setting(Config,section,key,type='str'):
@@ -45,34 +119,39 @@ def get_config_setting(Config,section,key,type='str'):
   :type section: str
   :param key: The name of variable to read from the config file
   :type key: str
-  :param type: The type of Config variable to read ('str','boolean',etc.)
+  :param type: The type of Config variable to read ('str','boolean','int','float')
                The default is 'str'
   :type type: str:
-  :returns: str or boolean
+  :returns: str, boolean, int or float. Missing 'int' and 'float' values return None.
   """
+  if type == 'boolean':
+    missing = 0
+  elif type == 'int' or type == 'float':
+    missing = None
+  else:
+    missing = ""
+
   try:
     if type == 'boolean':
       result = Config.getboolean(section,key)
+    elif type == 'int':
+      result = Config.getint(section,key)
+    elif type == 'float':
+      result = Config.getfloat(section,key)
     else:
       result = Config.get(section,key)
   except ConfigParser.NoSectionError as e:
     print 'Warning: ' + section + ' does not exist in config file'
-    if type == 'boolean':
-       return 0
-    else:
-       return ""
+    return missing
   except ConfigParser.NoOptionError as e:
     print 'Warning: ' + key + ' does not exist in the config file'
-    if type == 'boolean':
-       return 0
-    else:
-       return ""
+    return missing
+  except ValueError as e:
+    print 'Warning: ' + key + ' is not a valid ' + type + ' in the config file'
+    return missing
   except ConfigParser.Error as e:
     print 'Warning: Unexpected error with config file'
-    if type == 'boolean':
-       return 0
-    else:
-       return ""
+    return missing
 
   return result
 
@@ -82,14 +161,81 @@ def get_config_setting(Config,section,key,type='str'):
 
 def download_file(url):
   """
-  This will download and return the response body from the provided URL.
+  This will download the response body from the provided URL.
+  The body is streamed and returned as a lazy iterator of lines.
+  Gzip content, whether sent with a gzip content-encoding or as a .gz file,
+  is decompressed chunk by chunk so the whole feed is never held in memory.
 
   :param url: The URL to use for the request.
   :type url: str
-  :returns: str
+  :returns: generator of str
+  """
+  try:
+     r = requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+  except requests.exceptions.ConnectionError as e:
+     print "Error: Could not connect to " + url
+     exit(1)
+  except requests.exceptions.Timeout:
+     print "Error: Timeout connecting to " + url
+     exit(1)
+
+  #iter_content removes any content-encoding. Gzip files are detected by their magic number.
+  return iter_lines(gunzip_chunks(read_chunks(r,url)))
+
+
+
+def read_chunks(r,url):
+  """
+  Yields the body of a streamed download in chunks of DOWNLOAD_CHUNK_SIZE.
+  A read that times out or a connection that drops during the download exits,
+  as a failed connection does.
+
+  :param r: The streamed response.
+  :type r: :class:`requests.Response`
+  :param url: The URL of the download, for the error message.
+  :type url: str
+  :returns: generator of str
+  """
+  try:
+    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+      yield chunk
+  except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+    print "Error: The download from " + url + " timed out or was interrupted"
+    exit(1)
+
+
+
+
+def download_feed(url,cache,names,force,debug):
+  """
+  Downloads a feed through the feed cache using a conditional request.
+  Several lists can share the feed's URL. Each is checked against the version it last synced.
+  If the server reports the feed is unchanged, or the body hashes the same as the
+  version last synced by every list, None is returned in place of the lines.
+  Otherwise the body is saved to the cache and its lines are read back lazily.
+  Pass the returned version to FeedCache.mark_synced once a list's sync succeeds.
+
+  :param url: The URL to use for the request.
+  :type url: str
+  :param cache: The feed cache to use.
+  :type cache: :class:`libs2\feed_cache.FeedCache`
+  :param names: The list names from os_indicators.config that use this URL.
+  :type names: list
+  :param force: Download and sync the feed even if it has not changed.
+  :type force: boolean
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: generator of str, dict
   """
+  headers = {}
+  if not force:
+    #The request can only be conditional if every list synced the same version.
+    all_headers = [cache.conditional_headers(name,url) for name in names]
+    if all(h == all_headers[0] for h in all_headers):
+      headers = all_headers[0]
+
   try:
-     r = requests.get(url, stream=True)
+     r = requests.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT)
   except requests.exceptions.ConnectionError as e:
      print "Error: Could not connect to " + url
      exit(1)
@@ -97,14 +243,91 @@ def download_file(url):
      print "Error: Timeout connecting to " + url
      exit(1)
 
-  if r.headers.get('content-encoding') == 'gzip':
-     zipdata = StringIO()
-     zipdata.write(r.raw.read())
-     zipdata.seek(0)
-     g = gzip.GzipFile(fileobj=zipdata, mode='rb')
-     return(g)
+  if r.status_code == 304:
+    if debug:
+      print url + " has not been modified since the last sync"
+    return (None, None)
+
+  if r.status_code != 200:
+    print "Error: " + url + " returned status code " + str(r.status_code)
+    exit(1)
+
+  version = cache.store(url, read_chunks(r,url), r.headers.get('etag'), r.headers.get('last-modified'))
+
+  if not force and all(cache.is_synced(name,version) for name in names):
+    if debug:
+      print url + " content is unchanged since the last sync"
+    return (None, version)
+
+  return (iter_lines(gunzip_chunks(cache.read(version))), version)
 
-  return (r.raw)
+
+
+
+def gunzip_chunks(chunks):
+  """
+  Decompresses a stream of chunks if it starts with the gzip magic number.
+  Otherwise the chunks are passed through unchanged.
+  Concatenated gzip members are decompressed one after another.
+
+  :param chunks: The raw chunks of the download.
+  :type chunks: iterable of str
+  :returns: generator of str
+  """
+  chunks = iter(chunks)
+  first = ""
+  for chunk in chunks:
+    first += chunk
+    if len(first) >= 2:
+      break
+
+  if first[:2] != GZIP_MAGIC:
+    if first:
+      yield first
+    for chunk in chunks:
+      yield chunk
+    return
+
+  decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  pending = first
+  while True:
+    while pending:
+      data = decomp.decompress(pending)
+      if data:
+        yield data
+      pending = decomp.unused_data
+      if pending:
+        #The start of another gzip member
+        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = next(chunks, None)
+    if pending == None:
+      break
+
+  data = decomp.flush()
+  if data:
+    yield data
+
+
+
+
+def iter_lines(chunks):
+  """
+  Splits a stream of chunks into lines. Each line keeps its trailing newline
+  so the result can be used anywhere a file object was iterated.
+
+  :param chunks: The decoded chunks of the download.
+  :type chunks: iterable of str
+  :returns: generator of str
+  """
+  partial = ""
+  for chunk in chunks:
+    lines = (partial + chunk).split("\n")
+    partial = lines.pop()
+    for line in lines:
+      yield line + "\n"
+
+  if partial:
+    yield partial
 
 
 
@@ -137,6 +360,141 @@ def get_crits_config(Config,args,debug):
 
 
 
+def get_connection_config(Config,debug):
+  """
+  Retrieve the HTTP connection pool, retry and cache settings from the [General] section of the config file.
+  Returns a dict of keyword arguments for the crits class.
+  Settings that are missing from the config file are left at the crits class defaults.
+
+  :param Config: The ConfigParser variable for the file containing the variable.
+  :type Config: ConfigParser
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: dict
+  """
+  settings = {}
+
+  for key, type in [('pool_connections','int'), ('pool_maxsize','int'),
+                    ('connect_timeout','float'), ('read_timeout','float'),
+                    ('cache_ttl','float'), ('retries','int'), ('retry_backoff','float'),
+                    ('retry_max_backoff','float'), ('request_deadline','float')]:
+    if Config.has_option('General',key) and Config.get('General',key).strip() != "":
+      value = get_config_setting(Config,'General',key,type)
+      if value != None:
+        settings[key] = value
+
+  for key in ['pool_block','keep_alive','field_projection']:
+    if Config.has_option('General',key):
+      settings[key] = bool(get_config_setting(Config,'General',key,'boolean'))
+
+  if debug:
+    print "Connection settings: " + str(settings)
+    print "JSON decoder: " + json_pages.BACKEND
+
+  return settings
+
+
+
+def get_adaptive_controller(Config,args,debug):
+  """
+  Builds the controller that adapts the number of requests in flight and the campaign
+  page size to CRITs' latency and errors (see libs2/adaptive.py).
+  It is enabled by --adaptive or adaptive : 1 in the [General] section of the config file.
+  Returns None when it is not enabled.
+
+  :param Config: The ConfigParser variable for the file containing the variable.
+  :type Config: ConfigParser
+  :param args: The args array from the command line
+  :type args: :class:`argparse.Namespace`
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: :class:`libs2\adaptive.AdaptiveController`
+  """
+  enabled = args.adaptive
+  if not enabled and Config.has_option('General','adaptive'):
+    enabled = get_config_setting(Config,'General','adaptive','boolean')
+
+  if not enabled:
+    return None
+
+  settings = {}
+  for key, name, type in [('adaptive_min_in_flight','min_limit','int'),
+                          ('adaptive_max_in_flight','max_limit','int'),
+                          ('adaptive_latency_target','latency_target','float'),
+                          ('adaptive_page_latency_target','page_latency_target','float')]:
+    if Config.has_option('General',key) and Config.get('General',key).strip() != "":
+      value = get_config_setting(Config,'General',key,type)
+      if value != None:
+        settings[name] = value
+
+  if debug:
+    print "Adaptive concurrency settings: " + str(settings)
+
+  return adaptive.AdaptiveController(**settings)
+
+
+
+def print_connection_stats(crits):
+  """
+  Prints how many HTTP connections were opened and reused during the run.
+
+  :param crits: The CRITs class used for connecting
+  :type crits: :class:`libs2\crits`
+  """
+  stats = crits.connection_stats()
+  print "Requests: " + str(stats['requests']) + " Connections opened: " + str(stats['opened']) + " reused: " + str(stats['reused']) + " retried: " + str(stats['retried'])
+
+  if crits.controller != None:
+    stats = crits.controller.stats()
+    print "Adaptive in flight limit: " + str(stats['limit']) + " page size: " + str(stats['page_size']) + \
+          " increases: " + str(stats['increases']) + " decreases: " + str(stats['decreases'])
+
+
+
+def write_metrics(crits,path,format,debug):
+  """
+  Writes the per-endpoint request metrics of the run (see libs2/metrics.py) to path.
+  This is registered with atexit so that it also runs when the script exits early.
+
+  :param crits: The CRITs class used for connecting
+  :type crits: :class:`libs2\crits`
+  :param path: The file to write.
+  :type path: str
+  :param format: 'json' or 'prometheus'.
+  :type format: str
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  """
+  try:
+    crits.metrics.write(path,format,crits.connection_stats())
+  except IOError as e:
+    print "Error: Could not write the metrics to " + path + ": " + str(e)
+    return
+
+  if debug:
+    print "Wrote " + format + " metrics to " + path
+
+
+
+def write_profile(phase_profiler):
+  """
+  Writes the pstats file of each profiled phase and prints the summary table.
+  This is registered with atexit so that it also runs when the script exits early.
+
+  :param phase_profiler: The profiler set up by --profile.
+  :type phase_profiler: :class:`libs2\profiler.PhaseProfiler`
+  """
+  try:
+    summary = phase_profiler.write()
+  except IOError as e:
+    print "Error: Could not write the profile to " + phase_profiler.directory + ": " + str(e)
+    return
+
+  print "Profile written to " + phase_profiler.directory
+  print summary
+
+
+
 def get_indicator(Config,args,debug):
   """
   Retrieve the indicator setting from the config file and/or command line.
@@ -155,344 +513,1555 @@ def get_indicator(Config,args,debug):
   if args.add_indicator:
     indicator = args.add_indicator
 
-  if indicator == None:
-    return (False)
+  if indicator == None:
+    return (False)
+
+  if (indicator != "True" and indicator != "False"):
+     print "Error: The indicator is a boolean and can only be 'True' or 'False'"
+     exit(1)
+  elif indicator == "True":
+     return (True)
+
+  return(False)
+
+
+
+def get_confidence(Config,args,debug):
+  """
+  Retrieve the confidence setting from the config file and/or command line.
+  Return a string containing the confidence level.
+
+  :param Config: The ConfigParser variable for the file containing the variable.
+  :type Config: ConfigParser
+  :param args: The section of the config file that contains the variable
+  :type args: :class:`argparse.Namespace`
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: str
+  """
+  confidence = get_config_setting(Config,"DefaultIndicatorInfo","confidence_level")
+
+  if args.confidence_level:
+    confidence = args.confidence_level
+
+  if confidence == None:
+    return("low")
+
+  if (confidence != "low" and confidence != "medium" and confidence != "high"):
+     print "Error: Confidence level must be 'low', 'medium', or 'high'"
+     exit(1)
+
+  return(confidence)
+
+
+
+
+def get_campaign(Config,args,debug):
+  """
+  Retrieve the campaign setting from the config file and/or command line.
+  Return the string containing the campaign name
+
+  :param Config: The ConfigParser variable for the file containing the variable.
+  :type Config: ConfigParser
+  :param args: The section of the config file that contains the variable
+  :type args: :class:`argparse.Namespace`
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: str
+  """
+  campaign = get_config_setting(Config,"DefaultIndicatorInfo","campaign_name")
+
+  if args.campaign:
+    campaign = args.campaign
+
+  if campaign == None:
+    return("")
+
+  return (campaign)
+
+
+
+
+def get_source(Config,args,debug):
+  """
+  Retrieve the source setting from the config file and/or command line.
+  Return a string specifying the source name.
+
+  :param Config: The ConfigParser variable for the file containing the variable.
+  :type Config: ConfigParser
+  :param args: The section of the config file that contains the variable
+  :type args: :class:`argparse.Namespace`
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: str
+  """
+  source = get_config_setting(Config,"DefaultIndicatorInfo","source")
+
+  if args.source:
+    source = args.source
+
+  if source == None:
+    return("")
+
+  return (source)
+
+
+
+
+def get_ip_and_type(line):
+  """
+  This function will take a line from an open source file.
+  It extracts the IP relevant information (either an IP address or CIDR class)
+  It will return the IP value and the type of value('Address - cidr','Address - ipv4-addr') 
+
+  :param A line containing an IP address or CIDR address class.
+  :type line: str
+  :returns: str, str
+  """
+  ip_result = re.match("^[0-9.]+([/0-9]+)?",line)
+
+  if ip_result == None:
+    return (None,None)
+
+  ip = ip_result.group(0)
+
+  if ip.find("/") != -1:
+    return (ip,"Address - cidr")
+
+  return (ip,"Address - ipv4-addr")
+
+
+
+
+def get_list_kind(OSConfig,os_list_name):
+  """
+  Returns the kind of records in the list from its _type setting: 'ip' (the default) or 'domain'.
+  An unknown type exits with an error.
+
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param os_list_name: The name of the list in os_indicators.config.
+  :type os_list_name: str
+  :returns: str
+  """
+  kind = 'ip'
+  if OSConfig.has_option('Open Source Lists',os_list_name + '_type'):
+    kind = (get_config_setting(OSConfig,'Open Source Lists',os_list_name + '_type') or 'ip').strip().lower()
+
+  if kind not in KIND_NAMES:
+    print "Error: The _type of " + os_list_name + " must be ip or domain"
+    exit(1)
+
+  return kind
+
+
+
+def get_feed_parser(OSConfig,os_list_name):
+  """
+  Returns the parser for the list's _format setting (see libs2/feed_parsers.py).
+  Domain lists (see get_list_kind) use the domain parsers.
+  Lists without a _format are parsed as plain. The format's options are read from
+  settings named after the list, such as ssl_blacklist_column for the csv format.
+  An unknown format or invalid option exits with an error.
+
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param os_list_name: The name of the list in os_indicators.config.
+  :type os_list_name: str
+  :returns: function that yields (value, type) tuples from the lines of the list
+  """
+  kind = get_list_kind(OSConfig,os_list_name)
+
+  os_format = None
+  if OSConfig.has_option('Open Source Lists',os_list_name + '_format'):
+    os_format = get_config_setting(OSConfig,'Open Source Lists',os_list_name + '_format').strip()
+
+  options = {}
+  for option in feed_parsers.format_options(os_format,kind):
+    if OSConfig.has_option('Open Source Lists',os_list_name + '_' + option):
+      options[option] = get_config_setting(OSConfig,'Open Source Lists',os_list_name + '_' + option)
+
+  try:
+    if kind == 'domain':
+      return feed_parsers.get_domain_parser(os_format,**options)
+    return feed_parsers.get_parser(os_format,**options)
+  except (ValueError, re.error) as e:
+    print "Error: Invalid format settings for " + os_list_name + ": " + str(e)
+    exit(1)
+
+
+
+
+def get_section_markers(OSConfig,os_list_names):
+  """
+  Returns the _begin marker of each list that has one.
+  Lists that share a URL use these markers to find their section of the file.
+
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param os_list_names: The names of the lists that share a URL.
+  :type os_list_names: list
+  :returns: dict
+  """
+  markers = {}
+  for name in os_list_names:
+    if OSConfig.has_option('Open Source Lists',name + '_begin'):
+      markers[name] = get_config_setting(OSConfig,'Open Source Lists',name + '_begin')
+  return markers
+
+
+
+
+def split_sections(f, markers, names):
+  """
+  Some open-source indicator downloads contain multiple sections.
+  This reads f once and splits it into one section per list.
+  A list with a marker gets the lines after its marker, up to the next marker or the end of f.
+  A list without a marker gets every line.
+  Each section is spooled to a temporary file, so large sections are kept on disk rather than in memory.
+
+  :param f: The lines of the download
+  :type f: iterable of str
+  :param markers: The _begin marker of each list that has one (see get_section_markers).
+  :type markers: dict
+  :param names: The lists to return sections for.
+  :type names: list
+  :returns: dict of list name -> file, or None if the list's marker was never found
+  """
+  spools = {}
+  for name in names:
+    spools[name] = tempfile.SpooledTemporaryFile(max_size=SECTION_SPOOL_SIZE)
+
+  whole = [spools[name] for name in names if name not in markers]
+  found = Set([])
+  current = None
+
+  for line in f:
+    marker_line = False
+    for name, marker in markers.items():
+      if line.find(marker) != -1:
+        current = name
+        found.add(name)
+        marker_line = True
+        break
+
+    if not marker_line and current in spools:
+      spools[current].write(line)
+
+    for spool in whole:
+      spool.write(line)
+
+  sections = {}
+  for name in names:
+    spools[name].seek(0)
+    if name in markers and name not in found:
+      spools[name].close()
+      sections[name] = None
+    else:
+      sections[name] = spools[name]
+
+  return sections
+
+
+
+
+def enumerate_campaign(find,campaign,source,fanout,debug,limit=1000,submit_find=None,find_args=None,page_size=None):
+  """
+  Yields every object that the find function returns for the campaign.
+  The first page supplies meta.total_count. The remaining pages are then
+  fetched concurrently, at most fanout at a time, and yielded in order.
+  If submit_find is supplied, the remaining pages are scheduled through it instead of a thread pool.
+  If page_size is supplied, it is asked for the size of each page as the page is scheduled,
+  so an adaptive client can shrink or grow the pages during the listing.
+
+  :param find: The CRITs find function to page through (e.g. crits.find_ip).
+  :type find: function
+  :param campaign: The string containing the campaign name to enumerate.
+  :type campaign: str
+  :param source: The string representing the CRITs source.
+  :type source: str
+  :param fanout: The max number of pages requested at once.
+  :type fanout: int
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param limit: The number of objects per page. Must be <= 1000.
+  :type limit: int
+  :param submit_find: The CritsExecutor equivalent of find (e.g. CritsExecutor.find_ip).
+  :type submit_find: function
+  :param find_args: Extra keyword arguments for every find call (e.g. modified_since).
+  :type find_args: dict
+  :param page_size: Returns the page size to use given the largest one wanted (e.g. crits.page_size).
+  :type page_size: function
+  :returns: generator of dict
+  """
+  find_args = dict(find_args or {}, meta=True)
+
+  if page_size == None:
+    page_size = lambda default: default
+
+  size = page_size(limit)
+  first = find("",campaign,source,"",size,0,**find_args)
+  total = first['meta']['total_count']
+  page = first.get('objects',[])
+
+  for obj in page:
+    yield obj
+
+  if len(page) < size:
+    return
+
+  if debug:
+    print "Campaign " + campaign + " has " + str(total) + " entries. Fetching " + str(max(total - size, 0)) + " more."
+
+  #The offset and size of the last page that was scheduled
+  last = [0, size]
+
+  def ranges():
+    offset = last[0] + last[1]
+    while offset < total:
+      last[0] = offset
+      last[1] = page_size(limit)
+      yield (offset, last[1])
+      offset += last[1]
+
+  pool = None
+  if submit_find == None:
+    def fetch(offset,size):
+      try:
+        return find("",campaign,source,"",size,offset,**find_args)
+      except SystemExit:
+        #find exits on connection errors. Hand the failure back to the calling thread.
+        raise crits_executor.CritsExecutorError("find failed")
+
+    pool = ThreadPool(max(fanout,1))
+    submit_find = lambda value, campaign, source, id, size, offset, **kwargs: pool.apply_async(fetch, (offset, size))
+
+  try:
+    for page in fetch_pages_in_executor(submit_find,campaign,source,ranges(),fanout,find_args):
+      if page == None:
+        print "Error: Could not enumerate campaign: " + campaign
+        exit(1)
+      for obj in page:
+        yield obj
+  finally:
+    if pool != None:
+      pool.close()
+      pool.join()
+
+  #Entries added after the first page was read are picked up sequentially.
+  offset = last[0] + last[1]
+  while len(page) == last[1]:
+    last[1] = page_size(limit)
+    page = find("",campaign,source,"",last[1],offset,**find_args).get('objects',[])
+    for obj in page:
+      yield obj
+    offset += last[1]
+
+
+
+def fetch_pages_in_executor(submit_find,campaign,source,ranges,window,find_args):
+  """
+  Schedules a page request for each (offset, size) in ranges through a CritsExecutor find method.
+  ranges is only read as pages are scheduled, so the sizes can change during the listing.
+  At most window pages are outstanding and the pages are yielded in offset order.
+  A page that could not be fetched is yielded as None.
+
+  :param submit_find: The CritsExecutor find method (e.g. CritsExecutor.find_ip).
+  :type submit_find: function
+  :param campaign: The string containing the campaign name to enumerate.
+  :type campaign: str
+  :param source: The string representing the CRITs source.
+  :type source: str
+  :param ranges: The offset and size of each page to fetch.
+  :type ranges: iterable of (int, int)
+  :param window: The max number of pages requested ahead of the consumer.
+  :type window: int
+  :param find_args: Extra keyword arguments for every submit_find call.
+  :type find_args: dict
+  :returns: generator of list
+  """
+  pending = deque()
+
+  def next_page():
+    try:
+      return pending.popleft().get().get('objects',[])
+    except crits_executor.CritsExecutorError:
+      return None
+
+  for offset, size in ranges:
+    pending.append(submit_find("",campaign,source,"",size,offset,**find_args))
+    if len(pending) >= max(window,1):
+      yield next_page()
+
+  while pending:
+    yield next_page()
+
+
+
+def add_entries(crits,entries,campaign,source,indicator,confidence,workers,debug,executor=None,kind='ip'):
+  """
+  Adds each IP or domain in entries to CRITs with one crits.add_ips or crits.add_domains batch
+  of at most workers adds in flight.
+  A failed add does not stop the others. The result of every add is collected
+  and a summary of the successes and failures is printed at the end.
+  If executor is supplied, the adds are scheduled on the CritsExecutor instead.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param entries: The IPs or CIDRs to add.
+  :type entries: iterable
+  :param campaign: The string containing the campaign name to use.
+  :type campaign: str
+  :param source: The string representing the CRITs source. It must already exist.
+  :type source: str
+  :param indicator: The boolean representing whether or not these are indicators.
+  :type indicator: boolean
+  :param confidence: The string representing the confidence to use.
+  :type confidence: str
+  :param workers: The number of adds that may be in flight at once.
+  :type workers: int
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param executor: The CritsExecutor to schedule the adds on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param kind: The kind of the entries ('ip' or 'domain').
+  :type kind: str
+  :returns: list, list (the entries that were added, the entries that failed)
+  """
+
+  added = []
+  failed = []
+  messages = {}
+
+  if executor != None:
+    results = add_entries_in_executor(executor,entries,campaign,source,indicator,confidence,kind)
+  else:
+    results = []
+    for result in add_batch(crits,entries,campaign,source,indicator,confidence,workers,kind):
+      results.append((result['item'][kind], result['ok']))
+      if not result['ok']:
+        messages[result['item'][kind]] = result['message']
+      elif debug:
+        print "Successfully added " + result['item'][kind]
+
+  for entry, result in results:
+    if result == False:
+      failed.append(entry)
+    else:
+      added.append(entry)
+
+  print "Add summary for campaign " + campaign + ": " + str(len(added)) + " added, " + str(len(failed)) + " failed"
+  for entry in failed:
+    if messages.get(entry):
+      print "Failed to add " + KIND_LABELS[kind] + " " + entry + ": " + messages[entry]
+    else:
+      print "Failed to add " + KIND_LABELS[kind] + " " + entry
+
+  return (added, failed)
+
+
+
+def add_batch(crits,entries,campaign,source,indicator,confidence,workers,kind='ip'):
+  """
+  Sends the adds of entries as one crits.add_ips or crits.add_domains batch and returns
+  its results. Each result's item holds the entry under the key kind.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param entries: The IPs, CIDRs or domains to add.
+  :type entries: iterable
+  :param campaign: The string containing the campaign name to use.
+  :type campaign: str
+  :param source: The string representing the CRITs source. It must already exist.
+  :type source: str
+  :param indicator: The boolean representing whether or not these are indicators.
+  :type indicator: boolean
+  :param confidence: The string representing the confidence to use.
+  :type confidence: str
+  :param workers: The number of adds that may be in flight at once.
+  :type workers: int
+  :param kind: The kind of the entries ('ip' or 'domain').
+  :type kind: str
+  :returns: list of dict (see crits._batch)
+  """
+
+  if kind == 'domain':
+    return crits.add_domains([{'domain' : entry} for entry in entries],workers,campaign=campaign,
+                             source=source,indicator=indicator,confidence=confidence)
+
+  records = []
+  for entry in entries:
+    e_ip,e_type = get_ip_and_type(entry)
+    records.append({'ip' : e_ip, 'ip_type' : e_type})
+
+  return crits.add_ips(records,workers,campaign=campaign,source=source,
+                       indicator=indicator,confidence=confidence)
+
+
+
+def add_entries_in_executor(executor,entries,campaign,source,indicator,confidence,kind='ip'):
+  """
+  Schedules an add for each entry on the CritsExecutor.
+  The executor bounds the number of adds in flight. Yields (entry, result) as each
+  add completes, in submission order. A failed add yields a result of False.
+
+  :param executor: The CritsExecutor to schedule the adds on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param entries: The IPs or CIDRs to add.
+  :type entries: iterable
+  :param campaign: The string containing the campaign name to use.
+  :type campaign: str
+  :param source: The string representing the CRITs source. It must already exist.
+  :type source: str
+  :param indicator: The boolean representing whether or not these are indicators.
+  :type indicator: boolean
+  :param confidence: The string representing the confidence to use.
+  :type confidence: str
+  :param kind: The kind of the entries ('ip' or 'domain').
+  :type kind: str
+  :returns: generator of (str, boolean)
+  """
+  pending = deque()
+
+  def next_result():
+    entry, handle = pending.popleft()
+    try:
+      return (entry, handle.get())
+    except crits_executor.CritsExecutorError:
+      return (entry, False)
+
+  for entry in entries:
+    if kind == 'domain':
+      pending.append((entry, executor.add_domain(entry,campaign,source,indicator,confidence)))
+    else:
+      e_ip,e_type = get_ip_and_type(entry)
+      pending.append((entry, executor.add_ip(e_ip,campaign,source,e_type,indicator,confidence)))
+    if len(pending) >= executor.max_in_flight:
+      yield next_result()
+
+  while pending:
+    yield next_result()
+
+
+
+def index_record(result,shared):
+  """
+  Reduces a CRITs IP or domain object to the fields needed to expire it.
+  Identical campaign and source lists are stored once and shared between records.
+
+  :param result: An object returned by a CRITs find query.
+  :type result: dict
+  :param shared: The tuples already in use, keyed by themselves.
+  :type shared: dict
+  :returns: (str, tuple, tuple) The _id, campaign names and source names.
+  """
+  campaigns = tuple(c['name'] for c in result.get('campaign',[]))
+  sources = tuple(s['name'] for s in result.get('source',[]))
+
+  return (result['_id'], shared.setdefault(campaigns,campaigns), shared.setdefault(sources,sources))
+
+
+
+def load_campaign_index(crits,kind,campaign,source,fanout,debug,executor=None,mirror=None):
+  """
+  Returns an index of the campaign's existing records (see index_record).
+  Only the value and INDEX_FIELDS of each record are requested.
+  Without a mirror, every record is listed from CRITs.
+  With a mirror, only records modified since the mirror's watermark are requested.
+  If the campaign's count in CRITs then differs from the mirror, the campaign is rescanned in full.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param kind: The type of record to index ('ip' or 'domain').
+  :type kind: str
+  :param campaign: The string containing the campaign name to index.
+  :type campaign: str
+  :param source: The string representing the CRITs source.
+  :type source: str
+  :param fanout: The number of campaign pages fetched at once.
+  :type fanout: int
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param executor: The CritsExecutor to schedule requests on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param mirror: The local copy of the campaign membership.
+  :type mirror: :class:`libs2\mirror.CampaignMirror`
+  :returns: dict
+  """
+  find = getattr(crits, 'find_' + kind)
+  submit_find = None
+  if executor != None:
+    submit_find = getattr(executor, 'find_' + kind)
+
+  fields = (kind,) + INDEX_FIELDS
+
+  if mirror == None:
+    existing_index = {}
+    shared = {}
+    for result in enumerate_campaign(find,campaign,source,fanout,debug,submit_find=submit_find,find_args={'fields':fields},
+                                     page_size=crits.page_size):
+      existing_index[result[kind]] = index_record(result,shared)
+    return existing_index
+
+  watermark = mirror.watermark(kind,campaign)
+
+  if watermark != None:
+    changed = mirror.upsert(kind,campaign,enumerate_campaign(find,campaign,source,fanout,debug,
+                                                             submit_find=submit_find,find_args={'modified_since':watermark,
+                                                                                    'fields':fields},
+                                                             page_size=crits.page_size))
+    total = find("",campaign,source,"",1,0,meta=True,fields=('_id',))['meta']['total_count']
+    mirrored = mirror.count(kind,campaign)
+
+    if debug:
+      print "Mirror refresh for " + campaign + ": " + str(changed) + " changed since " + watermark
+
+    if total == mirrored:
+      return mirror.index(kind,campaign)
+
+    print "Warning: The mirror has " + str(mirrored) + " entries for " + campaign + " but CRITs has " + str(total) + ". Rescanning."
+    mirror.clear(kind,campaign)
+
+  loaded = mirror.upsert(kind,campaign,enumerate_campaign(find,campaign,source,fanout,debug,submit_find=submit_find,
+                                                         find_args={'fields':fields},page_size=crits.page_size))
+
+  if debug:
+    print "Mirror full scan for " + campaign + ": " + str(loaded) + " entries"
+
+  return mirror.index(kind,campaign)
+
+
+
+def diff_file(crits,file,campaign,source,debug,fanout=1,executor=None,mirror=None,parse=None,kind='ip'):
+  """
+  Lists the campaign's existing records and works out which entries of the file must be added.
+  The entries to add are the file's own IPs and CIDRs. An existing IP or CIDR record is
+  kept when the file covers every address in it, and entries of the file that a kept
+  record covers are not added again. Nothing is written to CRITs.
+  For domains, the normalized names from the file are kept in a DomainSet and the names
+  that the campaign already has are not added again.
+  The lines are read with parse, or with the plain parser for the kind if it is not set.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param file: The list of lines from the file
+  :type file: list
+  :param campaign: The string containing the campaign name to use.
+  :type campaign: str
+  :param source: The string representing the CRITs source. It must already exist.
+  :type source: str
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param fanout: The number of campaign pages fetched at once.
+  :type fanout: int
+  :param executor: The CritsExecutor to schedule the page fetches on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param mirror: The local copy of the campaign membership to refresh instead of listing every record.
+  :type mirror: :class:`libs2\mirror.CampaignMirror`
+  :param parse: The feed parser for the file's format (see get_feed_parser).
+  :type parse: function
+  :param kind: The kind of the records ('ip' or 'domain').
+  :type kind: str
+  :returns: IPv4Set or DomainSet, dict (see index_record), list (the entries from the file,
+            the index of the campaign's existing records and the entries to add)
+  """
+  with profile_phase('enumerate'):
+    existing_index = load_campaign_index(crits,kind,campaign,source,fanout,debug,executor,mirror)
+
+  if parse == None and kind == 'domain':
+    parse = feed_parsers.get_domain_parser('plain')
+  elif parse == None:
+    parse = feed_parsers.get_parser('plain')
+
+  #A list that is streamed straight from its download is read here, so its download time counts as diff.
+  with profile_phase('diff'):
+    if kind == 'domain':
+      new_set = domainset.DomainSet(domain for domain, domain_type in parse(file))
+    else:
+      new_set = ipset.IPv4Set(ip for ip, ip_type in parse(file))
+
+    #Only the existing records that the file still fully covers are kept by remove_expired_entries.
+    existing = existing_index.keys()
+
+    if kind == 'domain':
+      kept = [entry for entry, covered in zip(existing, new_set.covers(existing)) if covered]
+      new_adds = [entry for entry in new_set.difference(kept)]
+    else:
+      #The ranges only decide coverage. An address inside a kept CIDR is not added again.
+      kept, expired, kept_ranges = new_set.split(existing)
+      new_adds = [entry for entry in new_set.difference(kept_ranges)]
+
+  if debug:
+    print "Existing " + KIND_NAMES[kind] + " count: " + str(len(existing_index))
+    print "File " + KIND_NAMES[kind] + " count: " + str(len(new_set))
+    print "Existing " + KIND_NAMES[kind] + "s covered by file: " + str(len(kept))
+    print "New additions: " + str(len(new_adds))
+
+  return(new_set,existing_index,new_adds)
+
+
+
+def process_file(crits,file,campaign,source,indicator,confidence,debug,workers=None,fanout=1,executor=None,mirror=None,parse=None,kind='ip'):
+  """
+  Takes the list of lines from the provided file and inserts them into the database.
+  The campaign, source, indicator and confidence settings will be used for each entry.
+  The entries to add are worked out by diff_file.
+  This returns the entries from the file regardless of whether they were inserted,
+  and an index of the campaign's existing records built while listing them.
+  Both can be passed to remove_expired_entries to compare with the database records.
+  The ips that could not be added are returned last.
+  If workers is set, the adds are sent concurrently by add_entries and failures are
+  summarized instead of aborting the run. If executor is set, the page fetches and adds
+  are scheduled on the CritsExecutor.
+  The lines are read with parse, or with the plain parser if it is not set.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param file: The list of lines from the file
+  :type file: list
+  :param campaign: The string containing the campaign name to use.
+  :type campaign: str
+  :param source: The string representing the CRITs source. It must already exist.
+  :type source: str
+  :param indicator: The boolean representing whether or not these are indicators.
+  :type indicator: boolean
+  :param confidence: The string representing the confidence to use.
+  :type confidence: str
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param workers: The number of concurrent adds. None adds one at a time.
+  :type workers: int
+  :param fanout: The number of campaign pages fetched at once.
+  :type fanout: int
+  :param executor: The CritsExecutor to schedule requests on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param mirror: The local copy of the campaign membership to refresh instead of listing every record.
+  :type mirror: :class:`libs2\mirror.CampaignMirror`
+  :param parse: The feed parser for the file's format (see get_feed_parser).
+  :type parse: function
+  :param kind: The kind of the records ('ip' or 'domain').
+  :type kind: str
+  :returns: IPv4Set or DomainSet, dict (see index_record), list
+  """
+  new_set,existing_index,new_adds = diff_file(crits,file,campaign,source,debug,fanout,executor,mirror,parse,kind)
+
+  with profile_phase('add'):
+    if workers or executor != None:
+      added, failed = add_entries(crits,new_adds,campaign,source,indicator,confidence,workers,debug,executor,kind)
+      return(new_set,existing_index,failed)
+
+    for entry in new_adds:
+      if kind == 'domain':
+        if crits.add_domain(entry,campaign,source,indicator,confidence) == False:
+          print "Error adding domain " + entry + " in campaign: " + campaign
+          exit(1)
+        continue
+
+      #This is a little weird since I asked for the type previously and threw it away
+      e_ip,e_type = get_ip_and_type(entry)
+
+      if crits.add_ip(e_ip,campaign,source,e_type,indicator,confidence) == False:
+        print "Error adding IP address " + entry + " in campaign: " + campaign
+        exit(1)
+
+  return(new_set,existing_index,[])
+
+
+
+def check_campaign_list(result, args):
+  """
+  This is used by the delete whether the campaign exists.
+  If a campaign was requested that doesn't exist, then it exits with an error.
+  Otherwise, the campaign is returned.
+
+  :param result: The returned value from a CRITs find query.
+  :type result: arr
+  :param args: The args array from the command line
+  :type args: object
+  :returns: str
+  """
+  del_campaign = ""
+
+  if len(result[0]['campaign']) > 1 and args.campaign:
+    for entry in result[0]['campaign']:
+      if entry['name'] == args.campaign:
+        del_campaign = args.campaign
+
+    if del_campaign == "":
+      print "Error: The campaign " + args.campaign + " is not associated with that IP."
+      exit(1)
+
+  return (del_campaign)
+
+
+
+def check_source_list(result, args):
+  """
+  This is used by the delete functionality to determine whether to delete a source.
+  If there is only one source left, it returns a blank string. 
+  If more than one exists, then it returns the source.
+  If the source does not exist, it exits with an error.
+
+  :param result: The returned value from a CRITs find query.
+  :type result: arr
+  :param args: The args array from the command line
+  :type args: object
+  :returns: str
+  """
+
+  del_source = ""
+  if len(result[0]['source']) > 1 and args.source:
+    for entry in result[0]['source']:
+      if entry['name'] == source:
+        del_source = source
+
+    if del_source == "":
+      print "Error: The source " + args.source + " is not associated with that IP."
+      exit(1)
+
+  return (del_source)
+
+
+
+
+def remove_expired_entries(crits,campaign,source,in_set,existing_index,debug,mirror=None,workers=None,kind='ip'):
+  """
+  This takes the index of the campaign's IPs built by process_file and diffs it with the ranges in in_set.
+  IPs and CIDRs that exist in the CRITs database but are not fully covered by in_set are considered expired.
+  Any IPs that were in the database that are not covered by in_set, are removed from the database.
+  The _id, campaigns and sources for each expired IP come from the index, so no lookups are needed.
+  The removals are decided by plan_removals and sent by execute_removals. Returns the IPs that could not be removed.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param campaign: The string containing the campaign name that is being processed.
+  :type campaign: str
+  :param source: The string representing the CRITs source. It must already exist.
+  :type source: str
+  :param in_set: The entries from the OS IP list
+  :type in_set: :class:`libs2\ipset.IPv4Set`
+  :param existing_index: The IPs from the CRITs database mapped to their record (see index_record)
+  :type existing_index: dict
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param mirror: The local copy of the campaign membership. IPs that leave the campaign are removed from it.
+  :type mirror: :class:`libs2\mirror.CampaignMirror`
+  :param workers: The number of concurrent removals. None removes one at a time.
+  :type workers: int
+  :param kind: The kind of the records ('ip' or 'domain').
+  :type kind: str
+  :returns: list
+  """
+
+  records = plan_removals(campaign,source,in_set,existing_index,debug)
+  return execute_removals(crits,campaign,records,debug,mirror,workers,kind)
+
+
+
+def plan_removals(campaign,source,in_set,existing_index,debug):
+  """
+  Returns the removal records for the IPs in existing_index that are not fully covered by in_set.
+  An IP in other campaigns is only removed from this campaign, an IP from other sources also
+  loses this source, and any other IP is deleted. Nothing is written to CRITs.
+
+  :param campaign: The string containing the campaign name that is being processed.
+  :type campaign: str
+  :param source: The string representing the CRITs source.
+  :type source: str
+  :param in_set: The entries from the OS IP list, or the names from a domain list
+  :type in_set: :class:`libs2\ipset.IPv4Set` or :class:`libs2\domainset.DomainSet`
+  :param existing_index: The IPs or domains from the CRITs database mapped to their record (see index_record)
+  :type existing_index: dict
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: list of dict with the keys value, id, campaign and source (see crits.delete_ips)
+  """
+
+  existing = existing_index.keys()
+  expired_set = [entry for entry, covered in zip(existing, in_set.covers(existing)) if not covered]
+
+  if debug:
+    print "Expired set count: " + str(len(expired_set))
+
+  records = []
+
+  for entry in expired_set:
+    ip_id, ip_campaigns, ip_sources = existing_index[entry]
+
+    del_campaign=""
+    if len(ip_campaigns) > 1:
+      del_campaign=campaign
+
+    del_source=""
+    if len(ip_sources) > 1:
+      del_source=source
+
+    records.append({'value' : entry, 'id' : ip_id, 'campaign' : del_campaign, 'source' : del_source})
+
+  return records
+
+
+
+def execute_removals(crits,campaign,records,debug,mirror=None,workers=None,kind='ip'):
+  """
+  Sends the removal records built by plan_removals as one crits.delete_ips
+  (or crits.delete_domains) batch. Returns the IPs or domains that could not be removed.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param campaign: The string containing the campaign name that is being processed.
+  :type campaign: str
+  :param records: The removal records.
+  :type records: list of dict
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param mirror: The local copy of the campaign membership. IPs that leave the campaign are removed from it.
+  :type mirror: :class:`libs2\mirror.CampaignMirror`
+  :param workers: The number of concurrent removals. None removes one at a time.
+  :type workers: int
+  :param kind: The kind of the records ('ip' or 'domain').
+  :type kind: str
+  :returns: list
+  """
+
+  for record in records:
+    print "Deleting " + kind + "_id: " + record['id'] + " campaign: " + record['campaign'] + " source: " + record['source']
+
+  departed = []
+  failed = []
 
-  if (indicator != "True" and indicator != "False"):
-     print "Error: The indicator is a boolean and can only be 'True' or 'False'"
-     exit(1)
-  elif indicator == "True":
-     return (True)
+  if kind == 'domain':
+    results = crits.delete_domains(records,workers or 1)
+  else:
+    results = crits.delete_ips(records,workers or 1)
 
-  return(False)
+  for result in results:
+    record = result['item']
+    if not result['ok']:
+      print "Error: Could not delete " + KIND_NAMES[kind] + ": " + record['id'] + " " + result['message']
+      failed.append(record['value'])
+    else:
+      if debug:
+        print "Successfully removed " + record['id']
+      #An IP that only lost its source is still part of the campaign.
+      if record['campaign'] != "" or record['source'] == "":
+        departed.append(record['value'])
 
+  if mirror != None:
+    mirror.remove(kind,campaign,departed)
 
+  return failed
 
-def get_confidence(Config,args,debug):
+
+def get_os_list_names(OSConfig,value,kind=None):
   """
-  Retrieve the confidence setting from the config file and/or command line.
-  Return a string containing the confidence level.
+  Expands the value of --update_os_ip_list or --update_os_domain_list into a list of list names.
+  "all" selects every list with a _URL entry under [Open Source Lists].
+  Otherwise the value is a comma separated list of names.
+  If kind is set, "all" only selects the lists of that kind (see get_list_kind) and
+  naming a list of another kind exits with an error.
+
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param value: The list name(s) from the command line.
+  :type value: str
+  :param kind: The kind of list to select ('ip' or 'domain'), or None for every list.
+  :type kind: str
+  :returns: list
+  """
+  if value.strip().lower() == "all":
+    names = []
+    if OSConfig.has_section('Open Source Lists'):
+      for option in OSConfig.options('Open Source Lists'):
+        if option.endswith('_url'):
+          name = option[:-len('_url')]
+          if kind == None or get_list_kind(OSConfig,name) == kind:
+            names.append(name)
+    if len(names) == 0 and kind != None:
+      print "Error: No " + KIND_NAMES[kind] + " lists with a _URL entry were found in the open source config file"
+      exit(1)
+    elif len(names) == 0:
+      print "Error: No lists with a _URL entry were found in the open source config file"
+      exit(1)
+    return names
 
-  :param Config: The ConfigParser variable for the file containing the variable.
-  :type Config: ConfigParser
-  :param args: The section of the config file that contains the variable
-  :type args: :class:`argparse.Namespace`
-  :param debug: A boolean indicating whether the debug flag is set.
-  :type debug: boolean
-  :returns: str
+  names = [name.strip() for name in value.split(',') if name.strip() != ""]
+  if kind != None:
+    for name in names:
+      if get_list_kind(OSConfig,name) != kind:
+        print "Error: The _type of " + name + " is " + get_list_kind(OSConfig,name) + ", not " + kind
+        exit(1)
+  return names
+
+
+
+def group_os_lists_by_url(OSConfig,os_list_names):
   """
-  confidence = get_config_setting(Config,"DefaultIndicatorInfo","confidence_level")
+  Groups the lists by their _URL so that each URL is only downloaded once.
+  The groups keep the order in which the lists were given.
+
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param os_list_names: The names of the lists in os_indicators.config.
+  :type os_list_names: list
+  :returns: list of (str, list), list (the URL groups, the names that have no URL)
+  """
+  groups = []
+  by_url = {}
+  missing = []
 
-  if args.confidence_level:
-    confidence = args.confidence_level
+  for name in os_list_names:
+    url = ""
+    if OSConfig.has_option('Open Source Lists',name + '_URL'):
+      url = get_config_setting(OSConfig,'Open Source Lists',name + '_URL')
 
-  if confidence == None:
-    return("low")
+    if url == None or url == "":
+      print "Error: Could not identify the url attribute in the config file for " + name
+      missing.append(name)
+      continue
+
+    if url not in by_url:
+      by_url[url] = []
+      groups.append((url, by_url[url]))
+    by_url[url].append(name)
+
+  return groups, missing
 
-  if (confidence != "low" and confidence != "medium" and confidence != "high"):
-     print "Error: Confidence level must be 'low', 'medium', or 'high'"
-     exit(1)
 
-  return(confidence)
 
+def new_sync_result(os_list_name,status='failed'):
+  """
+  Returns an empty result for sync_os_list.
+
+  :param os_list_name: The name of the list in os_indicators.config.
+  :type os_list_name: str
+  :param status: 'synced', 'partial', 'planned', 'unchanged', 'resumed' or 'failed'.
+                 'resumed' means the writes of an interrupted sync are still outstanding,
+                 so the new feed was not diffed. 'partial' means some writes failed.
+                 The command exits with 1 for any status in INCOMPLETE_STATUSES.
+  :type status: str
+  :returns: dict with the keys name, status, file, existing, add_failures, delete_failures and seconds
+  """
+  return {'name' : os_list_name, 'status' : status, 'file' : 0, 'existing' : 0,
+          'add_failures' : 0, 'delete_failures' : 0, 'seconds' : 0}
 
 
 
-def get_campaign(Config,args,debug):
+def sync_os_url(crits,OSConfig,args,os_url,os_list_names,settings,debug,host_slots=None):
   """
-  Retrieve the campaign setting from the config file and/or command line.
-  Return the string containing the campaign name
+  Downloads a feed once and syncs every list that uses it.
+  The download is split into each list's section in a single pass (see split_sections).
+  The whole body is read, into the feed cache or the sections' temporary files, before
+  the host slot is released, so the per-host limit covers the entire download.
+  Configuration problems and CRITs connection errors exit, as they do for the other commands.
 
-  :param Config: The ConfigParser variable for the file containing the variable.
-  :type Config: ConfigParser
-  :param args: The section of the config file that contains the variable
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param args: The args array from the command line
   :type args: :class:`argparse.Namespace`
+  :param os_url: The URL of the feed.
+  :type os_url: str
+  :param os_list_names: The names of the lists to sync from the feed.
+  :type os_list_names: list
+  :param settings: The campaign, indicator, confidence, page_fanout, executor,
+                   mirror_file, journal_file and feed_cache_dir to use for the sync, and
+                   the plan to add the writes to instead of sending them (or None).
+  :type settings: dict
   :param debug: A boolean indicating whether the debug flag is set.
   :type debug: boolean
-  :returns: str
+  :param host_slots: Semaphores keyed by upstream host that limit concurrent downloads per host.
+  :type host_slots: dict
+  :returns: list of dict (see new_sync_result)
   """
-  campaign = get_config_setting(Config,"DefaultIndicatorInfo","campaign_name")
-
-  if args.campaign:
-    campaign = args.campaign
+  host_slot = None
+  if host_slots != None:
+    host_slot = host_slots.get(urlparse.urlparse(os_url).netloc)
 
-  if campaign == None:
-    return("")
+  if host_slot != None:
+    host_slot.acquire()
 
-  return (campaign)
+  try:
+    with profile_phase('download'):
+      FeedCache = None
+      feed_version = None
+      if settings['feed_cache_dir']:
+        FeedCache = feed_cache.FeedCache(settings['feed_cache_dir'], DOWNLOAD_CHUNK_SIZE)
+        f, feed_version = download_feed(os_url,FeedCache,os_list_names,args.force_sync,debug)
+      else:
+        f = download_file(os_url)
+
+      if f == None:
+        if debug:
+          print "Skipping " + ", ".join(os_list_names)
+        return [new_sync_result(name,'unchanged') for name in os_list_names]
+
+      pending = os_list_names
+      if FeedCache != None and not args.force_sync:
+        pending = [name for name in os_list_names if not FeedCache.is_synced(name,feed_version)]
+
+      #The markers of every list that shares the URL bound the sections, not just the ones being synced.
+      sharing = [name for name in get_os_list_names(OSConfig,"all")
+                 if get_config_setting(OSConfig,'Open Source Lists',name + '_URL') == os_url]
+      markers = get_section_markers(OSConfig, Set(sharing).union(os_list_names))
+
+      #A cached feed is already on disk and can be read lazily. A download must be spooled here.
+      if FeedCache != None and len(pending) == 1 and pending[0] not in markers:
+        sections = {pending[0] : f}
+      else:
+        sections = split_sections(f, markers, pending)
+  finally:
+    if host_slot != None:
+      host_slot.release()
+
+  results = []
+  for name in os_list_names:
+    if name not in pending:
+      results.append(new_sync_result(name,'unchanged'))
+    elif sections[name] == None:
+      print "Error: Could not find the section for " + name + " in " + os_url
+      results.append(new_sync_result(name))
+    else:
+      results.append(sync_os_list(crits,OSConfig,args,name,sections[name],settings,debug,FeedCache,feed_version))
 
+  return results
 
 
 
-def get_source(Config,args,debug):
+def sync_os_list(crits,OSConfig,args,os_list_name,g,settings,debug,FeedCache=None,feed_version=None):
   """
-  Retrieve the source setting from the config file and/or command line.
-  Return a string specifying the source name.
+  Syncs the lines of one open source list with its campaign in CRITs.
+  New entries are added and entries that are no longer in the list are removed.
+  If settings has a plan, the adds and removals are added to the plan instead of being sent.
+  If settings has a journal_file, the adds and removals are stored in the journal before they
+  are sent (see send_journaled_writes). If the journal holds writes left over from an interrupted
+  sync of the campaign, only those are sent and the campaign is not listed or diffed.
+  Configuration problems and CRITs connection errors exit, as they do for the other commands.
 
-  :param Config: The ConfigParser variable for the file containing the variable.
-  :type Config: ConfigParser
-  :param args: The section of the config file that contains the variable
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
+  :param args: The args array from the command line
   :type args: :class:`argparse.Namespace`
+  :param os_list_name: The name of the list in os_indicators.config.
+  :type os_list_name: str
+  :param g: The lines of the list.
+  :type g: iterable of str
+  :param settings: See sync_os_url.
+  :type settings: dict
   :param debug: A boolean indicating whether the debug flag is set.
   :type debug: boolean
-  :returns: str
+  :param FeedCache: The feed cache that holds the download.
+  :type FeedCache: :class:`libs2\feed_cache.FeedCache`
+  :param feed_version: The version of the download to mark as synced if there are no failures.
+  :type feed_version: dict
+  :returns: dict (see new_sync_result)
   """
-  source = get_config_setting(Config,"DefaultIndicatorInfo","source")
-
-  if args.source:
-    source = args.source
-
-  if source == None:
-    return("")
-
-  return (source)
+  start = time.time()
+  result = new_sync_result(os_list_name)
 
+  os_source = get_config_setting(OSConfig,'Open Source Lists',os_list_name + '_source')
 
+  if os_source == None or os_source == "":
+    print "Error: Could not identify the source attribute in the config file for " + os_list_name
+    exit(1)
 
+  parse = get_feed_parser(OSConfig,os_list_name)
+  kind = get_list_kind(OSConfig,os_list_name)
 
-def get_ip_and_type(line):
-  """
-  This function will take a line from an open source file.
-  It extracts the IP relevant information (either an IP address or CIDR class)
-  It will return the IP value and the type of value('Address - cidr','Address - ipv4-addr') 
+  Mirror = None
+  if settings['mirror_file']:
+    Mirror = mirror.CampaignMirror(settings['mirror_file'])
 
-  :param A line containing an IP address or CIDR address class.
-  :type line: str
-  :returns: str, str
-  """
-  ip_result = re.match("^[0-9.]+([/0-9]+)?",line)
+  Journal = None
+  if settings.get('journal_file') and settings.get('plan') == None:
+    Journal = journal.WriteJournal(settings['journal_file'])
 
-  if ip_result == None:
-    return (None,None)
+  try:
+    os_campaign_prefix = get_config_setting(OSConfig,'General', 'open_source_campaign_prefix')
+    os_add_campaign = get_config_setting(OSConfig,'General', 'add_campaign_if_missing','boolean')
 
-  ip = ip_result.group(0)
 
-  if ip.find("/") != -1:
-    return (ip,"Address - cidr")
+    os_campaign = settings['campaign']
+    if args.campaign == None or args.campaign == "":
+      os_campaign = os_campaign_prefix + os_source
 
-  return (ip,"Address - ipv4-addr")
 
+    plan = settings.get('plan')
 
+    campaign_exists = crits.get_campaign_id(os_campaign)
+    if campaign_exists == None and os_add_campaign and plan != None:
+      print "Warning! Campaign does not exist! It will be added when the plan is executed: " + os_campaign
 
+    elif campaign_exists == None and os_add_campaign:
+      print "Warning! Campaign does not exist! Adding new campaign: " + os_campaign
+      crits.add_campaign(os_campaign, "Open source " + KIND_NAMES[kind] + " list from " + os_source)
 
-def get_section(f, first_delim, second_delim):
-  """
-  Some open-source indicator downloads contain multiple sections.
-  This will return the section of the file f that is between the first_delim and second_delim
-
-  :param f: The file containing the section to be processed
-  :type f: file
-  :param first_delim: A string representing the beginning of the section
-  :type first_delim: str
-  :param second_delim: A string representing the terminator of the section
-  :type second_delim: str
-  :returns: list
-  """
-  g = []
+    elif campaign_exists == None:
+      print "Error: Campaign does not exist! Aborting!"
+      exit(1)
 
-  line = f.readline()
 
-  while line.find(first_delim) == -1:
-    line = f.readline()
-    if not line: return(None)
+    if debug:
+      print "Processing file..."
+    if Mirror != None and args.full_rescan:
+      Mirror.clear(kind,os_campaign)
+
+    if plan != None:
+      in_set,existing_index,new_adds = diff_file(crits,g,os_campaign,os_source,debug,settings['page_fanout'],
+                                                 settings['executor'],Mirror,parse,kind)
+      plan.add_list(os_list_name,os_campaign,os_source,settings['indicator'],settings['confidence'],new_adds,
+                    plan_removals(os_campaign,os_source,in_set,existing_index,debug),
+                    campaign_exists == None,len(in_set),len(existing_index),kind)
+      result['file'] = len(in_set)
+      result['existing'] = len(existing_index)
+      result['status'] = 'planned'
+      return result
+
+    if Journal != None:
+      key = kind + ':' + os_campaign
+      if args.full_rescan:
+        Journal.discard(key)
+
+      outstanding = Journal.pending(key)
+      if outstanding != None:
+        print "Resuming the interrupted sync of " + os_campaign + ": " + str(len(outstanding[1])) + " writes outstanding"
+        add_failures,delete_failures,synced_version = send_journaled_writes(crits,Journal,key,args.workers,debug,
+                                                                             Mirror,settings['executor'],kind)
+
+        #The feed that the writes were worked out from is the one that is now synced.
+        if FeedCache != None and synced_version != None and not add_failures and not delete_failures:
+          FeedCache.mark_synced(os_list_name,synced_version)
+
+        #The new feed is only diffed once the journal has drained. Until then the failed writes are retried first.
+        if Journal.pending(key) != None:
+          result['add_failures'] = len(add_failures)
+          result['delete_failures'] = len(delete_failures)
+          result['status'] = 'resumed'
+          return result
+
+      in_set,existing_index,new_adds = diff_file(crits,g,os_campaign,os_source,debug,settings['page_fanout'],
+                                                 settings['executor'],Mirror,parse,kind)
+      Journal.begin(key,os_list_name,os_campaign,os_source,settings['indicator'],settings['confidence'],new_adds,
+                    plan_removals(os_campaign,os_source,in_set,existing_index,debug),feed_version)
+
+      add_failures,delete_failures,synced_version = send_journaled_writes(crits,Journal,key,args.workers,debug,
+                                                                           Mirror,settings['executor'],kind)
+
+      if FeedCache != None and synced_version != None and not add_failures and not delete_failures:
+        FeedCache.mark_synced(os_list_name,synced_version)
+
+      result['file'] = len(in_set)
+      result['existing'] = len(existing_index)
+      result['add_failures'] = len(add_failures)
+      result['delete_failures'] = len(delete_failures)
+      if add_failures or delete_failures:
+        result['status'] = 'partial'
+      else:
+        result['status'] = 'synced'
+      return result
+
+    in_set,existing_index,add_failures = process_file(crits,g,os_campaign,os_source,settings['indicator'],
+                                                      settings['confidence'],debug,args.workers,
+                                                      settings['page_fanout'],settings['executor'],Mirror,parse,kind)
 
-  line = f.readline()
-  if second_delim != "":
-    while line.find(second_delim) == -1:
-      g.append(line)
-      line = f.readline()
-  else:
-    for line in f:
-      g.append(line)
+    if debug:
+      print "Removing old entries..."
+    with profile_phase('remove'):
+      delete_failures = remove_expired_entries(crits,os_campaign,os_source,in_set,existing_index,debug,
+                                               Mirror,args.workers,kind)
+
+    #A feed with failed writes is synced again on the next run even if it has not changed.
+    if FeedCache != None and not add_failures and not delete_failures:
+      FeedCache.mark_synced(os_list_name,feed_version)
+
+    result['file'] = len(in_set)
+    result['existing'] = len(existing_index)
+    result['add_failures'] = len(add_failures)
+    result['delete_failures'] = len(delete_failures)
+    if add_failures or delete_failures:
+      result['status'] = 'partial'
+    else:
+      result['status'] = 'synced'
 
-  return(g)
+    return result
 
+  finally:
+    result['seconds'] = time.time() - start
+    if Mirror != None:
+      Mirror.close()
+    if Journal != None:
+      Journal.close()
 
 
 
-def process_file(crits,file,campaign,source,indicator,confidence,debug):
+def send_journaled_writes(crits,Journal,key,workers,debug,Mirror=None,executor=None,kind='ip'):
   """
-  Takes the list of lines from the provided file and inserts them into the database.
-  The campaign, source, indicator and confidence settings will be used for each entry.
-  This returns the set of ips from the file regardless of whether they were inserted.
-  The set can be passed to remove_expired_entries to compare with the database records.
+  Sends the outstanding writes of a sync stored in the journal, adds first and then removals.
+  The writes are sent in chunks of JOURNAL_CHUNK_SIZE and each chunk's successful writes are
+  marked done before the next chunk starts, so an interrupted run loses at most one chunk of
+  progress. Failed writes stay in the journal for the next run until they run out of attempts.
+  The sync is removed from the journal once nothing is outstanding.
 
   :param crits: The CRITs class to be used for connecting
   :type crits: :class:`libs2\crits`
-  :param file: The list of lines from the file
-  :type file: list
-  :param campaign: The string containing the campaign name to use.
-  :type campaign: str
-  :param source: The string representing the CRITs source. It must already exist.
-  :type source: str
-  :param indicator: The boolean representing whether or not these are indicators.
-  :type indicator: boolean
-  :param confidence: The string representing the confidence to use.
-  :type confidence: str
+  :param Journal: The write journal.
+  :type Journal: :class:`libs2\journal.WriteJournal`
+  :param key: The key of the sync in the journal.
+  :type key: str
+  :param workers: The number of writes in flight at once.
+  :type workers: int
   :param debug: A boolean indicating whether the debug flag is set.
   :type debug: boolean
-  :returns: Set, Set
+  :param Mirror: The local copy of the campaign membership. IPs that leave the campaign are removed from it.
+  :type Mirror: :class:`libs2\mirror.CampaignMirror`
+  :param executor: The CritsExecutor to schedule the adds on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param kind: The kind of the records ('ip' or 'domain').
+  :type kind: str
+  :returns: list, list, dict (the entries that could not be added, the entries that could not be removed,
+            and the feed version of the sync if it is finished, or None)
   """
-  new_set = Set([])
-  existing_set = Set([])
-  current_entries = ['foo']
-  limit = 1000
-  offset = 0
 
-  while current_entries != None and bool(current_entries):
-    current_entries = crits.find_ip("",campaign,source,"",limit,offset)
+  sync, writes = Journal.pending(key)
+  campaign = sync['campaign']
 
-    if current_entries != None:
-      for result in current_entries:
-        c_ip = result['ip']
-        existing_set.add(c_ip)
+  add_failures = []
+  delete_failures = []
+  sent = 0
+  abandoned = []
 
-    offset += 1000
+  for op in ['add','remove']:
+    todo = [write for write in writes if write['op'] == op]
 
-  for line in file:
-    line = line.strip()
-    ip, ip_type = get_ip_and_type(line)
-    if ip != None:
-      new_set.add(ip)
+    for i in xrange(0, len(todo), JOURNAL_CHUNK_SIZE):
+      chunk = todo[i:i + JOURNAL_CHUNK_SIZE]
 
-  new_adds = new_set.difference(existing_set)
+      if op == 'add':
+        with profile_phase('add'):
+          failures = send_journaled_adds(crits,[write['value'] for write in chunk],sync,workers,debug,executor,kind)
+        add_failures.extend(failures.keys())
+      else:
+        with profile_phase('remove'):
+          failed = execute_removals(crits,campaign,[write['record'] for write in chunk],debug,Mirror,workers,kind)
+        failures = dict((value, "Could not remove the " + KIND_NAMES[kind]) for value in failed)
+        delete_failures.extend(failed)
 
-  if debug:
-    print "Existing IP count: " + str(len(existing_set))
-    print "File IP count: " + str(len(new_set))
-    print "New additions: " + str(len(new_adds))
+      Journal.complete(key,[write['seq'] for write in chunk if write['value'] not in failures])
+      abandoned.extend(Journal.failed(key,dict((write['seq'], failures[write['value']])
+                                               for write in chunk if write['value'] in failures)))
+      sent += len(chunk) - len(failures)
 
-  for entry in new_adds:
-    #This is a little weird since I asked for the type previously and threw it away
-    e_ip,e_type = get_ip_and_type(entry)
+  print "Journal summary for campaign " + campaign + ": " + str(sent) + " sent, " + \
+        str(len(add_failures) + len(delete_failures)) + " failed, " + str(len(abandoned)) + " given up"
 
-    if crits.add_ip(e_ip,campaign,source,e_type,indicator,confidence) == False:
-      print "Error adding IP address " + line + " in campaign: " + campaign
-      exit(1)
+  if Journal.finish(key):
+    #A sync that gave up on writes is not complete, so its feed is synced again on the next run.
+    if abandoned:
+      return (add_failures,delete_failures,None)
+    return (add_failures,delete_failures,sync['feed_version'])
 
-  return(new_set,existing_set)
+  return (add_failures,delete_failures,None)
 
 
 
-def check_campaign_list(result, args):
+def send_journaled_adds(crits,entries,sync,workers,debug,executor=None,kind='ip'):
   """
-  This is used by the delete whether the campaign exists.
-  If a campaign was requested that doesn't exist, then it exits with an error.
-  Otherwise, the campaign is returned.
+  Adds the entries with the campaign, source, indicator and confidence of a journaled sync.
+  Returns the entries that could not be added mapped to the reason.
 
-  :param result: The returned value from a CRITs find query.
-  :type result: arr
-  :param args: The args array from the command line
-  :type args: object
-  :returns: str
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param entries: The IPs, CIDRs or domains to add.
+  :type entries: list of str
+  :param sync: The sync from WriteJournal.pending.
+  :type sync: dict
+  :param workers: The number of adds in flight at once.
+  :type workers: int
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :param executor: The CritsExecutor to schedule the adds on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :param kind: The kind of the entries ('ip' or 'domain').
+  :type kind: str
+  :returns: dict
   """
-  del_campaign = ""
 
-  if len(result[0]['campaign']) > 1 and args.campaign:
-    for entry in result[0]['campaign']:
-      if entry['name'] == args.campaign:
-        del_campaign = args.campaign
+  failures = {}
 
-    if del_campaign == "":
-      print "Error: The campaign " + args.campaign + " is not associated with that IP."
-      exit(1)
+  if executor != None:
+    for entry, result in add_entries_in_executor(executor,entries,sync['campaign'],sync['source'],
+                                           sync['indicator'],sync['confidence'],kind):
+      if result == False:
+        print "Failed to add " + KIND_LABELS[kind] + " " + entry
+        failures[entry] = "Could not add the " + KIND_NAMES[kind]
+    return failures
 
-  return (del_campaign)
+  for result in add_batch(crits,entries,sync['campaign'],sync['source'],sync['indicator'],
+                          sync['confidence'],workers,kind):
+    if not result['ok']:
+      print "Failed to add " + KIND_LABELS[kind] + " " + result['item'][kind] + ": " + result['message']
+      failures[result['item'][kind]] = result['message']
+    elif debug:
+      print "Successfully added " + result['item'][kind]
 
+  return failures
 
 
-def check_source_list(result, args):
+
+def sync_os_lists(crits,OSConfig,args,os_list_names,settings,debug):
   """
-  This is used by the delete functionality to determine whether to delete a source.
-  If there is only one source left, it returns a blank string. 
-  If more than one exists, then it returns the source.
-  If the source does not exist, it exits with an error.
+  Syncs several lists at once. Lists that share a URL are downloaded once (see sync_os_url).
+  At most --feed_workers feeds are processed concurrently and at most
+  --feed_host_limit of them download from the same upstream host at a time.
+  A list that fails is reported in its result instead of stopping the others.
 
-  :param result: The returned value from a CRITs find query.
-  :type result: arr
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param OSConfig: The ConfigParser for the open source config file.
+  :type OSConfig: ConfigParser
   :param args: The args array from the command line
-  :type args: object
-  :returns: str
+  :type args: :class:`argparse.Namespace`
+  :param os_list_names: The names of the lists in os_indicators.config.
+  :type os_list_names: list
+  :param settings: See sync_os_url.
+  :type settings: dict
+  :param debug: A boolean indicating whether the debug flag is set.
+  :type debug: boolean
+  :returns: list of dict (see new_sync_result)
   """
+  groups, missing = group_os_lists_by_url(OSConfig,os_list_names)
+
+  host_slots = {}
+  for url, names in groups:
+    host = urlparse.urlparse(url).netloc
+    host_slots.setdefault(host, threading.BoundedSemaphore(max(args.feed_host_limit,1)))
+
+  def run(group):
+    url, names = group
+    try:
+      return sync_os_url(crits,OSConfig,args,url,names,settings,debug,host_slots)
+    except SystemExit:
+      return [new_sync_result(name) for name in names]
+    except Exception as e:
+      print "Error: Unexpected error syncing " + url + ": " + str(e)
+      return [new_sync_result(name) for name in names]
+
+  pool = ThreadPool(max(args.feed_workers,1))
+  try:
+    results = [new_sync_result(name) for name in missing]
+    for group_results in pool.map(run, groups):
+      results.extend(group_results)
+    return results
+  finally:
+    pool.close()
+    pool.join()
 
-  del_source = ""
-  if len(result[0]['source']) > 1 and args.source:
-    for entry in result[0]['source']:
-      if entry['name'] == source:
-        del_source = source
 
-    if del_source == "":
-      print "Error: The source " + args.source + " is not associated with that IP."
-      exit(1)
 
-  return (del_source)
+def plan_workers(crits,workers):
+  """
+  Returns the number of writes that a plan is sent with. Both the estimate of --plan and
+  execute_plan use it, so the estimate assumes the concurrency that the writes are sent with.
+
+  :param crits: The CRITs class to be used for connecting
+  :type crits: :class:`libs2\crits`
+  :param workers: The value of --workers. None uses the client's pool_maxsize, like crits.add_ips.
+  :type workers: int
+  :returns: int
+  """
 
+  if workers == None:
+    return crits.pool_maxsize
+  return workers
 
 
 
-def remove_expired_entries(crits,campaign,source,in_set,existing_set,debug):
+def execute_plan(crits,plan,workers,mirror_file,debug,executor=None):
   """
-  This will download all the IPs from the CRITs database for the given campaign.
-  It will then take that set of IPs and diff them with the IPs in in_set.
-  IPs that exist in the CRITs database but not within in_set are considered expired.
-  Any IPs that were in the database that are not in in_set, are removed from the database.
+  Sends the adds and removals of a plan written by --plan.
+  The campaigns that the plan marks as missing are added first. A list whose campaign
+  could not be added is reported as failed, and failed writes are reported in each
+  list's result instead of stopping the others.
 
   :param crits: The CRITs class to be used for connecting
   :type crits: :class:`libs2\crits`
-  :param campaign: The string containing the campaign name that is being processed.
-  :type campaign: str
-  :param source: The string representing the CRITs source. It must already exist.
-  :type source: str
-  :param in_set: The set of IPs from the OS IP list
-  :type in_set: Set
-  :param existing_set: The set of IPs from the CRITs database
-  :type existing_set: Set
+  :param plan: The plan (see sync_plan.load).
+  :type plan: dict
+  :param workers: The number of writes in flight at once. None uses plan_workers' default.
+  :type workers: int
+  :param mirror_file: The SQLite mirror to remove departed IPs and domains from, or "".
+  :type mirror_file: str
   :param debug: A boolean indicating whether the debug flag is set.
   :type debug: boolean
+  :param executor: The CritsExecutor to schedule the adds on.
+  :type executor: :class:`libs2\crits_executor.CritsExecutor`
+  :returns: list of dict (see new_sync_result)
   """
 
-  expired_set = existing_set.difference(in_set)
-
-  if debug:
-    print "Expired set count: " + str(len(expired_set))
-
-  for entry in expired_set:
-    ip_result = CRITs.find_ip(entry)
-
-    if ip_result == None:
-      print "Error could not find the IP: " + entry + " in campaign: " + campaign
-      exit(1)
+  results = []
+  workers = plan_workers(crits,workers)
+
+  for entry in plan['lists']:
+    start = time.time()
+    result = new_sync_result(entry['name'])
+    result['file'] = entry['file']
+    result['existing'] = entry['existing']
+    campaign = entry['campaign']
+    kind = entry.get('kind','ip')
+
+    if entry['create_campaign'] and crits.get_campaign_id(campaign) == None:
+      print "Adding new campaign: " + campaign
+      if crits.add_campaign(campaign, "Open source " + KIND_NAMES[kind] + " list from " + entry['source']) == False:
+        print "Error: Could not add the campaign " + campaign
+        result['seconds'] = time.time() - start
+        results.append(result)
+        continue
+
+    Mirror = None
+    if mirror_file:
+      Mirror = mirror.CampaignMirror(mirror_file)
+
+    try:
+      with profile_phase('add'):
+        added, add_failures = add_entries(crits,entry['adds'],campaign,entry['source'],entry['indicator'],
+                                          entry['confidence'],workers,debug,executor,kind)
+
+      with profile_phase('remove'):
+        records = entry['deletes'] + entry['source_removals'] + entry['campaign_removals']
+        delete_failures = execute_removals(crits,campaign,records,debug,Mirror,workers,kind)
+    finally:
+      if Mirror != None:
+        Mirror.close()
+
+    result['add_failures'] = len(add_failures)
+    result['delete_failures'] = len(delete_failures)
+    if add_failures or delete_failures:
+      result['status'] = 'partial'
+    else:
+      result['status'] = 'synced'
+    result['seconds'] = time.time() - start
+    results.append(result)
 
-    ip_id = ip_result[0]['_id']
+  return results
 
-    del_campaign=""
-    if len(ip_result[0]['campaign']) > 1:
-      del_campaign=campaign
 
-    del_source=""
-    if len(ip_result[0]['source']) > 1:
-      del_source=source
 
-    print "Deleting ip_id: " + ip_id + " campaign: " + del_campaign + " source: " + del_source
+def print_sync_results(results):
+  """
+  Prints a table with one row per synced list.
 
-    if del_campaign == "" and del_source == "":
-      result = CRITs.delete_ip(ip_id)
-    else:
-      if del_source != "":
-        result = CRITs.delete_ip_reference(ip_id,del_source)
-        if not result:
-          print "There was an error deleting the source!"
-          exit(1)
-      if del_campaign != "":
-        campaign_result = CRITs.find_campaign(del_campaign)
-        if campaign_result == None:
-          print "Error: Could not find the campaign: " + del_campaign
-          exit(1)
-        campaign_id = campaign_result[0]['_id']
-        result = CRITs.delete_campaign_reference(campaign_id,"IP",ip_id)
+  :param results: The results returned by sync_os_lists.
+  :type results: list of dict
+  """
+  row = "%-20s %-10s %10s %10s %12s %15s %9s"
+  print row % ("List","Status","File","Existing","Add errors","Delete errors","Seconds")
+  for r in results:
+    print row % (r['name'], r['status'], r['file'], r['existing'], r['add_failures'],
+                 r['delete_failures'], "%.1f" % r['seconds'])
 
-    if not result:
-      print "Error: Could not delete IP: " + ip_id
 
 
 if __name__ == '__main__':
@@ -532,6 +2101,38 @@ if __name__ == '__main__':
                    help='The CRITS configuration file to use')
   parser.add_argument('--os_config_file', default=OS_CONFIG_FILE,
                    help='The open source configuration file to use')
+  parser.add_argument('--workers', type=int,
+                   help='The number of concurrent adds when importing or updating a list')
+  parser.add_argument('--page_fanout', type=int,
+                   help='The number of campaign pages to fetch at once when listing existing entries')
+  parser.add_argument('--client', choices=['sync','executor'], default='sync',
+                   help='Whether bulk imports and updates use a thread pool per batch or one shared CritsExecutor')
+  parser.add_argument('--mirror',
+                   help='A SQLite file that keeps a local copy of campaign membership between runs')
+  parser.add_argument('--full_rescan', action='store_true',
+                   help='Discard the mirrored campaign and any journaled writes and list it again from CRITs')
+  parser.add_argument('--journal',
+                   help='A SQLite file that stores the pending writes of each update so an interrupted update can be resumed')
+  parser.add_argument('--feed_cache',
+                   help='A directory that caches feed downloads so unchanged feeds are skipped')
+  parser.add_argument('--force_sync', action='store_true',
+                   help='Sync the feed even if it has not changed since the last run')
+  parser.add_argument('--feed_workers', type=int, default=4,
+                   help='The number of lists synced at once when updating several lists')
+  parser.add_argument('--feed_host_limit', type=int, default=1,
+                   help='The number of lists synced at once from the same upstream host')
+  parser.add_argument('--metrics_out', '--metrics-out',
+                   help='Write request counts, latency histograms and bytes per CRITs endpoint to this file at the end of the run')
+  parser.add_argument('--metrics_format', '--metrics-format', choices=['json','prometheus'], default='json',
+                   help='The format of the --metrics_out file')
+  parser.add_argument('--profile', metavar='DIR',
+                   help='Profile each phase of an import or update and write a pstats file per phase and a summary to DIR')
+  parser.add_argument('--record_cassette', '--record-cassette', metavar='FILE',
+                   help='Record every CRITs request and response, without credentials, to FILE for benchmarks/replay_crits.py. Responses are read in full instead of streamed while recording')
+  parser.add_argument('--plan', metavar='FILE',
+                   help='With --update_os_ip_list or --update_os_domain_list, write the adds and removals and an estimate of their API calls to FILE instead of sending them')
+  parser.add_argument('--adaptive', action='store_true',
+                   help='Adjust the requests in flight and the page size to the CRITs server\'s latency and errors')
 
 
   group = parser.add_mutually_exclusive_group()
@@ -560,7 +2161,15 @@ if __name__ == '__main__':
   group.add_argument('--import_ip_list',
                    help='Import a file containing a list of IPs')
   group.add_argument('--update_os_ip_list',
-                   help='Download and update the specified list of open source IPs')
+                   help='Download and update the specified list of open source IPs. '
+                        'Use a comma separated list or "all" to update several lists at once')
+  group.add_argument('--import_domain_list',
+                   help='Import a file containing a list of domains')
+  group.add_argument('--update_os_domain_list',
+                   help='Download and update the specified list of open source domains (lists with _type : domain). '
+                        'Use a comma separated list or "all" to update several lists at once')
+  group.add_argument('--execute_plan', metavar='FILE',
+                   help='Send the adds and removals in a plan written by --plan')
   args = parser.parse_args()
 
 
@@ -585,7 +2194,69 @@ if __name__ == '__main__':
   
   #Get the CRITs connection info and initialize a CRITs object.
   username,api_key,crits_url = get_crits_config(Config,args,debug)
-  CRITs = crits.crits(username,api_key,crits_url,verify,debug)
+  conn_settings = get_connection_config(Config,debug)
+
+  if args.workers != None and args.workers < 1:
+    print "Error: --workers must be at least 1"
+    exit(1)
+
+  if args.plan and not args.update_os_ip_list and not args.update_os_domain_list:
+    print "Error: --plan can only be used with --update_os_ip_list or --update_os_domain_list"
+    exit(1)
+
+  page_fanout = 1
+  if Config.has_option('General','page_fanout'):
+    page_fanout = get_config_setting(Config,'General','page_fanout','int')
+  if args.page_fanout:
+    page_fanout = args.page_fanout
+  if page_fanout == None or page_fanout < 1:
+    page_fanout = 1
+
+  #The controller decides how many requests are in flight, so give it enough workers to reach its maximum.
+  controller = get_adaptive_controller(Config,args,debug)
+  if controller != None:
+    conn_settings['controller'] = controller
+    if args.workers == None:
+      args.workers = controller.max_limit
+    page_fanout = max(page_fanout, controller.max_limit)
+
+  if args.record_cassette:
+    recorder = cassette.CassetteRecorder(args.record_cassette)
+    conn_settings['recorder'] = recorder
+    atexit.register(recorder.close)
+
+  #Keep one pooled connection per worker so connections are not discarded.
+  pool_needed = max(args.workers or 0, page_fanout)
+  if pool_needed > conn_settings.get('pool_maxsize',10):
+    conn_settings['pool_maxsize'] = pool_needed
+
+  mirror_file = ""
+  if Config.has_option('General','mirror_file'):
+    mirror_file = get_config_setting(Config,'General','mirror_file')
+  if args.mirror:
+    mirror_file = args.mirror
+
+  journal_file = ""
+  if Config.has_option('General','journal_file'):
+    journal_file = get_config_setting(Config,'General','journal_file')
+  if args.journal:
+    journal_file = args.journal
+
+  CRITsExecutor = None
+  if args.client == 'executor':
+    CRITsExecutor = crits_executor.CritsExecutor(username,api_key,crits_url,verify,debug,
+                                                 max_in_flight=max(args.workers or 32, page_fanout),
+                                                 **conn_settings)
+    CRITs = CRITsExecutor.client
+  else:
+    CRITs = crits.crits(username,api_key,crits_url,verify,debug,**conn_settings)
+
+  if args.metrics_out:
+    atexit.register(write_metrics,CRITs,args.metrics_out,args.metrics_format,debug)
+
+  if args.profile:
+    PROFILER = profiler.PhaseProfiler(args.profile)
+    atexit.register(write_profile,PROFILER)
 
 
   #Get the default settings for the process
@@ -714,84 +2385,134 @@ if __name__ == '__main__':
       exit(1)
 
     with open(args.import_ip_list,'r') as f:
-      process_file(CRITs,f,campaign,source,indicator,confidence,debug)
+      in_set,existing_index,add_failures = process_file(CRITs,f,campaign,source,indicator,confidence,debug,
+                                                        args.workers,page_fanout,CRITsExecutor)
 
-    exit(0)
+    if debug:
+      print_connection_stats(CRITs)
 
+    #The failures have been summarized by add_entries.
+    if add_failures:
+      exit(1)
+    exit(0)
 
 
-  #Download and process an open source list specified in the os_indicators.config.
-  if args.update_os_ip_list:
-    os_list_name = args.update_os_ip_list
 
-    os_source = get_config_setting(OSConfig,'Open Source Lists',os_list_name + '_source')
-    os_url = get_config_setting(OSConfig,'Open Source Lists',os_list_name + '_URL')
+  #Import a list of domains from a command line provided file
+  if args.import_domain_list:
+    if source == None or source == "":
+      print "Error: Please supply a source using -s"
+      exit(1)
 
-    if os_source == None or os_source == "":
-      print "Error: Could not identify the source attribute in the config file for " + os_list_name
+    if campaign == None or campaign == "":
+      print "Error: Please supply a campaign using -c"
       exit(1)
 
-    if os_url == None or os_url == "":
-      print "Error: Could not identify the url attribute in the config file for " + os_list_name
+    if os.path.isfile(args.import_domain_list) == False:
+      print "Error: The supplied file name does not exist!"
       exit(1)
- 
-    f = download_file(os_url)
 
-    g = f
+    with open(args.import_domain_list,'r') as f:
+      in_set,existing_index,add_failures = process_file(CRITs,f,campaign,source,indicator,confidence,debug,
+                                                        args.workers,page_fanout,CRITsExecutor,
+                                                        kind='domain')
 
-    if os_list_name == "shadowserver":
-      shadow_begin = get_config_setting(OSConfig,'Open Source Lists','shadowserver_begin')
+    if debug:
+      print_connection_stats(CRITs)
 
-      spamhaus_begin = get_config_setting(OSConfig,'Open Source Lists','spamhaus_begin')
-      g = get_section(f,shadow_begin,spamhaus_begin)
+    #The failures have been summarized by add_entries.
+    if add_failures:
+      exit(1)
+    exit(0)
 
-    elif os_list_name == "spamhaus":
-      spamhaus_begin = get_config_setting(OSConfig,'Open Source Lists','spamhaus_begin')
-      dshield_begin = get_config_setting(OSConfig,'Open Source Lists','dshield_begin')
-      g = get_section(f,spamhaus_begin,dshield_begin)
 
-    elif os_list_name == "dshield":
-      dshield_begin = get_config_setting(OSConfig,'Open Source Lists','dshield_begin')
-      g = get_section(f,dshield_begin,"")
-    elif os_list_name == "alienvault":
-      zipdata = StringIO()
-      zipdata.write(f.read())
-      zipdata.seek(0)
-      g = gzip.GzipFile(fileobj=zipdata, mode='rb')
 
-    if g is None: 
-      print "Error: Could not process list" 
-      exit(0) 
+  #Download and process the open source lists specified in the os_indicators.config.
+  if args.update_os_ip_list or args.update_os_domain_list:
+    if args.update_os_ip_list:
+      os_list_names = get_os_list_names(OSConfig,args.update_os_ip_list,'ip')
+    else:
+      os_list_names = get_os_list_names(OSConfig,args.update_os_domain_list,'domain')
 
-    os_campaign_prefix = get_config_setting(OSConfig,'General', 'open_source_campaign_prefix')
-    os_add_campaign = get_config_setting(OSConfig,'General', 'add_campaign_if_missing','boolean')
+    if len(os_list_names) > 1 and args.campaign:
+      print "Error: A campaign can not be supplied when updating more than one list"
+      exit(1)
 
+    feed_cache_dir = args.feed_cache
+    if not feed_cache_dir and OSConfig.has_option('General','feed_cache_dir'):
+      feed_cache_dir = get_config_setting(OSConfig,'General','feed_cache_dir')
+
+    settings = {
+      'campaign' : campaign,
+      'indicator' : indicator,
+      'confidence' : confidence,
+      'page_fanout' : page_fanout,
+      'executor' : CRITsExecutor,
+      'mirror_file' : mirror_file,
+      'journal_file' : journal_file,
+      'feed_cache_dir' : feed_cache_dir,
+      'plan' : None
+    }
+
+    #Planning only reads from CRITs. The feed cache is skipped so that the plan covers every list
+    #and no feed is marked as synced before its writes are sent.
+    if args.plan:
+      settings['plan'] = sync_plan.SyncPlan()
+      settings['feed_cache_dir'] = None
+
+    #Bodies that no list refers to, like the downloads of syncs that failed, are removed before any feed is downloaded.
+    if settings['feed_cache_dir']:
+      pruned = feed_cache.FeedCache(settings['feed_cache_dir'], DOWNLOAD_CHUNK_SIZE).prune()
+      if debug:
+        print "Removed " + str(pruned) + " unused files from the feed cache"
+
+    if len(os_list_names) == 1:
+      groups, missing = group_os_lists_by_url(OSConfig,os_list_names)
+      if missing:
+        exit(1)
+      result = sync_os_url(CRITs,OSConfig,args,groups[0][0],groups[0][1],settings,debug)[0]
+    else:
+      results = sync_os_lists(CRITs,OSConfig,args,os_list_names,settings,debug)
+      print_sync_results(results)
+      incomplete = [r for r in results if r['status'] in INCOMPLETE_STATUSES]
+      result = {'status' : 'failed' if incomplete else 'synced'}
+
+    if args.plan:
+      plan = settings['plan']
+      estimate = sync_plan.estimate_cost(plan.lists,CRITs.metrics.snapshot(),
+                                         plan_workers(CRITs,args.workers))
+      plan.write(args.plan,estimate)
+      print sync_plan.summary(plan.to_dict(estimate)),
 
-    os_campaign = campaign
-    if args.campaign == None or args.campaign == "":
-      os_campaign = os_campaign_prefix + os_source
+    if debug:
+      print_connection_stats(CRITs)
 
+    if result['status'] in INCOMPLETE_STATUSES:
+      exit(1)
+    exit(0)
 
-    campaign_exists = CRITs.find_campaign(os_campaign)
-    if campaign_exists == None and os_add_campaign:
-      print "Warning! Campaign does not exist! Adding new campaign: " + os_campaign
-      CRITs.add_campaign(os_campaign, "Open source IP list from " + os_source)
 
-    elif campaign_exists == None:
-      print "Error: Campaign does not exist! Aborting!"
+  #Send the writes of a plan written by --update_os_ip_list --plan or --update_os_domain_list --plan.
+  if args.execute_plan:
+    try:
+      plan = sync_plan.load(args.execute_plan)
+    except (IOError, ValueError) as e:
+      print "Error: Could not read the plan " + args.execute_plan + ": " + str(e)
       exit(1)
 
-
     if debug:
-      print "Processing file..."
-    in_set,existing_set = process_file(CRITs,g,os_campaign,os_source,indicator,confidence,debug)
+      print "Executing a plan made " + str(int((time.time() - plan['created']) / 60)) + " minutes ago"
+      print sync_plan.summary(plan),
 
-    if debug:
-      print "Removing old entries..."
-    remove_expired_entries(CRITs,os_campaign,os_source,in_set,existing_set,debug)
-    exit(0)
+    results = execute_plan(CRITs,plan,args.workers,mirror_file,debug,CRITsExecutor)
+    print_sync_results(results)
 
+    if debug:
+      print_connection_stats(CRITs)
 
+    if [r for r in results if r['status'] in INCOMPLETE_STATUSES]:
+      exit(1)
+    exit(0)
 
 
   #Delete an entire IP address info or IP attributes from the CRITs server.
@@ -832,11 +2553,10 @@ if __name__ == '__main__':
           exit(1)
 
       if del_campaign != "":
-        campaign_result = CRITs.find_campaign(del_campaign)
-        if campaign_result == None:
+        campaign_id = CRITs.get_campaign_id(del_campaign)
+        if campaign_id == None:
           print "Error: Could not find the campaign: " + del_campaign
           exit(1)
-        campaign_id = campaign_result[0]['_id']
         result = CRITs.delete_campaign_reference(campaign_id,"IP",ip_id)
 
         if not result:
@@ -885,11 +2605,10 @@ if __name__ == '__main__':
           exit(1)
 
       if del_campaign != "":
-        campaign_result = CRITs.find_campaign(del_campaign)
-        if campaign_result == None:
+        campaign_id = CRITs.get_campaign_id(del_campaign)
+        if campaign_id == None:
            print "Error: Could not find the campaign: " + del_campaign
            exit(1)
-        campaign_id = campaign_result[0]['_id']
         result = CRITs.delete_campaign_reference(campaign_id,"Domain",d_id)
 
         if not result:
@@ -902,13 +2621,12 @@ if __name__ == '__main__':
 
   #Delete an entire campaign based on its name
   if args.delete_campaign:
-    campaign_result = CRITs.find_campaign(args.delete_campaign)
+    campaign_id = CRITs.get_campaign_id(args.delete_campaign)
 
-    if campaign_result == None:
-      print "Error: Could not find the campaign: " + del_campaign
+    if campaign_id == None:
+      print "Error: Could not find the campaign: " + args.delete_campaign
       exit(1)
 
-    campaign_id = campaign_result[0]['_id']
     result = CRITs.delete_campaign(campaign_id)
 
     if not result:
@@ -941,5 +2659,4 @@ if __name__ == '__main__':
 
     exit(0)
 
-
-exit(0)
+  exit(0)
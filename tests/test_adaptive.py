@@ -0,0 +1,201 @@
+#!/usr/local/bin/python
+"""
+Tests for the AIMD controller in libs2/adaptive.py.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import adaptive
+from libs2 import crits
+import fake_crits
+
+
+
+def run_window(controller,latency,overloaded=False,request_class=None,page=False,waited=True,count=None):
+  """
+  Sends one window of requests through the controller, one at a time.
+  If waited is set, each request is reported as having waited for a slot.
+  """
+  if count == None:
+    count = controller.window
+  for i in xrange(count):
+    controller.acquire()
+    if waited:
+      controller.waited = True
+    controller.release(latency, overloaded, page, request_class)
+
+
+
+class AdaptiveControllerTest(unittest.TestCase):
+
+  def test_limit_grows_by_one_per_healthy_window(self):
+    controller = adaptive.AdaptiveController(initial_limit=4, max_limit=6, window=10)
+    run_window(controller, 0.01)
+    self.assertEqual(controller.stats()['limit'], 5)
+    run_window(controller, 0.01)
+    run_window(controller, 0.01)
+    self.assertEqual(controller.stats()['limit'], 6)
+    self.assertEqual(controller.stats()['increases'], 2)
+
+
+
+  def test_limit_only_grows_when_requests_waited(self):
+    controller = adaptive.AdaptiveController(initial_limit=4, window=10)
+    run_window(controller, 0.01, waited=False)
+    self.assertEqual(controller.stats()['limit'], 4)
+
+
+
+  def test_errors_cut_the_limit(self):
+    controller = adaptive.AdaptiveController(initial_limit=8, min_limit=3, window=10, error_threshold=0.1)
+    #One error in ten is not above the threshold.
+    run_window(controller, 0.01, count=9)
+    run_window(controller, 0.01, overloaded=True, count=1)
+    self.assertEqual(controller.stats()['limit'], 9)
+
+    run_window(controller, 0.01, overloaded=True)
+    self.assertEqual(controller.stats()['limit'], 4)
+    run_window(controller, 0.01, overloaded=True)
+    self.assertEqual(controller.stats()['limit'], 3)
+    self.assertEqual(controller.stats()['decreases'], 2)
+
+
+
+  def test_latency_above_the_target_cuts_the_limit(self):
+    controller = adaptive.AdaptiveController(initial_limit=8, window=10, latency_target=0.5)
+    run_window(controller, 0.4)
+    self.assertEqual(controller.stats()['limit'], 9)
+    run_window(controller, 0.6)
+    self.assertEqual(controller.stats()['limit'], 4)
+    self.assertEqual(controller.stats()['p90'], 0.6)
+
+
+
+  def test_latency_is_compared_with_the_class_baseline(self):
+    controller = adaptive.AdaptiveController(initial_limit=4, window=10)
+    run_window(controller, 0.01)
+    self.assertEqual(controller.stats()['limit'], 5)
+
+    #Ten times the baseline of the class is congestion.
+    run_window(controller, 0.1)
+    self.assertEqual(controller.stats()['limit'], 2)
+
+
+
+  def test_request_classes_keep_their_own_windows_and_baselines(self):
+    controller = adaptive.AdaptiveController(initial_limit=4, max_limit=32, window=10)
+
+    #Slow POSTs interleaved with fast GETs are not read as congestion of either.
+    for i in xrange(5):
+      run_window(controller, 0.01, request_class='GET ips', count=5)
+      run_window(controller, 0.5, request_class='POST ips', count=5)
+    self.assertEqual(controller.stats()['decreases'], 0)
+    self.assertEqual(sorted(controller.baselines), ['GET ips', 'POST ips'])
+
+    #The same requests in one class are.
+    mixed = adaptive.AdaptiveController(initial_limit=4, max_limit=32, window=10)
+    run_window(mixed, 0.01)
+    for i in xrange(5):
+      run_window(mixed, 0.01, count=5)
+      run_window(mixed, 0.5, count=5)
+    self.assertTrue(mixed.stats()['decreases'] > 0)
+
+
+
+  def test_page_size_follows_page_latency(self):
+    controller = adaptive.AdaptiveController(window=8, min_page_size=100, max_page_size=1000,
+                                             page_step=100, page_latency_target=1.0)
+    self.assertEqual(controller.page_size(), 1000)
+    self.assertEqual(controller.page_size(500), 500)
+
+    run_window(controller, 2.0, page=True, count=2)
+    self.assertEqual(controller.page_size(), 500)
+    run_window(controller, 2.0, page=True, count=2)
+    run_window(controller, 2.0, page=True, count=2)
+    run_window(controller, 2.0, page=True, count=2)
+    self.assertEqual(controller.page_size(), 100)
+
+    run_window(controller, 0.1, page=True, count=2)
+    self.assertEqual(controller.page_size(), 200)
+
+    #Pages are their own request class.
+    self.assertEqual(controller.samples.keys(), ['page'])
+
+
+
+  def test_acquire_waits_at_the_limit(self):
+    controller = adaptive.AdaptiveController(initial_limit=1, max_limit=1)
+    controller.acquire()
+    acquired = threading.Event()
+
+    def second():
+      controller.acquire()
+      acquired.set()
+      controller.release(0.01, False)
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    time.sleep(0.1)
+    self.assertFalse(acquired.is_set())
+    self.assertTrue(controller.waited)
+
+    controller.release(0.01, False)
+    thread.join(5)
+    self.assertTrue(acquired.is_set())
+    self.assertEqual(controller.in_flight, 0)
+
+
+
+class ControlledClientTest(unittest.TestCase):
+  """
+  Sends requests through a crits object with a controller to the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.controller = adaptive.AdaptiveController(window=100)
+    self.client = crits.crits('user', 'key', self.server.url(), controller=self.controller, retries=0)
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def test_requests_are_classed_by_verb_and_endpoint(self):
+    self.server.store.seed('ips', ['10.0.0.1'], 'OS-Test', 'Test', {'type' : 'Address - ipv4-addr'})
+    self.client.find_ip('10.0.0.1', 'OS-Test')
+    self.client.find_ip('', 'OS-Test', limit=10)
+    self.client.add_campaign('OS-New', 'New')
+
+    self.assertEqual(sorted(self.controller.samples), ['GET ips', 'POST campaigns', 'page'])
+    self.assertEqual(self.controller.in_flight, 0)
+
+
+
+  def test_failed_requests_release_their_slot(self):
+    self.server.error_rate = 1.0
+    #find_ip exits when CRITs returns an error, as the command line expects.
+    self.assertRaises(SystemExit, self.client.find_ip, '10.0.0.1', 'OS-Test')
+
+    self.assertEqual(self.controller.in_flight, 0)
+    self.assertEqual(self.controller.samples['GET ips'][0][1], True)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,236 @@
+#!/usr/local/bin/python
+"""
+Tests for the batch methods of libs2/crits.py (_batch, _delete_records, _worker_pool and _RateLimiter)
+against the fake CRITs server.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+SOURCE = 'Test'
+API_KEY = 'f00dfeedcafe'
+IP_FIELDS = {'type' : 'Address - ipv4-addr'}
+RESULT_KEYS = ['item', 'message', 'ok', 'return_code', 'seconds', 'status_code']
+
+
+
+class BatchTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', API_KEY, self.server.url(), retries=0)
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def record(self,ip):
+    store = self.server.store
+    return store.objects['ips'][store.by_value['ips'][ip]]
+
+
+
+  def test_add_results_are_in_order(self):
+    add = self.server.store.add
+
+    def refuse_one(kind,fields):
+      if fields.get('ip') == '10.0.0.3':
+        return {'return_code' : 1, 'message' : 'Refused'}
+      return add(kind,fields)
+    self.server.store.add = refuse_one
+
+    records = ['10.0.0.1', {'ip' : '10.0.0.2', 'campaign' : 'Other'}, '10.0.0.3', '', '10.0.0.4']
+    results = self.client.add_ips(records, workers=4, campaign=CAMPAIGN, source=SOURCE)
+
+    self.assertEqual([r['item'] for r in results], records)
+    self.assertEqual([sorted(r) for r in results], [RESULT_KEYS] * 5)
+    self.assertEqual([r['ok'] for r in results], [True, True, False, False, True])
+    self.assertEqual((results[2]['status_code'], results[2]['return_code'], results[2]['message']), (200, 1, 'Refused'))
+    #The empty record is refused before anything is sent.
+    self.assertEqual(results[3]['status_code'], None)
+    self.assertEqual([c['name'] for c in self.record('10.0.0.2')['campaign']], ['Other'])
+
+
+
+  def test_delete_results(self):
+    store = self.server.store
+    store.seed('ips', ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'], CAMPAIGN, SOURCE, IP_FIELDS)
+    store.seed('ips', ['10.0.0.2', '10.0.0.3'], 'Other', 'Other', IP_FIELDS)
+    ids = dict((ip, store.by_value['ips'][ip]) for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'])
+
+    records = [ids['10.0.0.1'],
+               {'id' : ids['10.0.0.2'], 'source' : SOURCE, 'campaign' : CAMPAIGN},
+               {'id' : ids['10.0.0.3'], 'campaign' : 'OS-Missing'},
+               'ffffffffffffffffffffffff',
+               {'source' : SOURCE}]
+    results = self.client.delete_ips(records, workers=4)
+
+    self.assertEqual([r['item'] for r in results], records)
+    self.assertEqual([r['ok'] for r in results], [True, True, False, False, False])
+    self.assertEqual(results[2]['message'], "Could not find the campaign: OS-Missing")
+    self.assertEqual(results[3]['status_code'], 404)
+    self.assertEqual(results[4]['message'], "An ID must be supplied to delete_ips")
+
+    self.assertFalse(ids['10.0.0.1'] in store.objects['ips'])
+    self.assertEqual([c['name'] for c in self.record('10.0.0.2')['campaign']], ['Other'])
+    self.assertEqual([s['name'] for s in self.record('10.0.0.2')['source']], ['Other'])
+    self.assertTrue(ids['10.0.0.4'] in store.objects['ips'])
+
+
+
+  def test_a_worker_that_exits_fails_its_record(self):
+    store = self.server.store
+    store.seed('ips', ['10.0.0.1', '10.0.0.2'], CAMPAIGN, SOURCE, IP_FIELDS)
+
+    #get_campaign_id exits when it can not reach CRITs.
+    def find_campaign(name,*args,**kwargs):
+      exit(1)
+    self.client.find_campaign = find_campaign
+
+    records = [{'id' : store.by_value['ips']['10.0.0.1'], 'campaign' : CAMPAIGN}, store.by_value['ips']['10.0.0.2']]
+    results = self.client.delete_ips(records, workers=2)
+
+    self.assertEqual([r['ok'] for r in results], [False, True])
+    self.assertEqual(results[0]['message'], "Could not connect to " + self.client.CRITs_URL)
+
+    #The pool still runs the next batch.
+    self.assertEqual([r['ok'] for r in self.client.add_ips(['10.0.0.5', '10.0.0.6'], workers=2, campaign=CAMPAIGN,
+                                                         source=SOURCE)], [True, True])
+
+
+
+  def test_errors_do_not_include_the_api_key(self):
+    def send(record):
+      raise ValueError("Bad response from " + self.client.CRITs_URL + "ips/?api_key=" + API_KEY)
+    results = self.client._batch(['a', 'b'], send, 2, None)
+
+    self.assertEqual([r['ok'] for r in results], [False, False])
+    for r in results:
+      self.assertFalse(API_KEY in r['message'])
+      self.assertTrue("<api_key>" in r['message'])
+
+    #A client that can not connect describes the error by the API URL, without the query string.
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    client = crits.crits('user', API_KEY, 'http://127.0.0.1:' + str(port) + '/api/v1/', retries=0)
+    try:
+      results = client.delete_ips(['a' * 24], workers=2)
+    finally:
+      client.session.close()
+    self.assertEqual(results[0]['ok'], False)
+    self.assertFalse(API_KEY in results[0]['message'])
+
+
+
+  def test_records_in_flight_are_limited_to_workers(self):
+    lock = threading.Lock()
+    counts = {'in_flight' : 0, 'most' : 0}
+
+    def send(record):
+      with lock:
+        counts['in_flight'] += 1
+        counts['most'] = max(counts['most'], counts['in_flight'])
+      time.sleep(0.02)
+      with lock:
+        counts['in_flight'] -= 1
+      return {'item' : record, 'ok' : True}
+
+    #The pool is larger than the batch's share of it.
+    self.client._worker_pool(8)
+    results = self.client._batch(range(20), send, 3, None)
+
+    self.assertEqual([r['item'] for r in results], range(20))
+    self.assertEqual(counts['most'], 3)
+
+
+
+  def test_worker_pool_is_shared_and_only_grows(self):
+    pool = self.client._worker_pool(2)
+    self.assertTrue(self.client._worker_pool(2) is pool)
+
+    larger = self.client._worker_pool(4)
+    self.assertFalse(larger is pool)
+    self.assertEqual(self.client.batch_pool_size, 4)
+    self.assertTrue(self.client._worker_pool(3) is larger)
+
+
+
+  def test_rate_limits_the_starts(self):
+    starts = []
+
+    def send(record):
+      starts.append(time.time())
+      return {'item' : record, 'ok' : True}
+
+    self.client._batch(range(6), send, 3, 20)
+    starts.sort()
+
+    #The first record starts at once and the rest are 1/20 seconds apart.
+    self.assertTrue(starts[-1] - starts[0] >= 5 * 0.05 - 0.01)
+    for a, b in zip(starts, starts[1:]):
+      self.assertTrue(b - a >= 0.03, b - a)
+
+
+
+class RateLimiterTest(unittest.TestCase):
+
+  def test_spacing(self):
+    limiter = crits._RateLimiter(50)
+    start = time.time()
+    limiter.wait()
+    self.assertTrue(time.time() - start < 0.01)
+
+    for i in xrange(10):
+      limiter.wait()
+    self.assertTrue(time.time() - start >= 10 * 0.02 - 0.005)
+
+
+
+  def test_threads_share_the_rate(self):
+    limiter = crits._RateLimiter(50)
+    starts = []
+    lock = threading.Lock()
+
+    def run():
+      for i in xrange(5):
+        limiter.wait()
+        with lock:
+          starts.append(time.time())
+
+    threads = [threading.Thread(target=run) for i in xrange(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(5)
+
+    starts.sort()
+    self.assertEqual(len(starts), 20)
+    self.assertTrue(starts[-1] - starts[0] >= 19 * 0.02 - 0.005)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
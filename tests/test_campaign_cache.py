@@ -0,0 +1,167 @@
+#!/usr/local/bin/python
+"""
+Tests for the campaign name to ID cache of libs2/crits.py (get_campaign_id and invalidate_campaign)
+against the fake CRITs server.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+
+
+
+def run_threads(count,target):
+  """
+  Starts count threads that call target at the same time and returns their results.
+  """
+  go = threading.Event()
+  results = [None] * count
+
+  def run(i):
+    go.wait(5)
+    results[i] = target()
+
+  threads = [threading.Thread(target=run, args=(i,)) for i in xrange(count)]
+  for thread in threads:
+    thread.start()
+  go.set()
+  for thread in threads:
+    thread.join(10)
+  return results
+
+
+
+class CampaignCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.server.store.seed('ips', [], CAMPAIGN, 'Test')
+    self.c_id = self.server.store.by_value['campaigns'][CAMPAIGN]
+    self.client = crits.crits('user', 'key', self.server.url())
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def gets(self):
+    return self.server.requests.get('GET campaigns', 0)
+
+
+
+  def test_lookups_are_cached(self):
+    self.assertEqual(self.client.get_campaign_id(CAMPAIGN), self.c_id)
+    self.assertEqual(self.client.get_campaign_id(CAMPAIGN), self.c_id)
+    self.assertEqual(self.client.get_campaign_id('OS-Missing'), None)
+    self.assertEqual(self.client.get_campaign_id('OS-Missing'), None)
+    self.assertEqual(self.gets(), 2)
+
+
+
+  def test_concurrent_lookups_send_one_request(self):
+    self.server.latency = 0.2
+    results = run_threads(16, lambda: self.client.get_campaign_id(CAMPAIGN))
+
+    self.assertEqual(results, [self.c_id] * 16)
+    self.assertEqual(self.gets(), 1)
+    self.assertEqual(self.client.campaign_lookups, {})
+
+
+
+  def test_a_waiter_takes_over_when_the_lookup_fails(self):
+    find_campaign = self.client.find_campaign
+    leader_started = threading.Event()
+    calls = []
+
+    #find_campaign exits when CRITs returns an error. The first lookup fails that way.
+    def failing_find_campaign(name,*args,**kwargs):
+      calls.append(name)
+      if len(calls) == 1:
+        leader_started.set()
+        time.sleep(0.2)
+        exit(1)
+      return find_campaign(name,*args,**kwargs)
+    self.client.find_campaign = failing_find_campaign
+
+    leader_exited = []
+
+    def leader():
+      try:
+        self.client.get_campaign_id(CAMPAIGN)
+      except SystemExit:
+        leader_exited.append(True)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    leader_started.wait(5)
+    results = run_threads(8, lambda: self.client.get_campaign_id(CAMPAIGN))
+    thread.join(5)
+
+    #The waiters do not read the failure as a missing campaign. One of them looks the name up again.
+    self.assertEqual(leader_exited, [True])
+    self.assertEqual(results, [self.c_id] * 8)
+    self.assertEqual(len(calls), 2)
+    self.assertEqual(self.gets(), 1)
+    self.assertEqual(self.client.campaign_lookups, {})
+
+
+
+  def test_a_lookup_made_stale_in_flight_is_not_cached(self):
+    find_campaign = self.client.find_campaign
+    in_flight = threading.Event()
+    invalidated = threading.Event()
+
+    def slow_find_campaign(name,*args,**kwargs):
+      result = find_campaign(name,*args,**kwargs)
+      in_flight.set()
+      invalidated.wait(5)
+      return result
+    self.client.find_campaign = slow_find_campaign
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(self.client.get_campaign_id(CAMPAIGN)))
+    thread.start()
+    in_flight.wait(5)
+    generation = self.client.cache_generation
+    self.client.invalidate_campaign(CAMPAIGN)
+    self.assertEqual(self.client.cache_generation, generation + 1)
+    invalidated.set()
+    thread.join(5)
+
+    #The caller gets the result, but the next lookup asks CRITs again.
+    self.assertEqual(results, [self.c_id])
+    self.assertFalse(CAMPAIGN in self.client.campaign_ids)
+    self.client.find_campaign = find_campaign
+    self.assertEqual(self.client.get_campaign_id(CAMPAIGN), self.c_id)
+    self.assertEqual(self.gets(), 2)
+
+
+
+  def test_invalidate_by_id(self):
+    self.client.get_campaign_id(CAMPAIGN)
+    self.client.invalidate_campaign(c_id=self.c_id)
+    self.assertFalse(CAMPAIGN in self.client.campaign_ids)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/cassette.py, including a recording of a crits object's requests to the fake CRITs server.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import cassette
+from libs2 import crits
+import fake_crits
+
+
+#A short username that also appears in indicator values, campaign names and JSON keys
+USERNAME = 'os'
+API_KEY = 'f00dfeedcafe'
+
+
+
+class CassetteTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'test.cassette')
+    self.recorder = cassette.CassetteRecorder(self.path)
+
+
+
+  def tearDown(self):
+    self.recorder.close()
+    shutil.rmtree(self.directory)
+
+
+
+  def entries(self):
+    self.recorder.close()
+    header, entries = cassette.load(self.path)
+    self.assertEqual(header['version'], cassette.CASSETTE_VERSION)
+    return entries
+
+
+
+  def test_credentials_are_removed_from_paths_and_forms(self):
+    self.recorder.record('get', 'ips/?username=os&c-campaign.name=OS-hosts&api_key=' + API_KEY, None,
+                         200, 'application/json', '{}', self.recorder.start, 0.1)
+    self.recorder.record('post', 'campaigns/', 'username=os&api_key=' + API_KEY + '&name=OS-hosts&description=os',
+                         200, 'application/json', '{}', self.recorder.start, 0.1)
+    entries = self.entries()
+
+    self.assertEqual(entries[0]['path'], 'ips/?c-campaign.name=OS-hosts')
+    self.assertEqual(entries[1]['body'], 'description=os&name=OS-hosts')
+
+
+
+  def test_a_username_in_a_response_is_kept(self):
+    response = json.dumps({'meta' : {'next' : '/api/v1/ips/?username=os&api_key=' + API_KEY + '&offset=20'},
+                           'objects' : [{'ip' : '10.0.0.1', 'campaign' : [{'name' : 'OS-os'}],
+                                         'source' : [{'name' : 'os'}], 'os' : 'hosts.os.example'}]})
+    self.recorder.record('get', 'ips/', None, 200, 'application/json', response, self.recorder.start, 0.1)
+    self.recorder.record('patch', 'ips/a/?api_key=' + API_KEY, json.dumps({'source' : 'os', 'api_key' : API_KEY}),
+                         200, 'application/json', json.dumps({'username' : 'os', 'message' : 'os removed'}),
+                         self.recorder.start, 0.1)
+    entries = self.entries()
+
+    recorded = json.loads(entries[0]['response'])
+    self.assertEqual(recorded['objects'], json.loads(response)['objects'])
+    self.assertEqual(recorded['meta']['next'], '/api/v1/ips/?username=SCRUBBED&api_key=SCRUBBED&offset=20')
+
+    self.assertEqual(json.loads(entries[1]['body']), {'source' : 'os', 'api_key' : 'SCRUBBED'})
+    self.assertEqual(json.loads(entries[1]['response']), {'username' : 'SCRUBBED', 'message' : 'os removed'})
+
+
+
+  def test_request_key_ignores_credentials(self):
+    recorded = cassette.request_key('get', 'ips/?c-ip=10.0.0.1', None)
+    self.assertEqual(cassette.request_key('GET', 'ips/?api_key=' + API_KEY + '&username=os&c-ip=10.0.0.1', None),
+                     recorded)
+    self.assertEqual(cassette.request_key('patch', 'ips/a/', '{"b": 1, "a": 2}'),
+                     cassette.request_key('PATCH', 'ips/a/', '{"a": 2, "b": 1}'))
+
+
+
+  def test_recording_a_client(self):
+    server = fake_crits.FakeCrits().start()
+    client = crits.crits(USERNAME, API_KEY, server.url(), recorder=self.recorder)
+    try:
+      server.store.seed('domains', ['os.example.com', 'hosts.example'], 'OS-os', 'os')
+      client.find_domain('', 'OS-os', limit=10)
+      client.add_campaign('OS-hosts', 'os lists')
+    finally:
+      client.session.close()
+      server.stop()
+
+    entries = self.entries()
+    with open(self.path) as f:
+      self.assertFalse(API_KEY in f.read())
+
+    self.assertEqual([(e['method'], e['status']) for e in entries], [('GET', 200), ('POST', 200)])
+    self.assertFalse('username' in entries[0]['path'])
+    self.assertEqual(sorted(obj['domain'] for obj in json.loads(entries[0]['response'])['objects']),
+                     ['hosts.example', 'os.example.com'])
+    self.assertEqual(entries[1]['body'], 'description=os+lists&name=OS-hosts')
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/crits_executor.py against the fake CRITs server.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+from libs2 import crits_executor
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+SOURCE = 'Test'
+
+
+
+class CritsExecutorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.server.store.seed('ips', ['10.0.0.1'], CAMPAIGN, SOURCE, {'type' : 'Address - ipv4-addr'})
+    self.executor = crits_executor.CritsExecutor('user', 'key', self.server.url(), max_in_flight=2, retries=0)
+
+
+
+  def tearDown(self):
+    self.executor.close()
+    self.executor.client.session.close()
+    self.server.stop()
+
+
+
+  def test_submitted_methods_are_crits_methods(self):
+    for name in crits_executor.SUBMITTED_METHODS:
+      self.assertTrue(callable(getattr(crits.crits, name, None)), name)
+      self.assertEqual(getattr(self.executor, name).__name__, name)
+
+
+
+  def test_other_names_can_not_be_scheduled(self):
+    for name in ['_request', 'session', 'find_sample', '__len__']:
+      self.assertRaises(AttributeError, getattr, self.executor, name)
+    self.assertFalse(hasattr(self.executor, 'invalidate_campaign'))
+
+
+
+  def test_calls_return_results(self):
+    found = self.executor.find_ip('10.0.0.1', CAMPAIGN)
+    c_id = self.executor.get_campaign_id(CAMPAIGN)
+    added = self.executor.add_ips(['10.0.0.2', '10.0.0.3'], workers=2, campaign=CAMPAIGN, source=SOURCE)
+
+    self.assertEqual(found.get(5)[0]['ip'], '10.0.0.1')
+    self.assertEqual(c_id.get(5), self.server.store.by_value['campaigns'][CAMPAIGN])
+    self.assertEqual([r['ok'] for r in added.get(5)], [True, True])
+
+
+
+  def test_callback(self):
+    done = threading.Event()
+    values = []
+
+    def callback(value):
+      values.append(value)
+      done.set()
+
+    self.executor.get_campaign_id(CAMPAIGN, callback=callback)
+    done.wait(5)
+    self.assertEqual(values, [self.server.store.by_value['campaigns'][CAMPAIGN]])
+
+
+
+  def test_a_call_that_exits_raises_from_get(self):
+    #find_ip exits when CRITs returns an error.
+    self.server.error_rate = 1.0
+    results = [self.executor.find_ip('10.0.0.1', CAMPAIGN) for i in xrange(3)]
+    for result in results:
+      self.assertRaises(crits_executor.CritsExecutorError, result.get, 5)
+
+    #The failed calls gave back their slots.
+    self.server.error_rate = 0.0
+    results = [self.executor.find_ip('10.0.0.1', CAMPAIGN) for i in xrange(3)]
+    self.assertEqual([result.get(5)[0]['ip'] for result in results], ['10.0.0.1'] * 3)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
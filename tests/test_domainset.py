@@ -0,0 +1,169 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/domainset.py and the domain diff in os_list_update.diff_file.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+from libs2 import domainset
+import os_list_update
+import fake_crits
+
+
+
+def random_domains(rng,count):
+  """
+  Returns domains from a small name space in mixed forms, with some values that are not domains.
+  """
+  values = []
+  for i in xrange(count):
+    name = "host%d.example%d.com" % (rng.randint(0, 50), rng.randint(0, 3))
+    roll = rng.random()
+    if roll < 0.2:
+      name = name.upper()
+    elif roll < 0.3:
+      name = name + "."
+    elif roll < 0.35:
+      name = "*." + name
+    elif roll < 0.4:
+      name = rng.choice(["10.0.0.1", "", "bad..name", "-bad.com"])
+    values.append(name)
+  return values
+
+
+
+def normalized(values):
+  return set(name for name in (domainset.normalize_domain(value) for value in values) if name != None)
+
+
+
+class NormalizeDomainTest(unittest.TestCase):
+
+  def test_canonical_form(self):
+    self.assertEqual(domainset.normalize_domain(' WWW.Example.COM. '), 'www.example.com')
+    self.assertEqual(domainset.normalize_domain('*.example.com'), 'example.com')
+    self.assertEqual(domainset.normalize_domain(u'b\xfccher.example'), 'xn--bcher-kva.example')
+    self.assertEqual(domainset.normalize_domain('b\xc3\xbccher.example'), 'xn--bcher-kva.example')
+    self.assertEqual(domainset.normalize_domain('_dmarc.example.com'), '_dmarc.example.com')
+
+
+
+  def test_invalid_values(self):
+    for value in [None, '', 'localhost', '10.0.0.1', 'bad..example.com', '-bad.example.com',
+                  'a' * 64 + '.com', 'example.123', 'exa mple.com', 'b\xff.example']:
+      self.assertEqual(domainset.normalize_domain(value), None, repr(value))
+
+
+
+class DomainSetTest(unittest.TestCase):
+
+  def test_names_are_normalized_sorted_and_unique(self):
+    s = domainset.DomainSet(['b.example.com', 'A.example.com', 'a.example.com.', 'bogus', '*.c.example.com'])
+
+    self.assertEqual(len(s), 3)
+    self.assertEqual([name for name in s], ['a.example.com', 'b.example.com', 'c.example.com'])
+    self.assertEqual(s[0], 'a.example.com')
+    self.assertEqual(s[-1], 'c.example.com')
+    self.assertRaises(IndexError, s.__getitem__, 3)
+
+
+
+  def test_contains(self):
+    s = domainset.DomainSet(['a.example.com', 'b.example.com'])
+    self.assertTrue('A.Example.com.' in s)
+    self.assertFalse('c.example.com' in s)
+    self.assertFalse('bogus' in s)
+    self.assertFalse('a.example.com' in domainset.DomainSet())
+
+
+
+  def test_covers_by_lookup_and_by_merge(self):
+    rng = random.Random(5)
+    values = random_domains(rng, 400)
+    s = domainset.DomainSet(values)
+    expected = normalized(values)
+
+    #A few names are looked up one at a time, many are merged with the set.
+    for count in [3, 300]:
+      queries = random_domains(rng, count)
+      self.assertEqual(s.covers(queries), [domainset.normalize_domain(q) in expected for q in queries])
+
+
+
+  def test_difference(self):
+    s = domainset.DomainSet(['a.example.com', 'b.example.com', 'c.example.com'])
+    self.assertEqual([name for name in s.difference(['B.example.com', 'd.example.com'])],
+                     ['a.example.com', 'c.example.com'])
+    self.assertEqual([name for name in s.difference(domainset.DomainSet(s))], [])
+    self.assertEqual(len(domainset.DomainSet().difference(s)), 0)
+
+
+
+  def test_difference_matches_python_sets(self):
+    rng = random.Random(8)
+    for i in xrange(20):
+      a = random_domains(rng, rng.randint(0, 300))
+      b = random_domains(rng, rng.randint(0, 300))
+      self.assertEqual([name for name in domainset.DomainSet(a).difference(b)], sorted(normalized(a) - normalized(b)))
+
+
+
+  def test_build_in_chunks(self):
+    rng = random.Random(9)
+    values = random_domains(rng, 1000)
+    saved = domainset.SORT_CHUNK_SIZE
+    domainset.SORT_CHUNK_SIZE = 16
+    try:
+      s = domainset.DomainSet(iter(values))
+    finally:
+      domainset.SORT_CHUNK_SIZE = saved
+
+    #Duplicates in different chunks are merged.
+    self.assertEqual([name for name in s], sorted(normalized(values)))
+    self.assertEqual(len(s), len(normalized(values)))
+
+
+
+class DomainDiffTest(unittest.TestCase):
+  """
+  Runs diff_file for a domain list against the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', 'key', self.server.url())
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def test_existing_names_are_not_added_again(self):
+    self.server.store.seed('domains', ['a.example.com', 'old.example.com'], 'OS-Test', 'Test')
+    feed = ['A.Example.com.', 'b.example.com', 'b.example.com', '*.c.example.com', 'not a domain']
+    in_set, existing_index, new_adds = os_list_update.diff_file(self.client, [line + "\n" for line in feed],
+                                                                'OS-Test', 'Test', False, kind='domain')
+
+    self.assertEqual(sorted(new_adds), ['b.example.com', 'c.example.com'])
+    self.assertEqual(sorted(existing_index), ['a.example.com', 'old.example.com'])
+    self.assertEqual(in_set.covers(['old.example.com']), [False])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/feed_cache.py and the conditional feed download in os_list_update.download_feed.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import BaseHTTPServer
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import feed_cache
+import os_list_update
+
+
+URL = 'http://feeds.example.com/block.txt'
+
+
+
+def feed_files(cache,suffix):
+  return sorted(entry for entry in os.listdir(cache.directory) if entry.endswith(suffix))
+
+
+
+class FeedCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = feed_cache.FeedCache(os.path.join(self.directory, 'cache'), chunk_size=4)
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+
+
+  def test_store_is_content_addressed(self):
+    first = self.cache.store(URL, ["10.0.0.1\n", "10.0.0.2\n"], etag='"a"')
+    second = self.cache.store(URL, ["10.0.0.1\n10.0.0.2\n"], etag='"b"')
+
+    self.assertEqual(first['sha256'], second['sha256'])
+    self.assertEqual(len(feed_files(self.cache, '.feed')), 1)
+    self.assertEqual("".join(self.cache.read(first)), "10.0.0.1\n10.0.0.2\n")
+
+
+
+  def test_conditional_headers(self):
+    self.assertEqual(self.cache.conditional_headers('block', URL), {})
+
+    version = self.cache.store(URL, ["10.0.0.1\n"], etag='"a"', last_modified='Mon, 05 Jan 2015 00:00:00 GMT')
+    self.cache.mark_synced('block', version)
+    self.assertEqual(self.cache.conditional_headers('block', URL),
+                     {'If-None-Match' : '"a"', 'If-Modified-Since' : 'Mon, 05 Jan 2015 00:00:00 GMT'})
+
+    #A different URL or a missing body means the feed must be downloaded in full.
+    self.assertEqual(self.cache.conditional_headers('block', URL + '?v=2'), {})
+    os.remove(os.path.join(self.cache.directory, version['sha256'] + '.feed'))
+    self.assertEqual(self.cache.conditional_headers('block', URL), {})
+
+
+
+  def test_is_synced_is_per_list(self):
+    version = self.cache.store(URL, ["10.0.0.1\n"])
+    self.assertFalse(self.cache.is_synced('block', version))
+
+    self.cache.mark_synced('block', version)
+    self.assertTrue(self.cache.is_synced('block', version))
+    self.assertFalse(self.cache.is_synced('other', version))
+
+
+
+  def test_mark_synced_removes_the_replaced_body(self):
+    old = self.cache.store(URL, ["10.0.0.1\n"])
+    self.cache.mark_synced('block', old)
+    new = self.cache.store(URL, ["10.0.0.2\n"])
+    self.cache.mark_synced('block', new)
+
+    self.assertEqual(feed_files(self.cache, '.feed'), [new['sha256'] + '.feed'])
+    self.assertEqual(self.cache.synced('block')['sha256'], new['sha256'])
+
+
+
+  def test_mark_synced_keeps_a_body_another_list_uses(self):
+    old = self.cache.store(URL, ["10.0.0.1\n"])
+    self.cache.mark_synced('block', old)
+    self.cache.mark_synced('other', old)
+    new = self.cache.store(URL, ["10.0.0.2\n"])
+    self.cache.mark_synced('block', new)
+
+    self.assertEqual(feed_files(self.cache, '.feed'), sorted([old['sha256'] + '.feed', new['sha256'] + '.feed']))
+
+
+
+  def test_prune_removes_unreferenced_bodies_and_temporary_files(self):
+    synced = self.cache.store(URL, ["10.0.0.1\n"])
+    self.cache.mark_synced('block', synced)
+    self.cache.store(URL, ["10.0.0.2\n"])
+    open(os.path.join(self.cache.directory, 'left.tmp'), 'w').close()
+
+    self.assertEqual(self.cache.prune(), 2)
+    self.assertEqual(feed_files(self.cache, '.feed'), [synced['sha256'] + '.feed'])
+    self.assertEqual(feed_files(self.cache, '.tmp'), [])
+    self.assertEqual(self.cache.prune(), 0)
+
+
+
+class _FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves the server's body with its ETag and answers a matching If-None-Match with 304.
+  """
+
+  def log_message(self, *args):
+    pass
+
+
+
+  def do_GET(self):
+    self.server.requests.append(self.headers.get('If-None-Match'))
+    if self.headers.get('If-None-Match') == self.server.etag:
+      self.send_response(304)
+      self.end_headers()
+      return
+
+    self.send_response(200)
+    self.send_header('ETag', self.server.etag)
+    self.send_header('Content-Length', str(len(self.server.body)))
+    self.end_headers()
+    self.wfile.write(self.server.body)
+
+
+
+class DownloadFeedTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = feed_cache.FeedCache(self.directory)
+    self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _FeedHandler)
+    self.server.body = "10.0.0.1\n10.0.0.2\n"
+    self.server.etag = '"v1"'
+    self.server.requests = []
+    self.url = 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/block.txt'
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.directory)
+
+
+
+  def download(self,names=('block',),force=False):
+    lines, version = os_list_update.download_feed(self.url, self.cache, list(names), force, False)
+    if lines != None:
+      lines = [line for line in lines]
+    return lines, version
+
+
+
+  def test_unchanged_feed_is_not_synced_again(self):
+    lines, version = self.download()
+    self.assertEqual(lines, ["10.0.0.1\n", "10.0.0.2\n"])
+    self.cache.mark_synced('block', version)
+
+    #The server answers 304 to the ETag of the synced version.
+    self.assertEqual(self.download(), (None, None))
+    self.assertEqual(self.server.requests, [None, '"v1"'])
+
+
+
+  def test_new_etag_with_the_same_body_is_not_synced_again(self):
+    lines, version = self.download()
+    self.cache.mark_synced('block', version)
+
+    self.server.etag = '"v2"'
+    lines, new_version = self.download()
+    self.assertEqual(lines, None)
+    self.assertEqual(new_version['sha256'], version['sha256'])
+
+
+
+  def test_changed_feed_is_read_from_the_cache(self):
+    lines, version = self.download()
+    self.cache.mark_synced('block', version)
+
+    self.server.etag = '"v2"'
+    self.server.body = "10.0.0.3\n"
+    lines, new_version = self.download()
+    self.assertEqual(lines, ["10.0.0.3\n"])
+    self.assertNotEqual(new_version['sha256'], version['sha256'])
+
+
+
+  def test_lists_on_different_versions_download_in_full(self):
+    lines, version = self.download(('block', 'other'))
+    self.cache.mark_synced('block', version)
+
+    #other has not synced this version, so the request is not conditional and other gets the lines.
+    lines, version = self.download(('block', 'other'))
+    self.assertEqual(lines, ["10.0.0.1\n", "10.0.0.2\n"])
+    self.assertEqual(self.server.requests, [None, None])
+
+
+
+  def test_force_downloads_and_syncs(self):
+    lines, version = self.download()
+    self.cache.mark_synced('block', version)
+
+    lines, version = self.download(force=True)
+    self.assertEqual(lines, ["10.0.0.1\n", "10.0.0.2\n"])
+    self.assertEqual(self.server.requests, [None, None])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
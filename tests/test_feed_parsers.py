@@ -0,0 +1,178 @@
+#!/usr/local/bin/python
+"""
+Table driven tests for every format registered in libs2/feed_parsers.py,
+and for the format settings read by os_list_update.get_feed_parser.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import ConfigParser
+import os
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import feed_parsers
+import os_list_update
+
+
+IP = feed_parsers.IP_TYPE
+CIDR = feed_parsers.CIDR_TYPE
+DOMAIN = feed_parsers.DOMAIN_TYPE
+
+
+#(format, options, feed lines, expected values) for the IP parsers
+IP_CASES = [
+  ('plain', {},
+   ["# Comment 10.9.9.9\n", "10.0.0.1\n", "10.0.0.2:8080 # port\n", "  10.0.1.0/24\tnetwork\n",
+    "host 10.0.0.5\n", "999.0.0.1.5\n", "\n"],
+   [('10.0.0.1', IP), ('10.0.0.2', IP), ('10.0.1.0/24', CIDR)]),
+
+  ('netset', {},
+   ["#\n# FireHOL netset\n#\n", "10.0.0.1\n", "10.0.1.0/24\n", "10.0.0.2 trailing text\n", " 10.0.0.3 \n"],
+   [('10.0.0.1', IP), ('10.0.1.0/24', CIDR), ('10.0.0.3', IP)]),
+
+  #The SSLBL blacklist starts each row with the date the address was listed.
+  ('csv', {'column' : '1'},
+   ["################################################################\n",
+    "# abuse.ch SSLBL Botnet C2 IP Blacklist (CSV)                  #\n",
+    "# Firstseen,DstIP,DstPort\n",
+    "2015-06-01 12:03:10,10.0.0.1,443\n",
+    "2015-06-01 13:00:00,10.0.0.2,8443\n",
+    "2015-06-02 00:00:00,not an address,443\n",
+    "2015-06-02 00:00:00\n"],
+   [('10.0.0.1', IP), ('10.0.0.2', IP)]),
+
+  ('csv', {'column' : '0', 'delimiter' : ';'},
+   ["10.0.0.1;botnet\n", "\"10.0.1.0/24\";spam\n", "#10.9.9.9;comment\n"],
+   [('10.0.0.1', IP), ('10.0.1.0/24', CIDR)]),
+
+  ('snort', {},
+   ["# Snort rules\n",
+    "alert ip [10.0.0.1,10.0.0.2,!10.0.0.9] any -> $HOME_NET any (msg:\"10.7.7.7 in the options\"; sid:1;)\n",
+    "drop tcp 10.0.1.0/24 any -> any any (sid:2;)\n",
+    "10.0.0.3 # reputation list\n"],
+   [('10.0.0.1', IP), ('10.0.0.2', IP), ('10.0.1.0/24', CIDR), ('10.0.0.3', IP)]),
+
+  ('regex', {'pattern' : r'ip="([^"]*)"'},
+   ['<entry ip="10.0.0.1"/>\n', '<entry ip="10.0.1.0/24"/>\n', '<entry ip="bogus"/>\n', '<entry/>\n'],
+   [('10.0.0.1', IP), ('10.0.1.0/24', CIDR)]),
+
+  ('regex', {'pattern' : r'[0-9.]+/32'},
+   ['blocked 10.0.0.1/32 today\n', 'blocked 10.0.0.2\n'],
+   [('10.0.0.1/32', CIDR)]),
+]
+
+
+#(format, options, feed lines, expected values) for the domain parsers
+DOMAIN_CASES = [
+  ('plain', {},
+   ["# Comment\n", "; Comment\n", "Example.COM.\n", "bad..example.com\n", "b.example.com extra words\n", "\n"],
+   ['example.com', 'b.example.com']),
+
+  ('hosts', {},
+   ["127.0.0.1 localhost\n", "0.0.0.0 a.example.com b.example.com # two names\n", "# 0.0.0.0 c.example.com\n",
+    "0.0.0.0\n"],
+   ['a.example.com', 'b.example.com']),
+
+  ('adblock', {},
+   ["! Title: list\n", "||a.example.com^\n", "||b.example.com^$third-party\n", "||c.example.com/path^\n",
+    "||*.d.example.com^\n", "@@||e.example.com^\n", "f.example.com\n"],
+   ['a.example.com', 'b.example.com']),
+
+  ('csv', {'column' : '2'},
+   ["# id,date,domain\n", "1,2015-06-01,A.example.com\n", "2,2015-06-01,not a domain\n", "3,2015-06-01\n"],
+   ['a.example.com']),
+
+  ('regex', {'pattern' : r'host=(\S+)'},
+   ["GET host=a.example.com path=/\n", "GET host=10.0.0.1\n", "GET path=/\n"],
+   ['a.example.com']),
+]
+
+
+
+class FeedParsersTest(unittest.TestCase):
+
+  def test_every_format_has_a_case(self):
+    self.assertEqual(sorted(set(case[0] for case in IP_CASES)), sorted(feed_parsers.PARSERS))
+    self.assertEqual(sorted(set(case[0] for case in DOMAIN_CASES)), sorted(feed_parsers.DOMAIN_PARSERS))
+
+
+
+  def test_ip_formats(self):
+    for name, options, lines, expected in IP_CASES:
+      parse = feed_parsers.get_parser(name, **options)
+      self.assertEqual([value for value in parse(lines)], expected, name + " " + repr(options))
+
+
+
+  def test_domain_formats(self):
+    for name, options, lines, expected in DOMAIN_CASES:
+      parse = feed_parsers.get_domain_parser(name, **options)
+      self.assertEqual([value for value in parse(lines)], [(domain, DOMAIN) for domain in expected],
+                       name + " " + repr(options))
+
+
+
+  def test_default_format_is_plain(self):
+    self.assertEqual([value for value in feed_parsers.get_parser(None)(["10.0.0.1 x\n"])], [('10.0.0.1', IP)])
+    self.assertEqual([value for value in feed_parsers.get_domain_parser("")(["example.com x\n"])],
+                     [('example.com', DOMAIN)])
+
+
+
+  def test_invalid_formats_and_options(self):
+    for get in [feed_parsers.get_parser, feed_parsers.get_domain_parser]:
+      self.assertRaises(ValueError, get, 'bogus')
+      self.assertRaises(ValueError, get, 'plain', column='1')
+      self.assertRaises(ValueError, get, 'csv', column='one')
+      self.assertRaises(ValueError, get, 'csv', delimiter='::')
+      self.assertRaises(ValueError, get, 'regex')
+
+    try:
+      feed_parsers.get_parser('bogus')
+    except ValueError as e:
+      self.assertEqual(str(e), "Unknown feed format 'bogus'. Supported formats: csv, netset, plain, regex, snort")
+
+
+
+class GetFeedParserTest(unittest.TestCase):
+
+  def setUp(self):
+    self.config = ConfigParser.ConfigParser()
+    self.config.add_section('Open Source Lists')
+
+
+
+  def set(self,name,**settings):
+    for key, value in settings.items():
+      self.config.set('Open Source Lists', name + '_' + key, value)
+
+
+
+  def test_options_are_read_from_the_list_settings(self):
+    self.set('ssl_blacklist', format='csv', column='1')
+    self.set('blocked_hosts', type='domain', format='hosts')
+
+    parse = os_list_update.get_feed_parser(self.config, 'ssl_blacklist')
+    self.assertEqual([value for value in parse(["2015-06-01 12:03:10,10.0.0.1,443\n"])], [('10.0.0.1', IP)])
+    parse = os_list_update.get_feed_parser(self.config, 'blocked_hosts')
+    self.assertEqual([value for value in parse(["0.0.0.0 a.example.com\n"])], [('a.example.com', DOMAIN)])
+
+
+
+  def test_an_unknown_format_exits(self):
+    self.set('broken', format='bogus')
+    self.assertRaises(SystemExit, os_list_update.get_feed_parser, self.config, 'broken')
+
+    self.set('bad_pattern', format='regex', pattern='(')
+    self.assertRaises(SystemExit, os_list_update.get_feed_parser, self.config, 'bad_pattern')
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,273 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/ipset.py and the IP diff in os_list_update.diff_file. The set tests run
+with NumPy (when it is installed) and with the pure Python fallback.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+from libs2 import ipset
+import os_list_update
+import fake_crits
+
+
+
+def random_values(rng,count):
+  """
+  Returns IPs from a small address space, with some CIDRs and strings that are not plain addresses.
+  """
+  values = []
+  for i in xrange(count):
+    roll = rng.random()
+    if roll < 0.8:
+      values.append("10.0.%d.%d" % (rng.randint(0, 3), rng.randint(0, 255)))
+    elif roll < 0.95:
+      values.append("10.0.%d.0/%d" % (rng.randint(0, 3), rng.choice([24, 25, 30, 32])))
+    else:
+      values.append(rng.choice(["010.0.0.1", "10.1", "bogus", "10.0.0.1 "]))
+  return values
+
+
+
+class _WithoutNumpy:
+  """
+  Runs the tests of the class it is mixed into with the pure Python fallback.
+  """
+
+  def setUp(self):
+    self.saved_numpy = ipset.numpy
+    ipset.numpy = None
+
+
+
+  def tearDown(self):
+    ipset.numpy = self.saved_numpy
+
+
+
+class AddressTest(unittest.TestCase):
+
+  def test_ip_to_int_round_trips(self):
+    self.assertEqual(ipset.ip_to_int('10.0.0.1'), 0x0A000001)
+    self.assertEqual(ipset.ip_to_int('255.255.255.255'), 0xFFFFFFFF)
+    self.assertEqual(ipset.int_to_ip(0x0A000001), '10.0.0.1')
+    self.assertEqual(ipset.int_to_ip(0), '0.0.0.0')
+
+
+
+  def test_ip_to_int_rejects_other_forms(self):
+    for value in ['10.1', '010.0.0.1', '10.0.0.1 ', '10.0.0.256', '10.0.0.0/24', '', 'bogus']:
+      self.assertEqual(ipset.ip_to_int(value), None, value)
+
+
+
+class IPv4SetTest(unittest.TestCase):
+
+  def test_values_are_kept_as_given(self):
+    values = ['10.0.0.2', '9.0.0.1', '10.0.0.2', '10.0.0.0/24', '010.0.0.1', 'bogus']
+    s = ipset.IPv4Set(values)
+
+    self.assertEqual(len(s), 5)
+    self.assertEqual(sorted(s), sorted(set(values)))
+    #Addresses come first in numeric order, then the other values.
+    self.assertEqual([value for value in s][:2], ['9.0.0.1', '10.0.0.2'])
+
+
+
+  def test_contains(self):
+    s = ipset.IPv4Set(['10.0.0.1', '10.0.0.0/24', '010.0.0.2'])
+
+    self.assertTrue('10.0.0.1' in s)
+    self.assertTrue('10.0.0.0/24' in s)
+    self.assertTrue('010.0.0.2' in s)
+    self.assertFalse('10.0.0.2' in s)
+    self.assertFalse('10.0.0.0/25' in s)
+    self.assertFalse('10.0.0.01' in s)
+    self.assertFalse('10.0.0.1' in ipset.IPv4Set())
+
+
+
+  def test_copy(self):
+    s = ipset.IPv4Set(['10.0.0.1', 'bogus'])
+    copy = ipset.IPv4Set(s)
+    copy.others.add('other')
+
+    self.assertEqual(sorted(copy), ['10.0.0.1', 'bogus', 'other'])
+    self.assertEqual(sorted(s), ['10.0.0.1', 'bogus'])
+
+
+
+  def test_difference(self):
+    a = ipset.IPv4Set(['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.0/24', 'bogus'])
+    b = ipset.IPv4Set(['10.0.0.2', '10.0.0.9', 'bogus'])
+
+    self.assertEqual(sorted(a.difference(b)), ['10.0.0.0/24', '10.0.0.1', '10.0.0.3'])
+    self.assertEqual(sorted(a.difference(['10.0.0.1', '10.0.0.0/24'])), ['10.0.0.2', '10.0.0.3', 'bogus'])
+    self.assertEqual(sorted(a.difference([])), sorted(a))
+    self.assertEqual(len(ipset.IPv4Set().difference(a)), 0)
+
+
+
+  def test_difference_matches_python_sets(self):
+    rng = random.Random(12)
+    for i in xrange(20):
+      a = random_values(rng, rng.randint(0, 300))
+      b = random_values(rng, rng.randint(0, 300))
+      self.assertEqual(sorted(ipset.IPv4Set(a).difference(ipset.IPv4Set(b))), sorted(set(a) - set(b)))
+
+
+
+  def test_parse_in_chunks(self):
+    rng = random.Random(7)
+    values = random_values(rng, 500)
+    saved = ipset.SCAN_CHUNK_SIZE
+    ipset.SCAN_CHUNK_SIZE = 16
+    try:
+      self.assertEqual(sorted(ipset.IPv4Set(values)), sorted(set(values)))
+    finally:
+      ipset.SCAN_CHUNK_SIZE = saved
+
+
+
+class IPv4SetWithoutNumpyTest(_WithoutNumpy, IPv4SetTest):
+  pass
+
+
+
+def covered_by(block,values):
+  """
+  Returns whether every address of block is an address of one of values, by counting.
+  """
+  first, last = ipset.parse_block(block)
+  addresses = set()
+  for value in values:
+    parsed = ipset.parse_block(value)
+    if parsed != None:
+      addresses.update(xrange(max(parsed[0], first), min(parsed[1], last) + 1))
+  return len(addresses) == last - first + 1
+
+
+
+class IPv4RangesTest(unittest.TestCase):
+
+  def test_parse_block(self):
+    self.assertEqual(ipset.parse_block('10.0.0.1'), (0x0A000001, 0x0A000001))
+    self.assertEqual(ipset.parse_block('10.0.0.5/24'), (0x0A000000, 0x0A0000FF))
+    self.assertEqual(ipset.parse_block('0.0.0.0/0'), (0, 0xFFFFFFFF))
+    for value in ['10.0.0.0/33', '10.0.0.0/08', '10.0.0.0/', '10.0.0.0/x', '10.1/8', 'bogus']:
+      self.assertEqual(ipset.parse_block(value), None, value)
+
+
+
+  def test_adjacent_and_overlapping_blocks_merge(self):
+    ranges = ipset.IPv4Ranges(['10.0.0.0/25', '10.0.0.128/25', '10.0.1.0', '10.0.0.7', '10.0.5.0/24', 'bogus'])
+
+    #10.0.0.0-10.0.1.0, 10.0.5.0/24 and the string.
+    self.assertEqual(len(ranges), 3)
+    self.assertEqual(ranges.covers(['10.0.0.0/24', '10.0.0.0/23', '10.0.1.0', '10.0.1.1', '10.0.5.9', 'bogus', 'other']),
+                     [True, False, True, False, True, True, False])
+    self.assertTrue('10.0.0.200' in ranges)
+    self.assertFalse('10.0.4.255' in ranges)
+    self.assertEqual(ipset.IPv4Ranges().covers(['10.0.0.1']), [False])
+
+
+
+  def test_covers_matches_counting(self):
+    rng = random.Random(3)
+    for i in xrange(20):
+      values = random_values(rng, rng.randint(0, 200))
+      queries = [value for value in random_values(rng, 100) if ipset.parse_block(value) != None]
+      self.assertEqual(ipset.IPv4Set(values).covers(queries), [covered_by(query, values) for query in queries])
+
+
+
+  def test_set_covers_a_block_with_the_addresses_that_fill_it(self):
+    s = ipset.IPv4Set(['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.4/30'])
+    self.assertEqual(s.covers(['10.0.0.0/31', '10.0.0.0/30', '10.0.0.4', '10.0.0.0/29', '10.0.0.2']),
+                     [True, False, True, False, True])
+
+
+
+  def test_split(self):
+    s = ipset.IPv4Set(['10.0.0.0/24', '10.0.1.1', 'bogus'])
+    covered, uncovered, kept = s.split(['10.0.0.9', '10.0.2.1', '10.0.0.128/25', 'bogus', '10.0.1.0/31', 'other'])
+
+    self.assertEqual(covered, ['10.0.0.9', '10.0.0.128/25', 'bogus'])
+    self.assertEqual(uncovered, ['10.0.2.1', '10.0.1.0/31', 'other'])
+    self.assertEqual(kept.covers(['10.0.0.130', '10.0.0.9', '10.0.0.10', 'bogus']), [True, True, False, True])
+
+
+
+  def test_difference_with_ranges_removes_covered_entries(self):
+    s = ipset.IPv4Set(['10.0.0.7', '10.0.0.0/25', '10.0.0.0/23', '10.0.1.1', 'bogus', 'other'])
+    ranges = ipset.IPv4Ranges(['10.0.0.0/24', 'bogus'])
+
+    #Addresses and blocks inside 10.0.0.0/24 are removed. A larger block is not.
+    self.assertEqual(sorted(s.difference(ranges)), ['10.0.0.0/23', '10.0.1.1', 'other'])
+
+
+
+class IPv4RangesWithoutNumpyTest(_WithoutNumpy, IPv4RangesTest):
+  pass
+
+
+
+class DiffFileTest(unittest.TestCase):
+  """
+  Runs diff_file against the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', 'key', self.server.url())
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def diff(self,existing,feed):
+    self.server.store.seed('ips', existing, 'OS-Test', 'Test', {'type' : 'Address - ipv4-addr'})
+    new_set, existing_index, new_adds = os_list_update.diff_file(self.client, [line + "\n" for line in feed],
+                                                                 'OS-Test', 'Test', False)
+    return sorted(new_adds)
+
+
+
+  def test_covered_entries_are_not_added_again(self):
+    existing = ['10.0.0.0/24', '10.0.1.5', '10.0.9.9']
+    feed = ['10.0.0.0/24', '10.0.0.7', '10.0.1.5', '10.0.2.0/24', '10.0.3.1']
+    self.assertEqual(self.diff(existing, feed), ['10.0.2.0/24', '10.0.3.1'])
+
+
+
+  def test_adds_are_the_feed_entries(self):
+    #Neither the two addresses nor the block are merged or split into another form.
+    feed = ['10.0.4.0', '10.0.4.1', '10.0.4.0/31', '10.0.5.0/30']
+    self.assertEqual(self.diff(['10.0.5.1'], feed), sorted(feed))
+
+
+
+  def test_partly_covered_existing_block_does_not_stop_adds(self):
+    #10.0.6.0/24 is not fully in the feed, so it expires and does not cover 10.0.6.1.
+    self.assertEqual(self.diff(['10.0.6.0/24'], ['10.0.6.1', '10.0.6.0/25']), ['10.0.6.0/25', '10.0.6.1'])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,225 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/journal.py and the journaled sync in os_list_update.sync_os_list,
+including the resume of an interrupted sync.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import ConfigParser
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+from libs2 import journal
+import os_list_update
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+SOURCE = 'Test'
+KEY = 'ip:' + CAMPAIGN
+IP_FIELDS = {'type' : 'Address - ipv4-addr'}
+
+
+
+def removal(value,id):
+  return {'value' : value, 'id' : id, 'campaign' : '', 'source' : ''}
+
+
+
+class WriteJournalTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.journal = journal.WriteJournal(os.path.join(self.directory, 'journal.db'), max_attempts=2)
+
+
+
+  def tearDown(self):
+    self.journal.close()
+    shutil.rmtree(self.directory)
+
+
+
+  def begin(self,adds,removals,feed_version=None):
+    return self.journal.begin(KEY, 'test', CAMPAIGN, SOURCE, True, 'low', adds, removals, feed_version)
+
+
+
+  def test_pending_returns_the_sync_and_its_writes_in_order(self):
+    self.assertEqual(self.journal.pending(KEY), None)
+    self.assertEqual(self.begin(['10.0.0.1', '10.0.0.2'], [removal('10.0.0.3', 'c')], {'sha256' : 'abc'}), 3)
+
+    sync, writes = self.journal.pending(KEY)
+    self.assertEqual((sync['name'], sync['campaign'], sync['source'], sync['indicator'], sync['confidence']),
+                     ('test', CAMPAIGN, SOURCE, True, 'low'))
+    self.assertEqual(sync['feed_version'], {'sha256' : 'abc'})
+    self.assertEqual([(w['op'], w['value']) for w in writes],
+                     [('add', '10.0.0.1'), ('add', '10.0.0.2'), ('remove', '10.0.0.3')])
+    self.assertEqual(writes[2]['record'], removal('10.0.0.3', 'c'))
+
+
+
+  def test_complete_and_finish(self):
+    self.begin(['10.0.0.1', '10.0.0.2'], [])
+    self.journal.complete(KEY, [0])
+    self.assertFalse(self.journal.finish(KEY))
+    self.assertEqual([w['value'] for w in self.journal.pending(KEY)[1]], ['10.0.0.2'])
+
+    self.journal.complete(KEY, [1])
+    self.assertTrue(self.journal.finish(KEY))
+    self.assertEqual(self.journal.pending(KEY), None)
+
+
+
+  def test_failed_writes_are_given_up_after_max_attempts(self):
+    self.begin(['10.0.0.1', '10.0.0.2'], [])
+    self.assertEqual(self.journal.failed(KEY, {0 : 'error'}), [])
+    self.assertEqual(self.journal.pending(KEY)[1][0]['attempts'], 1)
+    self.assertEqual(self.journal.failed(KEY, {0 : 'error'}), [0])
+    self.assertEqual([w['value'] for w in self.journal.pending(KEY)[1]], ['10.0.0.2'])
+
+
+
+  def test_begin_replaces_and_discard_forgets(self):
+    self.begin(['10.0.0.1'], [])
+    self.begin(['10.0.0.2'], [])
+    self.assertEqual([w['value'] for w in self.journal.pending(KEY)[1]], ['10.0.0.2'])
+
+    self.journal.discard(KEY)
+    self.assertEqual(self.journal.pending(KEY), None)
+
+
+
+class JournaledSyncTest(unittest.TestCase):
+  """
+  Runs sync_os_list with a journal against the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', 'key', self.server.url())
+    self.server.store.seed('ips', ['10.0.0.1', '10.0.0.2'], CAMPAIGN, SOURCE, IP_FIELDS)
+
+    self.directory = tempfile.mkdtemp()
+    self.journal_file = os.path.join(self.directory, 'journal.db')
+
+    self.config = ConfigParser.ConfigParser()
+    self.config.add_section('General')
+    self.config.set('General', 'open_source_campaign_prefix', 'OS-')
+    self.config.set('General', 'add_campaign_if_missing', 'true')
+    self.config.add_section('Open Source Lists')
+    self.config.set('Open Source Lists', 'test_source', SOURCE)
+
+    self.args = argparse.Namespace(campaign=None, full_rescan=False, workers=None)
+    self.settings = {'campaign' : None, 'indicator' : True, 'confidence' : 'low', 'mirror_file' : "",
+                     'journal_file' : self.journal_file, 'page_fanout' : 1, 'executor' : None, 'plan' : None}
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+    shutil.rmtree(self.directory)
+
+
+
+  def sync(self,feed):
+    return os_list_update.sync_os_list(self.client, self.config, self.args, 'test',
+                                       [line + "\n" for line in feed], self.settings, False)
+
+
+
+  def campaign_ips(self):
+    store = self.server.store
+    return sorted(store.objects['ips'][i]['ip'] for i in store.members['ips'].get(CAMPAIGN, set()))
+
+
+
+  def pending(self):
+    Journal = journal.WriteJournal(self.journal_file)
+    try:
+      return Journal.pending(KEY)
+    finally:
+      Journal.close()
+
+
+
+  def interrupt(self,adds,removals):
+    """
+    Leaves writes in the journal as an interrupted run would.
+    """
+    Journal = journal.WriteJournal(self.journal_file)
+    try:
+      Journal.begin(KEY, 'test', CAMPAIGN, SOURCE, True, 'low', adds, removals)
+    finally:
+      Journal.close()
+
+
+
+  def test_sync_drains_the_journal(self):
+    result = self.sync(['10.0.0.2', '10.0.0.3'])
+
+    self.assertEqual(result['status'], 'synced')
+    self.assertEqual((result['file'], result['existing']), (2, 2))
+    self.assertEqual(self.campaign_ips(), ['10.0.0.2', '10.0.0.3'])
+    self.assertEqual(self.pending(), None)
+
+
+
+  def test_resume_sends_the_outstanding_writes_then_diffs_the_new_feed(self):
+    self.interrupt(['10.0.0.8'], [removal('10.0.0.1', self.server.store.by_value['ips']['10.0.0.1'])])
+
+    result = self.sync(['10.0.0.2', '10.0.0.4'])
+
+    #10.0.0.8 was added by the resume and then removed again by the diff of the new feed.
+    self.assertEqual(result['status'], 'synced')
+    self.assertEqual(result['existing'], 2)
+    self.assertEqual(self.campaign_ips(), ['10.0.0.2', '10.0.0.4'])
+    self.assertEqual(self.pending(), None)
+
+
+
+  def test_resume_with_failed_writes_stops_before_the_diff(self):
+    #The record does not exist, so CRITs refuses the delete.
+    self.interrupt([], [removal('10.0.0.9', 'ffffffffffffffffffffffff')])
+
+    result = self.sync(['10.0.0.2', '10.0.0.4'])
+
+    self.assertEqual(result['status'], 'resumed')
+    self.assertEqual(result['delete_failures'], 1)
+    self.assertEqual(self.campaign_ips(), ['10.0.0.1', '10.0.0.2'])
+    self.assertEqual([w['attempts'] for w in self.pending()[1]], [1])
+
+    #The write is given up after its last attempt and the new feed is synced in the same run.
+    self.assertEqual(self.sync(['10.0.0.2', '10.0.0.4'])['status'], 'resumed')
+    result = self.sync(['10.0.0.2', '10.0.0.4'])
+    self.assertEqual(result['status'], 'synced')
+    self.assertEqual(self.campaign_ips(), ['10.0.0.2', '10.0.0.4'])
+    self.assertEqual(self.pending(), None)
+
+
+
+  def test_full_rescan_discards_the_journal(self):
+    self.interrupt([], [removal('10.0.0.9', 'ffffffffffffffffffffffff')])
+    self.args.full_rescan = True
+
+    result = self.sync(['10.0.0.2'])
+    self.assertEqual(result['status'], 'synced')
+    self.assertEqual(self.campaign_ips(), ['10.0.0.2'])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
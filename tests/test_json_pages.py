@@ -0,0 +1,180 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/json_pages.py. The incremental decoding cases are skipped when ijson is not installed.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import json
+import os
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs2 import json_pages
+
+
+IP_OBJECT = {'_id' : 'a', 'ip' : '10.0.0.1', 'modified' : '2015-01-01 00:00:00',
+             'campaign' : [{'name' : 'OS-Test', 'confidence' : 'low'}, {'name' : 'Other', 'confidence' : 'high'}],
+             'source' : [{'name' : 'Test', 'instances' : [{'method' : '', 'reference' : ''}]}],
+             'status' : {'value' : 'New', 'changed' : '2015-01-01'}}
+
+PAGE = {'meta' : {'limit' : 2, 'offset' : 0, 'total_count' : 3},
+        'objects' : [IP_OBJECT, {'_id' : 'b', 'ip' : '10.0.0.2', 'campaign' : []}]}
+
+FIELDS = ['_id', 'campaign.name', 'source.name', 'modified']
+
+PROJECTED = [{'_id' : 'a', 'modified' : '2015-01-01 00:00:00',
+              'campaign' : [{'name' : 'OS-Test'}, {'name' : 'Other'}], 'source' : [{'name' : 'Test'}]},
+             {'_id' : 'b', 'campaign' : []}]
+
+
+
+def chunks(data,size):
+  return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+
+class ProjectTest(unittest.TestCase):
+
+  def test_dotted_fields_select_from_each_nested_object(self):
+    self.assertEqual(json_pages.project(IP_OBJECT, FIELDS), PROJECTED[0])
+    self.assertEqual(json_pages.project(IP_OBJECT, ['status.value', 'source.instances.method']),
+                     {'status' : {'value' : 'New'}, 'source' : [{'instances' : [{'method' : ''}]}]})
+
+
+
+  def test_a_whole_field_wins_over_its_dotted_fields(self):
+    self.assertEqual(json_pages.project(IP_OBJECT, ['campaign', 'campaign.name']),
+                     {'campaign' : IP_OBJECT['campaign']})
+
+
+
+  def test_missing_fields_are_left_out(self):
+    self.assertEqual(json_pages.project(IP_OBJECT, ['domain', 'status.reason', 'campaign.missing']),
+                     {'status' : {}, 'campaign' : [{}, {}]})
+    self.assertEqual(json_pages.project({}, FIELDS), {})
+
+
+
+  def test_no_fields_and_values_that_are_not_objects(self):
+    self.assertTrue(json_pages.project(IP_OBJECT, None) is IP_OBJECT)
+    self.assertTrue(json_pages.project(IP_OBJECT, []) is IP_OBJECT)
+    self.assertEqual(json_pages.project('10.0.0.1', FIELDS), '10.0.0.1')
+    self.assertEqual(json_pages.project({'campaign' : ['OS-Test', None]}, ['campaign.name']),
+                     {'campaign' : ['OS-Test', None]})
+
+
+
+class DecodeTest(unittest.TestCase):
+  """
+  Runs decode with whole-page decoding, whichever JSON module is installed.
+  """
+
+  def setUp(self):
+    self.streaming = json_pages.STREAMING
+    json_pages.STREAMING = False
+
+
+
+  def tearDown(self):
+    json_pages.STREAMING = self.streaming
+
+
+
+  def test_fields(self):
+    page = json_pages.decode(json.dumps(PAGE), fields=FIELDS)
+    self.assertEqual(page['objects'], PROJECTED)
+    self.assertEqual(page['meta'], PAGE['meta'])
+
+
+
+  def test_chunks_and_no_fields(self):
+    self.assertEqual(json_pages.decode(chunks(json.dumps(PAGE), 7)), PAGE)
+
+
+
+  def test_a_response_without_objects(self):
+    self.assertEqual(json_pages.decode('{"return_code": 0, "id": "a"}', fields=FIELDS), {'return_code' : 0, 'id' : 'a'})
+
+
+
+@unittest.skipIf(json_pages.ijson == None, "ijson is not installed")
+class StreamingDecodeTest(unittest.TestCase):
+  """
+  Runs decode with incremental decoding by ijson.
+  """
+
+  def setUp(self):
+    self.streaming = json_pages.STREAMING
+    json_pages.STREAMING = True
+
+
+
+  def tearDown(self):
+    json_pages.STREAMING = self.streaming
+
+
+
+  def test_fields_with_odd_chunk_sizes(self):
+    data = json.dumps(PAGE)
+    for size in [1, 2, 3, 7, 64, len(data)]:
+      page = json_pages.decode(chunks(data, size), fields=FIELDS)
+      self.assertEqual(page['objects'], PROJECTED, size)
+      self.assertEqual(page['meta'], PAGE['meta'], size)
+
+
+
+  def test_no_fields_matches_json(self):
+    data = json.dumps(PAGE)
+    self.assertEqual(json_pages.decode(data), json.loads(data))
+
+
+
+  def test_objects_that_are_not_maps(self):
+    data = json.dumps({'meta' : {}, 'objects' : ['10.0.0.1', [1, 2], {'ip' : '10.0.0.2'}]})
+    self.assertEqual(json_pages.decode(chunks(data, 5), fields=['ip'])['objects'],
+                     ['10.0.0.1', [1, 2], {'ip' : '10.0.0.2'}])
+
+
+
+  def test_a_response_without_objects(self):
+    self.assertEqual(json_pages.decode('{"return_code": 0, "id": "a"}', fields=FIELDS), {'return_code' : 0, 'id' : 'a'})
+
+
+
+class ChunkReaderTest(unittest.TestCase):
+
+  def test_reads_across_odd_chunks(self):
+    data = "".join(chr(ord('a') + i % 26) for i in xrange(100))
+    for chunk_size in [1, 3, 7, 64, 100]:
+      for read_size in [1, 2, 5, 13, 200]:
+        reader = json_pages._ChunkReader(chunks(data, chunk_size))
+        parts = []
+        while True:
+          part = reader.read(read_size)
+          if part == "":
+            break
+          self.assertTrue(len(part) <= read_size)
+          parts.append(part)
+        self.assertEqual("".join(parts), data, (chunk_size, read_size))
+        #Every read but the last is full.
+        self.assertEqual([len(part) for part in parts[:-1]], [read_size] * (len(parts) - 1))
+
+
+
+  def test_read_everything_and_empty_chunks(self):
+    reader = json_pages._ChunkReader(["ab", "", "cde", "", "f"])
+    self.assertEqual(reader.read(3), "abc")
+    self.assertEqual(reader.read(), "def")
+    self.assertEqual(reader.read(), "")
+    self.assertEqual(reader.read(4), "")
+
+
+
+if __name__ == '__main__':
+  unittest.main()
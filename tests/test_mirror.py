@@ -0,0 +1,281 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/mirror.py and the mirror refresh in os_list_update.load_campaign_index.
+
+Run from the top of the repository:
+  python -m unittest discover -s tests
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+from libs2 import mirror
+import os_list_update
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+SOURCE = 'Test'
+IP_FIELDS = {'type' : 'Address - ipv4-addr'}
+
+
+
+def ip_object(ip,id,modified,campaigns=(CAMPAIGN,),sources=(SOURCE,)):
+  return {'ip' : ip, '_id' : id, 'modified' : modified,
+          'campaign' : [{'name' : c} for c in campaigns],
+          'source' : [{'name' : s} for s in sources]}
+
+
+
+class CampaignMirrorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.mirror = mirror.CampaignMirror(os.path.join(self.directory, 'mirror.db'))
+
+
+
+  def tearDown(self):
+    self.mirror.close()
+    shutil.rmtree(self.directory)
+
+
+
+  def test_watermark_is_none_until_loaded(self):
+    self.assertEqual(self.mirror.watermark('ip', CAMPAIGN), None)
+    self.mirror.upsert('ip', CAMPAIGN, [])
+    self.assertEqual(self.mirror.watermark('ip', CAMPAIGN), "")
+
+
+
+  def test_watermark_keeps_the_newest_modified(self):
+    self.mirror.upsert('ip', CAMPAIGN, [ip_object('10.0.0.1', 'a', '2015-01-02 00:00:00'),
+                                        ip_object('10.0.0.2', 'b', '2015-01-03 00:00:00')])
+    self.assertEqual(self.mirror.watermark('ip', CAMPAIGN), '2015-01-03 00:00:00')
+
+    #An older change does not move the watermark back.
+    self.mirror.upsert('ip', CAMPAIGN, [ip_object('10.0.0.3', 'c', '2015-01-01 00:00:00')])
+    self.assertEqual(self.mirror.watermark('ip', CAMPAIGN), '2015-01-03 00:00:00')
+    self.assertEqual(self.mirror.count('ip', CAMPAIGN), 3)
+
+    #Campaigns and kinds have their own watermarks.
+    self.assertEqual(self.mirror.watermark('domain', CAMPAIGN), None)
+    self.assertEqual(self.mirror.watermark('ip', 'Other'), None)
+
+
+
+  def test_upsert_replaces_and_index_shares_names(self):
+    self.mirror.upsert('ip', CAMPAIGN, [ip_object('10.0.0.1', 'a', '2015-01-01 00:00:00'),
+                                        ip_object('10.0.0.2', 'b', '2015-01-01 00:00:00')])
+    self.mirror.upsert('ip', CAMPAIGN, [ip_object('10.0.0.1', 'a', '2015-01-02 00:00:00',
+                                                  sources=(SOURCE, 'Other'))])
+
+    index = self.mirror.index('ip', CAMPAIGN)
+    self.assertEqual(sorted(index), ['10.0.0.1', '10.0.0.2'])
+    self.assertEqual(index['10.0.0.1'], ('a', (CAMPAIGN,), (SOURCE, 'Other')))
+    self.assertEqual(index['10.0.0.2'], ('b', (CAMPAIGN,), (SOURCE,)))
+    self.assertTrue(index['10.0.0.1'][1] is index['10.0.0.2'][1])
+
+
+
+  def test_remove_and_clear(self):
+    self.mirror.upsert('ip', CAMPAIGN, [ip_object('10.0.0.1', 'a', '2015-01-01 00:00:00'),
+                                        ip_object('10.0.0.2', 'b', '2015-01-01 00:00:00')])
+    self.mirror.remove('ip', CAMPAIGN, ['10.0.0.1'])
+    self.assertEqual(sorted(self.mirror.index('ip', CAMPAIGN)), ['10.0.0.2'])
+
+    self.mirror.clear('ip', CAMPAIGN)
+    self.assertEqual(self.mirror.count('ip', CAMPAIGN), 0)
+    self.assertEqual(self.mirror.watermark('ip', CAMPAIGN), None)
+
+
+
+class SharedMirrorTest(unittest.TestCase):
+  """
+  Two list syncs writing to one mirror file at the same time, as --update_os_ip_list all does.
+  """
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'mirror.db')
+
+
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+
+
+  def test_a_slow_listing_does_not_lock_out_other_writers(self):
+    first_batch_written = threading.Event()
+    other_done = threading.Event()
+    errors = []
+
+    def slow_listing():
+      for i in xrange(1000):
+        yield ip_object('10.0.%d.%d' % (i / 256, i % 256), 'a%d' % i, '2015-01-01 00:00:00')
+      #The first batch is written when the next object is asked for, so wait after the first of the next batch.
+      yield ip_object('10.1.0.0', 'b', '2015-01-01 00:00:00')
+      first_batch_written.set()
+      other_done.wait(10)
+      yield ip_object('10.1.0.1', 'c', '2015-01-01 00:00:00')
+
+    def write(campaign,objects,timeout,before=None,after=None):
+      Mirror = mirror.CampaignMirror(self.path, timeout)
+      try:
+        if before != None:
+          before.wait(10)
+        Mirror.upsert('ip', campaign, objects)
+      except Exception as e:
+        errors.append(e)
+      finally:
+        Mirror.close()
+        if after != None:
+          after.set()
+
+    slow = threading.Thread(target=write, args=(CAMPAIGN, slow_listing(), 60))
+    #A short timeout makes the test fail quickly if the slow listing holds the lock.
+    other = threading.Thread(target=write, args=('Other', [ip_object('10.2.0.1', 'd', '2015-01-01 00:00:00')], 2,
+                                                 first_batch_written, other_done))
+    slow.start()
+    other.start()
+    slow.join(30)
+    other.join(30)
+
+    self.assertEqual(errors, [])
+    check = mirror.CampaignMirror(self.path)
+    try:
+      self.assertEqual(check.count('ip', CAMPAIGN), 1002)
+      self.assertEqual(check.count('ip', 'Other'), 1)
+    finally:
+      check.close()
+
+
+
+  def test_concurrent_upserts(self):
+    errors = []
+
+    def write(campaign):
+      Mirror = mirror.CampaignMirror(self.path)
+      try:
+        for n in xrange(5):
+          Mirror.upsert('ip', campaign, [ip_object('10.%d.%d.%d' % (n, i / 256, i % 256), campaign + str(i),
+                                                   '2015-01-01 00:00:00') for i in xrange(1500)])
+      except Exception as e:
+        errors.append(e)
+      finally:
+        Mirror.close()
+
+    threads = [threading.Thread(target=write, args=('Campaign' + str(i),)) for i in xrange(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(60)
+
+    self.assertEqual(errors, [])
+    check = mirror.CampaignMirror(self.path)
+    try:
+      self.assertEqual([check.count('ip', 'Campaign' + str(i)) for i in xrange(4)], [7500] * 4)
+    finally:
+      check.close()
+
+
+
+class MirrorRefreshTest(unittest.TestCase):
+  """
+  Runs load_campaign_index against the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', 'key', self.server.url())
+    self.directory = tempfile.mkdtemp()
+    self.mirror = mirror.CampaignMirror(os.path.join(self.directory, 'mirror.db'))
+    self.server.store.seed('ips', ['10.0.0.1', '10.0.0.2', '10.0.0.3'], CAMPAIGN, SOURCE, IP_FIELDS)
+
+
+
+  def tearDown(self):
+    self.mirror.close()
+    shutil.rmtree(self.directory)
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def load(self):
+    return os_list_update.load_campaign_index(self.client, 'ip', CAMPAIGN, "", 1, False, mirror=self.mirror)
+
+
+
+  def gets(self):
+    return self.server.requests.get('GET ips', 0)
+
+
+
+  def test_first_load_is_a_full_scan(self):
+    index = self.load()
+    self.assertEqual(sorted(index), ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+    self.assertEqual(self.mirror.count('ip', CAMPAIGN), 3)
+    self.assertNotEqual(self.mirror.watermark('ip', CAMPAIGN), None)
+
+
+
+  def test_refresh_only_requests_changes_since_the_watermark(self):
+    self.load()
+    watermark = self.mirror.watermark('ip', CAMPAIGN)
+
+    self.server.store.seed('ips', ['10.0.0.4'], CAMPAIGN, SOURCE, IP_FIELDS)
+    index = self.load()
+
+    self.assertEqual(sorted(index), ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'])
+    self.assertTrue(self.mirror.watermark('ip', CAMPAIGN) > watermark)
+
+    #The refresh asks for records modified at or after the watermark, which is 10.0.0.4
+    #and the record(s) that set the watermark, not the whole campaign.
+    changed = self.client.find_ip("", CAMPAIGN, "", "", 20, 0, meta=True, modified_since=watermark)
+    changed = [obj['ip'] for obj in changed['objects']]
+    self.assertTrue('10.0.0.4' in changed)
+    self.assertTrue(len(changed) < 4)
+
+
+
+  def test_drift_rescans_the_campaign(self):
+    self.load()
+
+    #A delete does not change any modified timestamp, so only the count check can notice it.
+    deleted = self.server.store.by_value['ips']['10.0.0.2']
+    self.server.store.delete('ips', deleted)
+    index = self.load()
+
+    self.assertEqual(sorted(index), ['10.0.0.1', '10.0.0.3'])
+    self.assertEqual(self.mirror.count('ip', CAMPAIGN), 2)
+
+
+
+  def test_no_drift_keeps_the_mirror(self):
+    self.load()
+    before = self.gets()
+    index = self.load()
+
+    self.assertEqual(sorted(index), ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+    #One page of changes since the watermark and one count request. No rescan.
+    self.assertEqual(self.gets() - before, 2)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
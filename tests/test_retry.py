@@ -0,0 +1,206 @@
+#!/usr/local/bin/python
+"""
+Tests for the retries of libs2/crits.py (_request, _retry, _never_sent and IDEMPOTENT_METHODS)
+against the fake CRITs server.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import os
+import os.path
+import socket
+import sys
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+SOURCE = 'Test'
+
+
+
+def first(count):
+  """
+  Returns a replacement for FakeCrits.should_fail or should_reset that is true for the first count requests.
+  """
+  remaining = [count]
+
+  def chance():
+    remaining[0] -= 1
+    return remaining[0] >= 0
+  return chance
+
+
+
+def closed_port():
+  """
+  Returns a local port that nothing listens on.
+  """
+  s = socket.socket()
+  s.bind(('127.0.0.1', 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+
+
+class RetryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.server.store.seed('ips', ['10.0.0.1'], CAMPAIGN, SOURCE, {'type' : 'Address - ipv4-addr'})
+    self.client = crits.crits('user', 'key', self.server.url(), retries=3, retry_backoff=0.01)
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def get(self,**kwargs):
+    return self.client._request('get', self.client.CRITs_URL + 'ips/?c-ip=10.0.0.1&username=user&api_key=key',
+                                **kwargs)
+
+
+
+  def test_idempotent_methods(self):
+    self.assertTrue('get' in crits.IDEMPOTENT_METHODS)
+    self.assertTrue('delete' in crits.IDEMPOTENT_METHODS)
+    self.assertFalse('post' in crits.IDEMPOTENT_METHODS)
+
+
+
+  def test_get_is_retried_after_a_503(self):
+    self.server.should_fail = first(2)
+    result = self.client.find_ip('10.0.0.1', CAMPAIGN)
+
+    self.assertEqual(result[0]['ip'], '10.0.0.1')
+    self.assertEqual(self.server.requests['GET ips'], 3)
+    self.assertEqual(self.client.requests_retried, 2)
+
+
+
+  def test_get_is_retried_after_a_connection_reset(self):
+    self.server.should_reset = first(1)
+    result = self.client.find_ip('10.0.0.1', CAMPAIGN)
+
+    self.assertEqual(result[0]['ip'], '10.0.0.1')
+    self.assertEqual(self.server.requests['GET ips'], 2)
+
+
+
+  def test_last_response_is_returned_when_the_retries_run_out(self):
+    self.server.error_rate = 1.0
+    r = self.get()
+
+    self.assertEqual(r.status_code, 503)
+    self.assertEqual(self.server.requests['GET ips'], 4)
+
+
+
+  def test_post_is_not_retried_after_a_503(self):
+    self.server.error_rate = 1.0
+    self.assertFalse(self.client.add_campaign('OS-New', 'New'))
+    self.assertEqual(self.server.requests['POST campaigns'], 1)
+
+
+
+  def test_post_is_not_retried_after_a_connection_reset(self):
+    #The server may have added the campaign before the connection was dropped.
+    self.server.reset_rate = 1.0
+    self.assertRaises(SystemExit, self.client.add_campaign, 'OS-New', 'New')
+    self.assertEqual(self.server.requests['POST campaigns'], 1)
+    self.assertEqual(self.client.requests_retried, 0)
+
+
+
+  def test_post_that_never_connected_is_retried(self):
+    client = crits.crits('user', 'key', 'http://127.0.0.1:' + str(closed_port()) + '/api/v1/',
+                         retries=2, retry_backoff=0.01)
+    try:
+      self.assertRaises(SystemExit, client.add_campaign, 'OS-New', 'New')
+      self.assertEqual(client.requests_sent, 3)
+      self.assertEqual(client.requests_retried, 2)
+    finally:
+      client.session.close()
+
+
+
+  def test_never_sent(self):
+    try:
+      requests.get('http://127.0.0.1:' + str(closed_port()) + '/')
+      self.fail("The request should not connect")
+    except requests.exceptions.ConnectionError as e:
+      self.assertTrue(crits._never_sent(e))
+
+    self.server.reset_rate = 1.0
+    try:
+      requests.get(self.client.CRITs_URL + 'ips/')
+      self.fail("The connection should be dropped")
+    except requests.exceptions.ConnectionError as e:
+      self.assertFalse(crits._never_sent(e))
+
+
+
+  def test_retries_stop_at_the_deadline(self):
+    self.server.error_rate = 1.0
+    self.server.latency = 0.2
+    self.client.retries = 100
+    start = time.time()
+    #The last attempt is given what is left of the deadline, so it may time out instead.
+    try:
+      self.assertEqual(self.get(deadline=0.5).status_code, 503)
+    except requests.exceptions.Timeout:
+      pass
+
+    self.assertTrue(time.time() - start < 1.0)
+    self.assertTrue(self.server.requests['GET ips'] <= 3)
+
+
+
+  def test_an_attempt_is_cut_short_by_the_deadline(self):
+    self.server.latency = 2.0
+    start = time.time()
+    self.assertRaises(requests.exceptions.Timeout, self.get, deadline=0.3)
+    self.assertTrue(time.time() - start < 1.5)
+
+
+
+  def test_retry_after_is_honored(self):
+    self.server.should_fail = first(1)
+    self.server.retry_after = 1
+    start = time.time()
+    r = self.get()
+
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(self.server.requests['GET ips'], 2)
+    self.assertTrue(time.time() - start >= 1.0)
+
+
+
+  def test_retry_after_past_the_deadline_is_not_waited_for(self):
+    self.server.error_rate = 1.0
+    self.server.retry_after = 5
+    start = time.time()
+    r = self.get(deadline=1.0)
+
+    self.assertEqual(r.status_code, 503)
+    self.assertEqual(self.server.requests['GET ips'], 1)
+    self.assertTrue(time.time() - start < 1.0)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/local/bin/python
+"""
+Tests for os_list_update.split_sections and the shared download of os_list_update.sync_os_url.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import argparse
+import BaseHTTPServer
+import ConfigParser
+import os
+import os.path
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+import os_list_update
+import fake_crits
+
+
+FEED = ("# Combined block list\n"
+        "# Section A\n"
+        "10.0.0.1\n"
+        "10.0.0.2\n"
+        "# Section B\n"
+        "10.0.1.1\n")
+
+
+
+def section_lines(sections,name):
+  if sections[name] == None:
+    return None
+  return [line for line in sections[name]]
+
+
+
+class SplitSectionsTest(unittest.TestCase):
+
+  def test_sections_are_split_at_the_markers(self):
+    sections = os_list_update.split_sections(FEED.splitlines(True), {'a' : 'Section A', 'b' : 'Section B'},
+                                             ['a', 'b', 'whole'])
+
+    self.assertEqual(section_lines(sections, 'a'), ["10.0.0.1\n", "10.0.0.2\n"])
+    self.assertEqual(section_lines(sections, 'b'), ["10.0.1.1\n"])
+    #A list without a marker gets every line, including the marker lines.
+    self.assertEqual(section_lines(sections, 'whole'), FEED.splitlines(True))
+
+
+
+  def test_markers_of_lists_not_returned_still_end_a_section(self):
+    sections = os_list_update.split_sections(FEED.splitlines(True), {'a' : 'Section A', 'b' : 'Section B'}, ['a'])
+    self.assertEqual(sorted(sections), ['a'])
+    self.assertEqual(section_lines(sections, 'a'), ["10.0.0.1\n", "10.0.0.2\n"])
+
+
+
+  def test_a_missing_marker_returns_none(self):
+    sections = os_list_update.split_sections(FEED.splitlines(True), {'a' : 'Section A', 'c' : 'Section C'}, ['a', 'c'])
+    self.assertEqual(sections['c'], None)
+    self.assertEqual(section_lines(sections, 'a'), ["10.0.0.1\n", "10.0.0.2\n", "# Section B\n", "10.0.1.1\n"])
+
+
+
+  def test_a_section_spanning_a_chunk_boundary(self):
+    #The chunks split the marker lines and the addresses.
+    for size in [1, 3, 7, 11]:
+      chunks = [FEED[i:i + size] for i in xrange(0, len(FEED), size)]
+      sections = os_list_update.split_sections(os_list_update.iter_lines(chunks),
+                                               {'a' : 'Section A', 'b' : 'Section B'}, ['a', 'b'])
+      self.assertEqual(section_lines(sections, 'a'), ["10.0.0.1\n", "10.0.0.2\n"], size)
+      self.assertEqual(section_lines(sections, 'b'), ["10.0.1.1\n"], size)
+
+
+
+  def test_large_sections_are_spooled_to_disk(self):
+    saved = os_list_update.SECTION_SPOOL_SIZE
+    os_list_update.SECTION_SPOOL_SIZE = 64
+    try:
+      lines = (["# Section A\n"] + ["10.0.%d.%d\n" % (i / 256, i % 256) for i in xrange(100)] +
+               ["# Section B\n", "10.1.0.1\n"])
+      sections = os_list_update.split_sections(lines, {'a' : 'Section A', 'b' : 'Section B'}, ['a', 'b'])
+    finally:
+      os_list_update.SECTION_SPOOL_SIZE = saved
+
+    #The section over the threshold moved to a temporary file. The small one stayed in memory.
+    self.assertTrue(sections['a']._rolled)
+    self.assertFalse(sections['b']._rolled)
+    self.assertEqual(section_lines(sections, 'a'), lines[1:101])
+    self.assertEqual(section_lines(sections, 'b'), ["10.1.0.1\n"])
+
+
+
+class _FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Serves the server's body and counts the downloads.
+  """
+
+  def log_message(self, *args):
+    pass
+
+
+
+  def do_GET(self):
+    self.server.downloads += 1
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(self.server.body)))
+    self.end_headers()
+    self.wfile.write(self.server.body)
+
+
+
+class SyncOsUrlTest(unittest.TestCase):
+  """
+  Syncs lists that share one feed against the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.feed = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _FeedHandler)
+    self.feed.body = FEED
+    self.feed.downloads = 0
+    self.url = 'http://127.0.0.1:' + str(self.feed.server_address[1]) + '/combined.txt'
+    thread = threading.Thread(target=self.feed.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', 'key', self.server.url())
+
+    self.config = ConfigParser.ConfigParser()
+    self.config.add_section('General')
+    self.config.set('General', 'open_source_campaign_prefix', 'OS-')
+    self.config.set('General', 'add_campaign_if_missing', 'true')
+    self.config.add_section('Open Source Lists')
+    for name, marker in [('a', '# Section A'), ('b', '# Section B'), ('c', '# Section C')]:
+      self.config.set('Open Source Lists', name + '_URL', self.url)
+      self.config.set('Open Source Lists', name + '_source', name.upper())
+      self.config.set('Open Source Lists', name + '_begin', marker)
+
+    self.args = argparse.Namespace(campaign=None, full_rescan=False, workers=None, force_sync=False)
+    self.settings = {'campaign' : None, 'indicator' : True, 'confidence' : 'low', 'mirror_file' : "",
+                     'journal_file' : "", 'feed_cache_dir' : None, 'page_fanout' : 1, 'executor' : None,
+                     'plan' : None}
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+    self.feed.shutdown()
+    self.feed.server_close()
+
+
+
+  def campaign_ips(self,campaign):
+    store = self.server.store
+    return sorted(store.objects['ips'][i]['ip'] for i in store.members['ips'].get(campaign, set()))
+
+
+
+  def test_lists_sharing_a_url_download_it_once(self):
+    #Small chunks split the marker lines across reads.
+    saved = os_list_update.DOWNLOAD_CHUNK_SIZE
+    os_list_update.DOWNLOAD_CHUNK_SIZE = 5
+    try:
+      results = os_list_update.sync_os_url(self.client, self.config, self.args, self.url, ['a', 'b', 'c'],
+                                           self.settings, False)
+    finally:
+      os_list_update.DOWNLOAD_CHUNK_SIZE = saved
+
+    self.assertEqual(self.feed.downloads, 1)
+    self.assertEqual([(r['name'], r['status']) for r in results], [('a', 'synced'), ('b', 'synced'), ('c', 'failed')])
+    self.assertEqual(self.campaign_ips('OS-A'), ['10.0.0.1', '10.0.0.2'])
+    self.assertEqual(self.campaign_ips('OS-B'), ['10.0.1.1'])
+    self.assertEqual(self.campaign_ips('OS-C'), [])
+
+
+
+  def test_other_sections_bound_the_synced_one(self):
+    results = os_list_update.sync_os_url(self.client, self.config, self.args, self.url, ['a'], self.settings, False)
+
+    self.assertEqual(results[0]['status'], 'synced')
+    self.assertEqual(self.campaign_ips('OS-A'), ['10.0.0.1', '10.0.0.2'])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
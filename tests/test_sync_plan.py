@@ -0,0 +1,228 @@
+#!/usr/local/bin/python
+"""
+Tests for libs2/sync_plan.py and os_list_update.execute_plan.
+"""
+
+__author__ = 'Peleus Uhley'
+__copyright__   = "Copyright 2015, Adobe System Incorporated"
+__license__ = "MIT License"
+
+
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from libs2 import crits
+from libs2 import sync_plan
+import os_list_update
+import fake_crits
+
+
+CAMPAIGN = 'OS-Test'
+SOURCE = 'Test'
+IP_FIELDS = {'type' : 'Address - ipv4-addr'}
+
+
+
+def plan_entry(adds=(),deletes=(),source_removals=(),campaign_removals=(),create_campaign=False,kind='ip'):
+  return {'adds' : list(adds), 'deletes' : list(deletes), 'source_removals' : list(source_removals),
+          'campaign_removals' : list(campaign_removals), 'create_campaign' : create_campaign, 'kind' : kind}
+
+
+
+def snapshot(*requests):
+  return {'requests' : [{'endpoint' : endpoint, 'method' : method, 'count' : count, 'seconds' : seconds}
+                        for endpoint, method, count, seconds in requests]}
+
+
+
+class SyncPlanTest(unittest.TestCase):
+
+  def test_removal_kind(self):
+    self.assertEqual(sync_plan.removal_kind({'campaign' : '', 'source' : ''}), 'delete')
+    self.assertEqual(sync_plan.removal_kind({'campaign' : '', 'source' : SOURCE}), 'source_removal')
+    self.assertEqual(sync_plan.removal_kind({'campaign' : CAMPAIGN, 'source' : SOURCE}), 'campaign_removal')
+
+
+
+  def test_add_list_sorts_the_removals(self):
+    plan = sync_plan.SyncPlan()
+    plan.add_list('test', CAMPAIGN, SOURCE, True, 'low', ['10.0.0.9'],
+                  [{'value' : '10.0.0.1', 'id' : 'a', 'campaign' : '', 'source' : ''},
+                   {'value' : '10.0.0.2', 'id' : 'b', 'campaign' : CAMPAIGN, 'source' : SOURCE},
+                   {'value' : '10.0.0.3', 'id' : 'c', 'campaign' : '', 'source' : SOURCE}])
+    entry = plan.to_dict()['lists'][0]
+
+    self.assertEqual([r['id'] for r in entry['deletes']], ['a'])
+    self.assertEqual([r['id'] for r in entry['campaign_removals']], ['b'])
+    self.assertEqual([r['id'] for r in entry['source_removals']], ['c'])
+
+
+
+  def test_count_calls(self):
+    calls = sync_plan.count_calls([plan_entry(adds=['a', 'b'], deletes=[{}],
+                                              campaign_removals=[{'source' : SOURCE}, {'source' : ''}],
+                                              create_campaign=True),
+                                   plan_entry(adds=['c'], source_removals=[{}])])
+
+    #A campaign removal that also removes a source sends a source removal first.
+    self.assertEqual(calls, {'add' : 3, 'delete' : 1, 'source_removal' : 2, 'campaign_removal' : 2, 'add_campaign' : 1})
+
+
+
+  def test_write_request(self):
+    self.assertEqual(sync_plan.write_request('add'), ('ips', 'POST'))
+    self.assertEqual(sync_plan.write_request('add', 'domain'), ('domains', 'POST'))
+    self.assertEqual(sync_plan.write_request('campaign_removal', 'domain'), ('campaigns', 'PATCH'))
+
+
+
+  def test_estimate_weights_latency_by_endpoint(self):
+    lists = [plan_entry(adds=['a'] * 10), plan_entry(adds=['d'] * 30, kind='domain')]
+    estimate = sync_plan.estimate_cost(lists, snapshot(('ips', 'POST', 2, 0.2), ('domains', 'POST', 1, 0.3),
+                                                       ('ips', 'GET', 1, 1.0)), 2)
+
+    self.assertAlmostEqual(estimate['latency']['add'], (10 * 0.1 + 30 * 0.3) / 40)
+    self.assertTrue(estimate['measured']['add'])
+    self.assertAlmostEqual(estimate['seconds'], (10 * 0.1 + 30 * 0.3) / 2)
+    self.assertEqual(estimate['total_calls'], 40)
+    self.assertEqual(estimate['workers'], 2)
+
+
+
+  def test_estimate_marks_writes_without_samples_unmeasured(self):
+    #A plan-only run lists the campaigns with GETs and sends no writes.
+    lists = [plan_entry(adds=['a'] * 10, deletes=[{}] * 2)]
+    estimate = sync_plan.estimate_cost(lists, snapshot(('ips', 'GET', 4, 2.0)), 1)
+
+    self.assertEqual(estimate['measured']['add'], False)
+    self.assertEqual(estimate['measured']['delete'], False)
+    self.assertAlmostEqual(estimate['latency']['add'], 0.5)
+    self.assertAlmostEqual(estimate['seconds'], 6.0)
+
+    summary = sync_plan.summary({'lists' : [], 'estimate' : estimate})
+    self.assertTrue("about 6 seconds with 1 workers" in summary)
+    self.assertTrue("Not measured (estimated from the mean latency of the reads): add, delete" in summary)
+
+
+
+  def test_estimate_without_samples_has_no_time(self):
+    estimate = sync_plan.estimate_cost([plan_entry(adds=['a'])], snapshot(), 4)
+    self.assertEqual(estimate['seconds'], None)
+    self.assertFalse("Not measured" in sync_plan.summary({'lists' : [], 'estimate' : estimate}))
+
+
+
+  def test_write_and_load(self):
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, 'plan.json')
+      plan = sync_plan.SyncPlan()
+      plan.add_list('test', CAMPAIGN, SOURCE, True, 'low', ['10.0.0.9'], [], file_count=1)
+      plan.write(path, sync_plan.estimate_cost(plan.lists, snapshot(), 1))
+
+      loaded = sync_plan.load(path)
+      self.assertEqual(loaded['lists'][0]['adds'], ['10.0.0.9'])
+      self.assertEqual(loaded['estimate']['total_calls'], 1)
+
+      with open(path, 'w') as f:
+        json.dump({'version' : sync_plan.PLAN_VERSION + 1, 'lists' : []}, f)
+      self.assertRaises(ValueError, sync_plan.load, path)
+    finally:
+      shutil.rmtree(directory)
+
+
+
+class ExecutePlanTest(unittest.TestCase):
+  """
+  Plans a sync and then executes it against the fake CRITs server.
+  """
+
+  def setUp(self):
+    self.server = fake_crits.FakeCrits().start()
+    self.client = crits.crits('user', 'key', self.server.url(), pool_maxsize=4)
+    store = self.server.store
+    store.seed('ips', ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'], CAMPAIGN, SOURCE, IP_FIELDS)
+    store.seed('ips', ['10.0.0.2'], 'Other', SOURCE, IP_FIELDS)
+    store.seed('ips', ['10.0.0.3'], CAMPAIGN, 'Other', IP_FIELDS)
+
+
+
+  def tearDown(self):
+    self.client.session.close()
+    self.server.stop()
+
+
+
+  def record(self,ip):
+    store = self.server.store
+    if ip not in store.by_value['ips']:
+      return None
+    return store.objects['ips'][store.by_value['ips'][ip]]
+
+
+
+  def make_plan(self,feed,campaign=CAMPAIGN,create_campaign=False):
+    new_set, existing_index, new_adds = os_list_update.diff_file(self.client, [line + "\n" for line in feed],
+                                                                 campaign, SOURCE, False)
+    removals = os_list_update.plan_removals(campaign, SOURCE, new_set, existing_index, False)
+    plan = sync_plan.SyncPlan()
+    plan.add_list('test', campaign, SOURCE, True, 'low', new_adds, removals, create_campaign,
+                  len(new_set), len(existing_index))
+    return plan
+
+
+
+  def test_planning_writes_nothing(self):
+    self.make_plan(['10.0.0.4', '10.0.0.9'])
+    self.assertEqual([key for key in self.server.requests if not key.startswith('GET')], [])
+
+
+
+  def test_execute(self):
+    plan = self.make_plan(['10.0.0.4', '10.0.0.9'])
+    entry = plan.to_dict()['lists'][0]
+    self.assertEqual(entry['adds'], ['10.0.0.9'])
+    self.assertEqual([r['value'] for r in entry['deletes']], ['10.0.0.1'])
+    self.assertEqual([r['value'] for r in entry['campaign_removals']], ['10.0.0.2'])
+    self.assertEqual([r['value'] for r in entry['source_removals']], ['10.0.0.3'])
+
+    results = os_list_update.execute_plan(self.client, plan.to_dict(), None, "", False)
+
+    self.assertEqual(results[0]['status'], 'synced')
+    self.assertEqual(self.record('10.0.0.1'), None)
+    self.assertEqual([c['name'] for c in self.record('10.0.0.2')['campaign']], ['Other'])
+    self.assertEqual([s['name'] for s in self.record('10.0.0.3')['source']], ['Other'])
+    self.assertEqual([c['name'] for c in self.record('10.0.0.9')['campaign']], [CAMPAIGN])
+
+    #The plan is now in sync, so planning again finds nothing to do.
+    entry = self.make_plan(['10.0.0.4', '10.0.0.9']).to_dict()['lists'][0]
+    self.assertEqual((entry['adds'], entry['deletes'], entry['source_removals'], entry['campaign_removals']),
+                     ([], [], [], []))
+
+
+
+  def test_execute_adds_a_missing_campaign(self):
+    plan = self.make_plan(['10.0.1.1'], 'OS-New', True)
+    results = os_list_update.execute_plan(self.client, plan.to_dict(), None, "", False)
+
+    self.assertEqual(results[0]['status'], 'synced')
+    self.assertNotEqual(self.client.get_campaign_id('OS-New'), None)
+    self.assertEqual([c['name'] for c in self.record('10.0.1.1')['campaign']], ['OS-New'])
+
+
+
+  def test_plan_and_execute_use_the_same_workers(self):
+    self.assertEqual(os_list_update.plan_workers(self.client, None), 4)
+    self.assertEqual(os_list_update.plan_workers(self.client, 2), 2)
+
+
+
+if __name__ == '__main__':
+  unittest.main()